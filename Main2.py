@@ -20,7 +20,8 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'Scripts'))
 
 # Import custom functions
 from extractPDF import extract_text
-from embed_texts import embed_text, save_embeddings
+from embed_texts import save_embeddings
+from Scripts.utils import embed_text
 from create_index import create_faiss_index
 
 # Define paths using os.path.join
@@ -5,6 +5,10 @@ Created on Fri Jan 24 16:51:16 2025
 @author: akome
 """
 
+# Retired: edits to documents.pkl are ignored once a snapshot exists (main.py
+# serves the current snapshot). Merge chunks with a "merge" operation in
+# Scripts/chunk_edits.json and run `python Scripts/chunk_journal.py apply`.
+
 import pickle
 
 # Load the documents.pkl file
@@ -0,0 +1,178 @@
+# Scripts/answer_cache.py
+#
+# Semantic cache of generated answers, in front of generate_response. Users
+# ask the same few dozen questions in slightly different words; a question
+# whose embedding is within ANSWER_CACHE_THRESHOLD cosine similarity of a
+# previously answered one gets that answer back without a retrieval or an
+# LLM call.
+#
+# Embeddings of the cached questions are rows of one normalized matrix, so
+# a lookup is a single matrix-vector product. A match also needs the same
+# variant (e.g. enhanced or not) and the same numbers in the question, since
+# "eGFR below 30" and "eGFR below 45" embed almost identically but are not
+# the same question. Every entry belongs to a corpus version (snapshot id
+# plus live edits); when the version changes the whole cache is dropped.
+# Follow-up questions ("what about in children?") are not cached, since
+# their answer depends on the conversation before them.
+
+import re
+import copy
+import time
+import logging
+import threading
+
+import numpy as np
+
+from Scripts.utils import normalize_query
+
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 24 * 60 * 60  # Seconds
+ANSWER_CACHE_THRESHOLD = 0.95    # Cosine similarity of all-mpnet-base-v2 query embeddings
+
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+# Words that refer back to an earlier turn, and openings that continue one
+REFERRING_WORDS = frozenset({
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "he", "him", "his", "she", "her", "same", "above", "previous", "mentioned",
+    "else", "also", "too", "again", "instead",
+})
+CONTINUATION_OPENINGS = ("and ", "but ", "or ", "so ", "what about ", "how about ", "what if ")
+
+def depends_on_history(query):
+    """
+    Whether a question looks like a follow-up that only makes sense after
+    the turns before it. Errs towards True: a standalone question flagged as
+    a follow-up only misses the cache.
+    """
+    query = normalize_query(query)
+    if query.startswith(CONTINUATION_OPENINGS):
+        return True
+    return not REFERRING_WORDS.isdisjoint(re.findall(r"[a-z]+", query))
+
+class SemanticAnswerCache:
+    """
+    Thread-safe nearest-neighbour cache of answers, bounded by size, with expiry.
+
+    Args:
+        max_size (int): Entries kept before the least recently used is evicted.
+        ttl (float, optional): Seconds an entry stays valid. None disables expiry.
+        threshold (float): Minimum cosine similarity for a hit.
+    """
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None
+        self._vectors = None                         # (max_size, dimension) float32, allocated on first put
+        self._valid = np.zeros(max_size, dtype=bool)
+        self._stored_at = np.zeros(max_size)
+        self._last_used = np.zeros(max_size)
+        self._entries = [None] * max_size            # slot -> (variant, numbers, query, answer)
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._valid.any():
+                self.invalidations += 1
+                logging.info(f"Corpus changed ({self._version} -> {version}); dropped {int(self._valid.sum())} cached answers")
+            self._valid[:] = False
+            self._entries = [None] * self.max_size
+            self._version = version
+
+    def _expire(self, now):
+        if self.ttl is None:
+            return
+        expired = self._valid & (now - self._stored_at > self.ttl)
+        if expired.any():
+            self._valid &= ~expired
+            self.evictions += int(expired.sum())
+            for slot in np.flatnonzero(expired):
+                self._entries[slot] = None
+
+    def get(self, embedding, version, query, variant=None):
+        """
+        Answer of the most similar cached question, or None.
+
+        Args:
+            embedding (np.ndarray): Normalized query embedding, (dimension,) or (1, dimension).
+            version: Corpus version the answer must come from (e.g. the snapshot id).
+            query (str): The question, for the number check.
+            variant (optional): Anything else the answer depends on, e.g. the enhance flag.
+
+        Returns:
+            A copy of the cached answer, or None on a miss.
+        """
+        numbers = frozenset(NUMBER_PATTERN.findall(normalize_query(query)))
+        with self._lock:
+            self._check_version(version)
+            now = time.monotonic()
+            self._expire(now)
+            candidates = np.flatnonzero(self._valid)
+            candidates = [
+                slot for slot in candidates
+                if self._entries[slot][0] == variant and self._entries[slot][1] == numbers
+            ]
+            if candidates:
+                similarities = self._vectors[candidates] @ np.ravel(embedding)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    slot = candidates[best]
+                    self._last_used[slot] = now
+                    self.hits += 1
+                    logging.debug(
+                        f"Answer cache hit ({similarities[best]:.3f}): {query!r} ~ {self._entries[slot][2]!r}"
+                    )
+                    return copy.deepcopy(self._entries[slot][3])
+            self.misses += 1
+            return None
+
+    def put(self, embedding, version, query, answer, variant=None):
+        """
+        Cache the answer to a question; see get for the arguments.
+        """
+        if self.max_size <= 0:
+            return
+        embedding = np.ravel(embedding).astype(np.float32)
+        numbers = frozenset(NUMBER_PATTERN.findall(normalize_query(query)))
+        with self._lock:
+            self._check_version(version)
+            now = time.monotonic()
+            self._expire(now)
+            if self._vectors is None or self._vectors.shape[1] != embedding.shape[0]:
+                self._vectors = np.zeros((self.max_size, embedding.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+            free = np.flatnonzero(~self._valid)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._vectors[slot] = embedding
+            self._valid[slot] = True
+            self._stored_at[slot] = now
+            self._last_used[slot] = now
+            self._entries[slot] = (variant, numbers, query, copy.deepcopy(answer))
+
+    def clear(self):
+        with self._lock:
+            self._valid[:] = False
+            self._entries = [None] * self.max_size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": int(self._valid.sum()),
+                "max_size": self.max_size,
+            }
@@ -0,0 +1,83 @@
+# Scripts/bench_batch.py
+#
+# Query throughput of retrieve_documents_batch against a loop over
+# retrieve_documents, on the current snapshot. The questions in
+# retrieval_eval.json are varied and repeated up to each batch size; the
+# query cache is disabled so every query is embedded.
+#
+#   python Scripts/bench_batch.py [--batch-sizes 1 8 32 128] [--k 3] [--output bench_batch.json]
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts import utils
+from Scripts.snapshot import SNAPSHOTS_DIRNAME, load_snapshot
+from Scripts.lexical_index import build_lexical_index
+from Scripts.bench_retrieval import EVAL_SET_PATH, load_eval_set
+
+DEFAULT_SNAPSHOTS_DIR = os.path.join(os.environ.get("ESUR_ARTIFACTS_DIR", SCRIPTS_DIR), SNAPSHOTS_DIRNAME)
+
+def make_queries(questions, count):
+    # Distinct strings, so neither cache can serve repeats
+    return [f"{questions[pos % len(questions)]} ({pos})" for pos in range(count)]
+
+def queries_per_second(func, queries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(queries)
+    return len(queries) * repeat / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batched against per-query retrieval.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per batch size.")
+    parser.add_argument("--dense-only", action="store_true", help="Leave out the lexical fusion.")
+    parser.add_argument("--snapshots-dir", default=DEFAULT_SNAPSHOTS_DIR)
+    parser.add_argument("--eval-set", default=EVAL_SET_PATH)
+    parser.add_argument("--output", help="Also write the results as JSON to this path.")
+    args = parser.parse_args()
+
+    utils.setup_logging(logging.WARNING)
+    snapshot = load_snapshot(args.snapshots_dir, model_name=utils.embedding_model_id())
+    if snapshot is None:
+        parser.error(f"No snapshot in {args.snapshots_dir}; run main.py or ingest_corpus.py first")
+    utils.set_documents(snapshot.store)
+    utils.set_index(snapshot.index, snapshot.manifest["index"])
+    if not args.dense_only:
+        utils.set_lexical_index(build_lexical_index(snapshot.store))
+    utils.set_embedding_cache(None)
+    utils.configure_query_cache(max_size=0)
+    utils.warm_up_embedding_model()
+    questions = [item["question"] for item in load_eval_set(args.eval_set)]
+
+    def loop(queries):
+        for query in queries:
+            utils.retrieve_documents(query, k=args.k, return_details=True)
+
+    def batch(queries):
+        utils.retrieve_documents_batch(queries, k=args.k)
+
+    results = {"snapshot_id": snapshot.snapshot_id, "k": args.k, "hybrid": not args.dense_only, "runs": []}
+    print(f"  {'batch':>6} {'loop q/s':>10} {'batch q/s':>10} {'speedup':>8}")
+    for size in args.batch_sizes:
+        queries = make_queries(questions, size)
+        run = {
+            "batch_size": size,
+            "loop_qps": queries_per_second(loop, queries, args.repeat),
+            "batch_qps": queries_per_second(batch, queries, args.repeat),
+        }
+        run["speedup"] = run["batch_qps"] / run["loop_qps"]
+        results["runs"].append(run)
+        print(f"  {size:>6} {run['loop_qps']:>10.1f} {run['batch_qps']:>10.1f} {run['speedup']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,99 @@
+# Scripts/bench_chunking.py
+#
+# Micro-benchmark of the headline splitter against the previous two-pass
+# implementation (re.split + re.findall), on extracted_text.txt replicated
+# to larger corpus sizes:
+#
+#   python Scripts/bench_chunking.py [--scales 1 10 50] [--repeat 5]
+
+import os
+import re
+import sys
+import time
+import argparse
+import tracemalloc
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.utils import split_text_by_headlines, iter_headline_chunks
+
+TEXT_PATH = os.path.join(SCRIPTS_DIR, "extracted_text.txt")
+
+def split_text_by_headlines_two_pass(text):
+    """
+    The previous implementation, kept here as the benchmark baseline.
+    """
+    headline_pattern = re.compile(r"""
+        (?:
+            ^[A-Z][A-Z\s\d\.\-:,]{2,}$      # Lines in uppercase (with possible numbers, dots, hyphens, colons)
+            |
+            ^(?:\d+\.)+\s.*$                # Lines starting with numbering like '1.', '1.1.', '2.3.1'
+        )
+        """, re.MULTILINE | re.VERBOSE)
+
+    splits = re.split(headline_pattern, text)
+    headlines = re.findall(headline_pattern, text)
+
+    sections = []
+    for idx, headline in enumerate(headlines):
+        if idx < len(splits):
+            content = splits[idx + 1].strip() if idx + 1 < len(splits) else ''
+            headline = headline.strip()
+            if content:
+                section = f"{headline}\n{content}"
+            else:
+                section = headline
+            sections.append(section)
+
+    remaining_content = splits[len(headlines) + 1:] if len(splits) > len(headlines) + 1 else []
+    for content in remaining_content:
+        content = content.strip()
+        if content:
+            sections.append(content)
+
+    return sections
+
+def measure(func, text, repeat):
+    """
+    Best wall time over `repeat` runs, and peak traced memory of one run.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the headline splitter.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 50],
+                        help="How many copies of extracted_text.txt to chunk.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per measurement.")
+    args = parser.parse_args()
+
+    with open(TEXT_PATH, "r", encoding="utf-8") as f:
+        base_text = f.read()
+
+    candidates = [
+        ("two-pass split+findall", split_text_by_headlines_two_pass),
+        ("single-pass, strings", split_text_by_headlines),
+        ("single-pass, offsets", lambda text: list(iter_headline_chunks(text))),
+    ]
+
+    for scale in args.scales:
+        text = "\n\n".join([base_text] * scale)
+        assert split_text_by_headlines(text) == split_text_by_headlines_two_pass(text)
+
+        print(f"\n{scale}x corpus: {len(text) / 1e6:.1f} MB")
+        baseline = None
+        for name, func in candidates:
+            seconds, peak = measure(func, text, args.repeat)
+            baseline = baseline or seconds
+            print(f"  {name:<24} {seconds * 1000:9.1f} ms  {baseline / seconds:5.2f}x  "
+                  f"peak {peak / 1e6:7.1f} MB")
@@ -0,0 +1,63 @@
+# Scripts/bench_embedding.py
+#
+# Corpus embedding throughput on the current chunks (documents.pkl):
+# the plain embed_text(doc_chunks) call against embed_corpus at several
+# batch sizes, and against the multi-process pool at several worker counts.
+# Run it on the ingestion host, CPU only:
+#
+#   python Scripts/bench_embedding.py [--batch-sizes 8 16 32 64] [--workers 2 4 8]
+
+import os
+import sys
+import time
+import pickle
+import logging
+import argparse
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.utils import embed_text, embed_corpus, warm_up_embedding_model
+
+DOCUMENTS_PATH = os.path.join(SCRIPTS_DIR, "documents.pkl")
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark corpus embedding throughput.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--workers", type=int, nargs="*", default=[],
+                        help="Worker counts to benchmark the process pool with.")
+    parser.add_argument("--replicate", type=int, default=1,
+                        help="Repeat the chunks to emulate a larger corpus.")
+    parser.add_argument("--documents", default=DOCUMENTS_PATH, help="Pickled list of chunk strings.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with open(args.documents, "rb") as f:
+        doc_chunks = pickle.load(f) * args.replicate
+
+    # Keep model loading out of the measurements
+    warm_up_embedding_model()
+
+    baseline, baseline_seconds = timed(embed_text, doc_chunks)
+    print(f"{len(doc_chunks)} chunks")
+    print(f"  {'embed_text (current)':<28} {len(doc_chunks) / baseline_seconds:8.1f} chunks/s")
+
+    for batch_size in args.batch_sizes:
+        embeddings, seconds = timed(embed_corpus, doc_chunks, batch_size=batch_size, show_progress=False)
+        max_diff = float(np.abs(embeddings - baseline).max())
+        print(f"  {'embed_corpus batch=' + str(batch_size):<28} {len(doc_chunks) / seconds:8.1f} chunks/s  "
+              f"{baseline_seconds / seconds:5.2f}x  max |diff| {max_diff:.1e}")
+
+    # Pool start-up (spawning workers, loading the model in each) is included
+    for workers in args.workers:
+        embeddings, seconds = timed(embed_corpus, doc_chunks, show_progress=False, workers=workers)
+        max_diff = float(np.abs(embeddings - baseline).max())
+        print(f"  {'embed_corpus workers=' + str(workers):<28} {len(doc_chunks) / seconds:8.1f} chunks/s  "
+              f"{baseline_seconds / seconds:5.2f}x  max |diff| {max_diff:.1e}")
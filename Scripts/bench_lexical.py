@@ -0,0 +1,119 @@
+# Scripts/bench_lexical.py
+#
+# Hybrid (BM25 + dense) against dense-only retrieval on the current
+# snapshot, using the labeled questions in retrieval_eval.json:
+#
+#   - hit@k of dense-only and of the fused ranking
+#   - latency of the lexical lookup alone, of the FAISS search alone and of
+#     the whole hybrid step (both searches plus fusion); query embedding is
+#     done once up front and left out, as it is the same for both
+#
+#   python Scripts/bench_lexical.py [--k 3] [--repeat 200] [--fusion rrf|weighted]
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.utils import embed_text, embedding_model_id, setup_logging, HYBRID_CANDIDATES, LEXICAL_WEIGHT
+from Scripts.snapshot import SNAPSHOTS_DIRNAME, load_snapshot
+from Scripts.lexical_index import LexicalIndex, fuse_rankings
+from Scripts.bench_retrieval import EVAL_SET_PATH, load_eval_set, relevant_chunks
+
+DEFAULT_SNAPSHOTS_DIR = os.path.join(os.environ.get("ESUR_ARTIFACTS_DIR", SCRIPTS_DIR), SNAPSHOTS_DIRNAME)
+
+def percentiles_ms(latencies):
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+def time_each(func, items, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hybrid BM25 + dense retrieval against dense-only.")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--candidates", type=int, default=HYBRID_CANDIDATES)
+    parser.add_argument("--fusion", choices=["rrf", "weighted"], default="rrf")
+    parser.add_argument("--repeat", type=int, default=200, help="Timed passes over the questions.")
+    parser.add_argument("--snapshots-dir", default=DEFAULT_SNAPSHOTS_DIR)
+    parser.add_argument("--eval-set", default=EVAL_SET_PATH)
+    parser.add_argument("--output", help="Also write the results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup_logging(logging.WARNING)
+    snapshot = load_snapshot(args.snapshots_dir, model_name=embedding_model_id())
+    if snapshot is None:
+        parser.error(f"No snapshot in {args.snapshots_dir}; run main.py or ingest_corpus.py first")
+    store, index = snapshot.store, snapshot.index
+    eval_set = load_eval_set(args.eval_set)
+    questions = [item["question"] for item in eval_set]
+
+    start = time.perf_counter()
+    lexical_index = LexicalIndex.build(store.ids(), store.texts())
+    build_seconds = time.perf_counter() - start
+
+    query_embeddings = embed_text(questions)
+    rows = list(range(len(questions)))
+    candidates = max(args.k, args.candidates)
+
+    def dense(row, count=args.k):
+        D, I = index.search(query_embeddings[row:row + 1], count)
+        keep = I[0] >= 0
+        return I[0][keep].tolist(), D[0][keep].tolist()
+
+    def hybrid(row):
+        dense_ids, dense_scores = dense(row, candidates)
+        lexical_ids, lexical_scores = lexical_index.search(questions[row], candidates)
+        return fuse_rankings(dense_ids, dense_scores, lexical_ids, lexical_scores,
+                             args.k, args.fusion, LEXICAL_WEIGHT)[0]
+
+    # Relevant chunk ids per question, for hit@k
+    chunk_ids = store.ids()
+    relevant = [
+        {chunk_ids[pos] for pos in relevant_chunks(store.texts(), item["expected"])}
+        for item in eval_set
+    ]
+    dense_hits = [bool(set(dense(row)[0]) & relevant[row]) for row in rows]
+    hybrid_hits = [bool(set(hybrid(row)) & relevant[row]) for row in rows]
+
+    results = {
+        "snapshot_id": snapshot.snapshot_id,
+        "chunks": len(store),
+        "terms": len(lexical_index.vocabulary),
+        "postings": int(len(lexical_index.rows)),
+        "lexical_build_seconds": build_seconds,
+        "k": args.k,
+        "candidates": candidates,
+        "fusion": args.fusion,
+        f"dense_hit@{args.k}": float(np.mean(dense_hits)),
+        f"hybrid_hit@{args.k}": float(np.mean(hybrid_hits)),
+        "lexical_search": percentiles_ms(time_each(lambda row: lexical_index.search(questions[row], candidates),
+                                                   rows, args.repeat)),
+        "dense_search": percentiles_ms(time_each(dense, rows, args.repeat)),
+        "hybrid_search": percentiles_ms(time_each(hybrid, rows, args.repeat)),
+    }
+
+    print(f"{results['chunks']} chunks, {results['terms']} terms, lexical build {build_seconds * 1000:.1f} ms")
+    print(f"  hit@{args.k}: dense {results[f'dense_hit@{args.k}']:.3f}  "
+          f"hybrid ({args.fusion}) {results[f'hybrid_hit@{args.k}']:.3f}")
+    for name in ("lexical_search", "dense_search", "hybrid_search"):
+        timings = results[name]
+        print(f"  {name:<15} p50 {timings['p50_ms']:.3f} ms  p95 {timings['p95_ms']:.3f} ms  "
+              f"p99 {timings['p99_ms']:.3f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
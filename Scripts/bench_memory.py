@@ -0,0 +1,155 @@
+# Scripts/bench_memory.py
+#
+# Per-worker memory of serve_workers.py on a large synthetic snapshot, for
+# each way of loading the index:
+#
+#   copy      every worker reads its own copy of the index
+#   mmap      every worker memory-maps index.faiss (--index-io mmap)
+#   preload   the parent loads the index and forks the workers (--preload)
+#
+# RSS counts shared pages in every process that touches them, so it looks
+# the same whether or not the index is shared. PSS splits each shared page
+# between the processes sharing it; the PSS summed over the workers is
+# what the server really costs. Both come from /proc/<pid>/smaps_rollup
+# (Linux). The embedding model is not loaded (--probe-only), so the numbers
+# are the index and chunk store alone.
+#
+#   python Scripts/bench_memory.py --vectors 1000000 --workers 1 4 16 --output bench_memory.json
+#
+# The synthetic snapshot is written once to --work-dir and reused.
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.utils import setup_logging
+from Scripts.chunk_store import ChunkStore
+from Scripts.embedding_store import load_embedding_matrix, as_float32
+from Scripts.index_builder import build_index
+from Scripts.snapshot import current_snapshot_id, write_snapshot
+from Scripts.bench_retrieval import synthesize_corpus, EMBEDDINGS_PATH
+
+MODES = {
+    "copy": ["--index-io", "copy"],
+    "mmap": ["--index-io", "mmap"],
+    "preload": ["--index-io", "copy", "--preload"],
+}
+
+def build_synthetic_snapshot(snapshots_dir, base_embeddings, vectors, policy):
+    if current_snapshot_id(snapshots_dir) is not None:
+        logging.info(f"Reusing synthetic snapshot in {snapshots_dir}")
+        return
+    embeddings = synthesize_corpus(base_embeddings, vectors)
+    ids = list(range(1, vectors + 1))
+    store = ChunkStore(ids, [f"synthetic chunk {cid}" for cid in ids])
+    index, params = build_index(embeddings, policy, ids=ids)
+    write_snapshot(snapshots_dir, store, embeddings, index, params, "synthetic")
+
+def smaps_rollup(pid):
+    """
+    Memory of one process in MB, from /proc/<pid>/smaps_rollup.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "private_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+        "shared_mb": fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0),
+    }
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+        return [int(child) for child in f.read().split()]
+
+def get_json(url, timeout=60):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def measure(snapshots_dir, workers, mode, port, probes_per_worker=8):
+    command = [
+        sys.executable, os.path.join(SCRIPTS_DIR, "serve_workers.py"),
+        "--workers", str(workers), "--port", str(port),
+        "--snapshots-dir", snapshots_dir, "--probe-only", *MODES[mode],
+    ]
+    server = subprocess.Popen(command)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 600
+        while True:
+            try:
+                get_json(f"{base_url}/health", timeout=5)
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"serve_workers.py did not come up ({mode}, {workers} workers)")
+                time.sleep(0.5)
+
+        # Every search scans the index, faulting its pages into whichever worker serves it
+        served = set()
+        for _ in range(workers * probes_per_worker):
+            served.add(get_json(f"{base_url}/probe?n=4")["pid"])
+
+        pids = child_pids(server.pid)
+        per_worker = [smaps_rollup(pid) for pid in pids]
+        return {
+            "workers": len(pids),
+            "workers_probed": len(served),
+            "rss_mb_mean": float(np.mean([m["rss_mb"] for m in per_worker])),
+            "pss_mb_mean": float(np.mean([m["pss_mb"] for m in per_worker])),
+            "private_mb_mean": float(np.mean([m["private_mb"] for m in per_worker])),
+            "pss_mb_total": float(np.sum([m["pss_mb"] for m in per_worker])),
+            "parent_pss_mb": smaps_rollup(server.pid)["pss_mb"],
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-worker memory of the retrieval server.")
+    parser.add_argument("--vectors", type=int, default=1_000_000, help="Synthetic corpus size.")
+    parser.add_argument("--index", default="flat", help="Index policy for the synthetic snapshot.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--embeddings", default=EMBEDDINGS_PATH, help="Real embeddings the corpus is grown from.")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "esur_bench_memory"))
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--output", help="Also write the results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    snapshots_dir = os.path.join(args.work_dir, f"{args.index}-{args.vectors}")
+    build_synthetic_snapshot(snapshots_dir, as_float32(load_embedding_matrix(args.embeddings)),
+                             args.vectors, args.index)
+    index_mb = os.path.getsize(
+        os.path.join(snapshots_dir, current_snapshot_id(snapshots_dir), "index.faiss")) / 2**20
+
+    results = {"vectors": args.vectors, "index": args.index, "index_file_mb": index_mb, "runs": []}
+    print(f"{args.vectors} vectors, {args.index} index ({index_mb:.0f} MB on disk)")
+    print(f"  {'mode':<8} {'workers':>7} {'RSS/worker':>11} {'PSS/worker':>11} {'private/worker':>15} {'PSS total':>10}")
+    for mode in args.modes:
+        for workers in args.workers:
+            run = {"mode": mode, **measure(snapshots_dir, workers, mode, args.port)}
+            results["runs"].append(run)
+            print(f"  {mode:<8} {workers:>7} {run['rss_mb_mean']:>8.0f} MB {run['pss_mb_mean']:>8.0f} MB "
+                  f"{run['private_mb_mean']:>12.0f} MB {run['pss_mb_total']:>7.0f} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,228 @@
+# Scripts/bench_retrieval.py
+#
+# Retrieval quality and speed per index configuration (see index_builder):
+#
+#   labeled    the ESUR questions in retrieval_eval.json, whose answers are
+#              identified by substrings of the relevant chunk; reports hit@k
+#              over the real chunks and recall@k against exact search
+#   synthetic  the real chunk embeddings replicated with noise up to each
+#              scale (e.g. 10k/100k/1M vectors), queried with perturbed
+#              chunks; reports recall@k against exact IndexFlatIP search
+#
+# Every configuration also reports single-query p50/p95/p99 latency and the
+# QPS of one batched search. Results are printed and written as JSON so runs
+# can be compared across commits:
+#
+#   python Scripts/bench_retrieval.py [--scales 10000 100000 1000000] [--configs flat ivf-flat hnsw]
+#                                     [--k 10] [--output bench_retrieval.json]
+
+import os
+import sys
+import json
+import time
+import pickle
+import logging
+import argparse
+import subprocess
+
+import faiss
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.utils import embed_text, setup_logging
+from Scripts.embedding_store import load_embedding_matrix, as_float32
+from Scripts.index_builder import build_index
+
+ARTIFACTS_DIR = os.environ.get("ESUR_ARTIFACTS_DIR", SCRIPTS_DIR)
+DOCUMENTS_PATH = os.path.join(ARTIFACTS_DIR, "documents.pkl")
+EMBEDDINGS_PATH = os.path.join(ARTIFACTS_DIR, "document_embeddings.npy")
+EVAL_SET_PATH = os.path.join(SCRIPTS_DIR, "retrieval_eval.json")
+
+DEFAULT_CONFIGS = ["flat", "ivf-flat", "ivf-pq", "hnsw"]
+
+# Vectors generated per step when building a synthetic corpus
+SYNTHETIC_BLOCK = 100_000
+
+def load_eval_set(path=EVAL_SET_PATH):
+    """
+    Load the labeled questions: [{"question": str, "expected": [substring, ...]}].
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def relevant_chunks(documents, expected):
+    """
+    Positions of the chunks containing any expected substring (whitespace-insensitive).
+    """
+    targets = [" ".join(text.split()) for text in expected]
+    return {
+        pos for pos, chunk in enumerate(documents)
+        if any(target in " ".join(chunk.split()) for target in targets)
+    }
+
+def normalize_rows(matrix):
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+def perturbed_rows(base, count, noise, rng):
+    """
+    Rows sampled from base with Gaussian noise of relative norm `noise`, renormalized.
+    """
+    rows = base[rng.integers(0, len(base), size=count)]
+    jitter = rng.standard_normal(rows.shape, dtype=np.float32) * (noise / np.sqrt(base.shape[1]))
+    return normalize_rows(rows + jitter).astype(np.float32)
+
+def synthesize_corpus(base, size, noise=0.25, seed=0):
+    """
+    Grow the chunk embeddings to `size` vectors by replicating them with noise.
+    """
+    rng = np.random.default_rng(seed)
+    corpus = np.empty((size, base.shape[1]), dtype=np.float32)
+    for start in range(0, size, SYNTHETIC_BLOCK):
+        stop = min(size, start + SYNTHETIC_BLOCK)
+        corpus[start:stop] = perturbed_rows(base, stop - start, noise, rng)
+    return corpus
+
+def exact_neighbours(corpus, queries, k):
+    index = faiss.IndexFlatIP(corpus.shape[1])
+    index.add(corpus)
+    return index.search(queries, k)[1]
+
+def recall_at_k(truth, found):
+    """
+    Mean fraction of the exact top-k found by the approximate search.
+    """
+    k = truth.shape[1]
+    return float(np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)]))
+
+def measure_index(index, queries, k):
+    """
+    Search every query alone (latency) and all of them at once (throughput).
+
+    Returns:
+        tuple: (top-k positions from the batched search, timing dict).
+    """
+    index.search(queries[:1], k)  # Warm-up
+
+    latencies = []
+    for row in range(len(queries)):
+        start = time.perf_counter()
+        index.search(queries[row:row + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    batch_seconds = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return found, {
+        "latency_ms_p50": float(p50),
+        "latency_ms_p95": float(p95),
+        "latency_ms_p99": float(p99),
+        "batch_qps": len(queries) / batch_seconds,
+    }
+
+def bench_configs(corpus, queries, k, configs, truth):
+    results = {}
+    for config in configs:
+        start = time.perf_counter()
+        try:
+            index, params = build_index(corpus, config)
+        except RuntimeError as e:
+            # e.g. too few vectors to train a PQ codebook
+            logging.warning(f"Skipping {config}: {e}")
+            results[config] = {"error": str(e)}
+            continue
+        build_seconds = time.perf_counter() - start
+
+        found, timings = measure_index(index, queries, k)
+        results[config] = {
+            "factory": params["factory"],
+            "build_seconds": build_seconds,
+            f"recall@{k}": recall_at_k(truth, found),
+            **timings,
+            "found": found,
+        }
+        print(f"  {config:<10} {params['factory']:<18} recall@{k} {results[config][f'recall@{k}']:.3f}  "
+              f"p50 {timings['latency_ms_p50']:7.3f} ms  p99 {timings['latency_ms_p99']:7.3f} ms  "
+              f"{timings['batch_qps']:10.0f} QPS  build {build_seconds:6.1f} s")
+    return results
+
+def bench_labeled(documents, embeddings, eval_set, k, configs):
+    relevant = [relevant_chunks(documents, item["expected"]) for item in eval_set]
+    # A label that matches nothing would count as a miss for every index and skew hit@k
+    unmatched = [item["question"] for item, positions in zip(eval_set, relevant) if not positions]
+    if unmatched:
+        raise ValueError(f"No chunk contains the expected text for: {unmatched}")
+
+    queries = as_float32(embed_text([item["question"] for item in eval_set]))
+    truth = exact_neighbours(embeddings, queries, k)
+
+    print(f"labeled: {len(eval_set)} questions over {len(documents)} chunks")
+    results = bench_configs(embeddings, queries, k, configs, truth)
+    for config, result in results.items():
+        if "found" in result:
+            found = result.pop("found")
+            result[f"hit@{k}"] = float(np.mean([bool(set(f) & r) for f, r in zip(found, relevant)]))
+            print(f"  {config:<10} hit@{k} {result[f'hit@{k}']:.3f}")
+    return results
+
+def bench_synthetic(base, scales, query_count, noise, k, configs):
+    results = {}
+    queries = perturbed_rows(base, query_count, noise, np.random.default_rng(1))
+    for scale in scales:
+        corpus = synthesize_corpus(base, scale, noise)
+        truth = exact_neighbours(corpus, queries, k)
+        print(f"synthetic: {scale} vectors, {query_count} queries")
+        results[str(scale)] = bench_configs(corpus, queries, k, configs, truth)
+        for result in results[str(scale)].values():
+            result.pop("found", None)
+        del corpus
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark retrieval recall and latency per index type.")
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS,
+                        help="Index policies or FAISS factory strings to compare.")
+    parser.add_argument("--scales", type=int, nargs="*", default=[10_000, 100_000],
+                        help="Synthetic corpus sizes; add 1000000 for the large run.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000, help="Synthetic queries per scale.")
+    parser.add_argument("--noise", type=float, default=0.25,
+                        help="Relative norm of the noise added to replicated vectors.")
+    parser.add_argument("--documents", default=DOCUMENTS_PATH)
+    parser.add_argument("--embeddings", default=EMBEDDINGS_PATH)
+    parser.add_argument("--eval-set", default=EVAL_SET_PATH)
+    parser.add_argument("--skip-labeled", action="store_true", help="Only run the synthetic scales.")
+    parser.add_argument("--output", help="Also write the results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup_logging(logging.WARNING)
+    embeddings = as_float32(load_embedding_matrix(args.embeddings))
+
+    results = {
+        "commit": git_commit(),
+        "k": args.k,
+        "faiss_threads": faiss.omp_get_max_threads(),
+        "synthetic_noise": args.noise,
+    }
+    if not args.skip_labeled:
+        with open(args.documents, "rb") as f:
+            documents = pickle.load(f)
+        results["labeled"] = bench_labeled(documents, embeddings, load_eval_set(args.eval_set),
+                                           args.k, args.configs)
+    results["synthetic"] = bench_synthetic(embeddings, args.scales, args.queries, args.noise,
+                                           args.k, args.configs)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,58 @@
+# Scripts/bench_startup.py
+#
+# Reports import time and peak RSS of Scripts.utils, with the embedding
+# model loaded lazily (the default) and eagerly (the previous behaviour,
+# reproduced by loading the model right after import). Each scenario runs
+# in a fresh interpreter:
+#
+#   python Scripts/bench_startup.py [--runs 3]
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIO_TEMPLATE = """
+import json, resource, time
+start = time.perf_counter()
+import Scripts.utils as utils
+imported = time.perf_counter() - start
+{after_import}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_seconds": imported,
+    "total_seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+SCENARIOS = {
+    "lazy import": "",
+    "eager model load (previous behaviour)": "utils.get_embedding_model()",
+    "import + warm_up_embedding_model()": "utils.warm_up_embedding_model()",
+}
+
+def run_scenario(after_import):
+    code = SCENARIO_TEMPLATE.format(after_import=after_import)
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=PROJECT_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold-start cost of Scripts.utils.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per scenario.")
+    args = parser.parse_args()
+
+    for name, after_import in SCENARIOS.items():
+        results = [run_scenario(after_import) for _ in range(args.runs)]
+        best = min(results, key=lambda r: r["total_seconds"])
+        print(f"{name:<40} import {best['import_seconds'] * 1000:8.1f} ms  "
+              f"total {best['total_seconds'] * 1000:9.1f} ms  max RSS {best['max_rss_mb']:7.1f} MB")
@@ -0,0 +1,135 @@
+# Scripts/check_backend_parity.py
+#
+# Compares the ONNX embedding backends against the torch reference on the
+# ESUR chunks (documents.pkl):
+#
+#   - cosine agreement between each chunk's reference and candidate vectors
+#   - top-k overlap of retrieval results for a set of clinical questions,
+#     and of each chunk's nearest neighbours
+#   - single-query latency and peak RSS growth from loading the backend
+#
+# Every backend is profiled in a fresh spawned process. ru_maxrss is a
+# high-water mark that never drops, so measured in one process the first
+# backend's peak would hide the growth of every later one.
+#
+#   python Scripts/check_backend_parity.py [--backends onnx onnx-int8] [--k 5]
+
+import os
+import sys
+import json
+import time
+import pickle
+import resource
+import argparse
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.utils import EMBEDDING_MODEL_NAME
+from Scripts.embedding_backends import load_embedding_backend
+
+DOCUMENTS_PATH = os.path.join(SCRIPTS_DIR, "documents.pkl")
+
+SAMPLE_QUESTIONS = [
+    "How long should there be between two gadolinium-based contrast agent injections?",
+    "Should metformin be stopped before iodine-based contrast medium?",
+    "Can iodine- and gadolinium-based contrast agents be given on the same day?",
+    "Is hemodialysis needed after contrast medium in patients on dialysis?",
+    "What is the risk of nephrogenic systemic fibrosis with eGFR below 30?",
+    "How should acute hypersensitivity reactions to contrast media be treated?",
+    "Can a breastfeeding mother continue after gadolinium administration?",
+    "What premedication is recommended for patients with a previous contrast reaction?",
+    "How is post-contrast acute kidney injury defined?",
+    "What should be done after contrast medium extravasation?",
+]
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def normalized(embeddings):
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def top_k(query_embeddings, chunk_embeddings, k, exclude_self=False):
+    scores = query_embeddings @ chunk_embeddings.T
+    if exclude_self:
+        np.fill_diagonal(scores, -np.inf)
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def overlap_at_k(reference, candidate):
+    k = reference.shape[1]
+    return float(np.mean([len(set(r) & set(c)) / k for r, c in zip(reference, candidate)]))
+
+def profile_backend(name, chunks, questions):
+    """
+    Load a backend and embed the chunks and questions with it. Run this in
+    a fresh process (see profile_in_subprocess) for a meaningful peak RSS.
+    """
+    rss_before = max_rss_mb()
+    model = load_embedding_backend(name, EMBEDDING_MODEL_NAME)
+    model.encode(["warm-up"], convert_to_numpy=True)
+
+    chunk_embeddings = normalized(model.encode(chunks, batch_size=16, convert_to_numpy=True))
+    latencies = []
+    query_embeddings = []
+    for question in questions:
+        start = time.perf_counter()
+        query_embeddings.append(model.encode([question], convert_to_numpy=True)[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "chunks": chunk_embeddings,
+        "queries": normalized(np.vstack(query_embeddings)),
+        "query_latency_ms_p50": statistics.median(latencies),
+        "peak_rss_growth_mb": max_rss_mb() - rss_before,
+    }
+
+def profile_in_subprocess(name, chunks, questions):
+    # Spawned rather than forked: a fresh interpreter, and torch is not fork-safe
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(profile_backend, name, chunks, questions).result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check ONNX embedding backends against torch.")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--documents", default=DOCUMENTS_PATH)
+    parser.add_argument("--output", help="Also write the results as JSON to this path.")
+    args = parser.parse_args()
+
+    with open(args.documents, "rb") as f:
+        chunks = pickle.load(f)
+
+    reference = profile_in_subprocess("torch", chunks, SAMPLE_QUESTIONS)
+    reference_query_top = top_k(reference["queries"], reference["chunks"], args.k)
+    reference_chunk_top = top_k(reference["chunks"], reference["chunks"], args.k, exclude_self=True)
+
+    results = {"torch": {
+        "query_latency_ms_p50": reference["query_latency_ms_p50"],
+        "peak_rss_growth_mb": reference["peak_rss_growth_mb"],
+    }}
+
+    for name in args.backends:
+        candidate = profile_in_subprocess(name, chunks, SAMPLE_QUESTIONS)
+        cosines = np.sum(reference["chunks"] * candidate["chunks"], axis=1)
+        results[name] = {
+            "cosine_mean": float(cosines.mean()),
+            "cosine_min": float(cosines.min()),
+            f"question_top{args.k}_overlap": overlap_at_k(
+                reference_query_top, top_k(candidate["queries"], candidate["chunks"], args.k)
+            ),
+            f"chunk_neighbour_top{args.k}_overlap": overlap_at_k(
+                reference_chunk_top, top_k(candidate["chunks"], candidate["chunks"], args.k, exclude_self=True)
+            ),
+            "query_latency_ms_p50": candidate["query_latency_ms_p50"],
+            "peak_rss_growth_mb": candidate["peak_rss_growth_mb"],
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
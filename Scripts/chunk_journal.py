@@ -0,0 +1,347 @@
+# Scripts/chunk_journal.py
+#
+# Declarative chunk curation. Instead of editing documents.pkl in place with
+# hard-coded positions (see LegacyScripts/), edits are kept in
+# chunk_edits.json and replayed over a fixed base chunking, chunk_base.pkl.
+# The base is frozen the first time the journal is applied: it is the
+# documents.pkl in place at that point (hand-curated chunks included), or
+# the headline chunking of extracted_text.txt when there is none. Chunks are
+# addressed by stable content ids (utils.chunk_id), shown as 16-digit hex;
+# an operation refers to the ids of the chunks as they stand just before it,
+# and may list each chunk only once. Ingested corpora keep every chunk's
+# document attribution: edited chunks take that of the chunk they come from.
+#
+#   python Scripts/chunk_journal.py list      # ids and previews of the base with the journal replayed
+#   python Scripts/chunk_journal.py apply     # replay the journal, re-embed only what changed
+#                                             # and update the index by chunk id
+#
+# Supported operations:
+#   {"op": "merge",   "ids": [a, b, ...], "separator": " "}
+#   {"op": "split",   "id": a, "after": ["marker", ...]}
+#   {"op": "replace", "ids": [a, ...], "texts": ["...", ...]}
+#   {"op": "delete",  "ids": [a, ...]}
+
+import os
+import sys
+import json
+import pickle
+import logging
+import argparse
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.embedding_store import save_embedding_matrix, load_embedding_matrix
+from Scripts.index_builder import rebuild_index, save_index, load_index
+from Scripts.chunk_store import ChunkStore, upsert_vectors, remove_vectors
+from Scripts.snapshot import SNAPSHOTS_DIRNAME, loose_embeddings_model, write_snapshot
+from Scripts.utils import (
+    setup_logging,
+    file_exists,
+    split_text_by_headlines,
+    fit_chunks_to_model,
+    compute_chunk_ids,
+    embed_text,
+    embedding_model_id,
+)
+
+ARTIFACTS_DIR = os.environ.get("ESUR_ARTIFACTS_DIR", SCRIPTS_DIR)
+
+JOURNAL_PATH = os.path.join(SCRIPTS_DIR, "chunk_edits.json")
+TEXT_PATH = os.path.join(SCRIPTS_DIR, "extracted_text.txt")
+DOCUMENTS_PATH = os.path.join(ARTIFACTS_DIR, "documents.pkl")
+BASE_CHUNKS_PATH = os.path.join(ARTIFACTS_DIR, "chunk_base.pkl")
+BASE_METADATA_PATH = os.path.join(ARTIFACTS_DIR, "chunk_base_metadata.pkl")
+METADATA_PATH = os.path.join(ARTIFACTS_DIR, "document_metadata.pkl")
+CHUNK_IDS_PATH = os.path.join(ARTIFACTS_DIR, "chunk_ids.pkl")
+EMBEDDINGS_PATH = os.path.join(ARTIFACTS_DIR, "document_embeddings.npy")
+INDEX_PATH = os.path.join(ARTIFACTS_DIR, "faiss_index.index")
+SNAPSHOTS_DIR = os.path.join(ARTIFACTS_DIR, SNAPSHOTS_DIRNAME)
+
+def format_id(cid):
+    return f"{cid:016x}"
+
+def parse_id(value):
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+def load_journal(journal_path=JOURNAL_PATH):
+    """
+    Load the list of edit operations. A missing journal means no edits.
+    """
+    if not file_exists(journal_path):
+        return []
+    with open(journal_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_base_chunks():
+    """
+    The chunks the journal is replayed over: chunk_base.pkl once frozen,
+    else the current documents.pkl, else the headline chunking of
+    extracted_text.txt.
+    """
+    for path in (BASE_CHUNKS_PATH, DOCUMENTS_PATH):
+        if file_exists(path):
+            with open(path, "rb") as f:
+                chunks = pickle.load(f)
+            logging.info(f"Loaded {len(chunks)} base chunks from {path}")
+            return chunks
+    if not file_exists(TEXT_PATH):
+        raise FileNotFoundError(f"No chunks to start from: neither {DOCUMENTS_PATH} nor {TEXT_PATH} exists")
+    with open(TEXT_PATH, "r", encoding="utf-8") as f:
+        chunks = split_text_by_headlines(f.read())
+    logging.info(f"Split {TEXT_PATH} into {len(chunks)} sections based on headlines")
+    return chunks
+
+def load_base_metadata(base_chunks):
+    """
+    Per-chunk metadata (document attribution, ingested corpora only) aligned
+    with the base chunks, or None.
+    """
+    path = BASE_METADATA_PATH if file_exists(BASE_CHUNKS_PATH) else METADATA_PATH
+    if not file_exists(path):
+        return None
+    with open(path, "rb") as f:
+        metadata = pickle.load(f)
+    if len(metadata) != len(base_chunks):
+        logging.warning(f"{path} does not match the base chunks; ignoring it")
+        return None
+    return metadata
+
+def freeze_base_chunks(chunks, metadata=None):
+    """
+    Save the base chunks (and their metadata), unless a base has been frozen already.
+    """
+    if file_exists(BASE_CHUNKS_PATH):
+        return
+    if metadata is not None:
+        with open(BASE_METADATA_PATH, "wb") as f:
+            pickle.dump(list(metadata), f)
+    with open(BASE_CHUNKS_PATH, "wb") as f:
+        pickle.dump(list(chunks), f)
+    logging.info(f"Froze {len(chunks)} base chunks for the journal in {BASE_CHUNKS_PATH}")
+
+def replay_journal(chunks, operations, return_origins=False):
+    """
+    Apply edit operations, in order, over a list of chunk strings.
+
+    Each operation refers to chunks by the ids compute_chunk_ids gives the
+    chunks as they stand before it (the ids `list` shows, and the ids
+    ChunkStore.from_chunks assigns), so repeated texts are told apart by
+    their occurrence number.
+
+    Args:
+        chunks (list): Base chunks, e.g. from split_text_by_headlines.
+        operations (list): Edit operations as stored in the journal.
+        return_origins (bool, optional): Also return, for every edited chunk,
+            the position of the base chunk it comes from (the first one, for
+            merges and replacements).
+
+    Returns:
+        list: The edited chunk strings, or (chunks, origins) with return_origins.
+
+    Raises:
+        ValueError: If an operation is malformed, lists a chunk twice, or
+            refers to a chunk that does not exist at that point.
+    """
+    texts = list(chunks)
+    origins = list(range(len(texts)))
+
+    def positions(cids, op_num):
+        cids = [parse_id(cid) for cid in cids]
+        if not cids:
+            raise ValueError(f"Journal operation {op_num} lists no chunks")
+        if len(set(cids)) != len(cids):
+            repeated = next(cid for cid in cids if cids.count(cid) > 1)
+            raise ValueError(f"Journal operation {op_num} lists chunk {format_id(repeated)} more than once")
+        by_id = {cid: pos for pos, cid in enumerate(compute_chunk_ids(texts))}
+        for cid in cids:
+            if cid not in by_id:
+                raise ValueError(f"Journal operation {op_num} refers to unknown chunk {format_id(cid)}")
+        return [by_id[cid] for cid in cids]
+
+    def replace(replaced, new_texts):
+        # The new texts take the place of the first replaced chunk, and its origin
+        first = min(replaced)
+        origin = origins[first]
+        for pos in sorted(replaced, reverse=True):
+            del texts[pos]
+            del origins[pos]
+        new_texts = [text for text in new_texts if text.strip()]
+        texts[first:first] = new_texts
+        origins[first:first] = [origin] * len(new_texts)
+
+    for op_num, operation in enumerate(operations):
+        op = operation["op"]
+        if op == "merge":
+            merge_positions = positions(operation["ids"], op_num)
+            separator = operation.get("separator", " ")
+            replace(merge_positions, [separator.join(texts[pos] for pos in merge_positions)])
+        elif op == "split":
+            pos, = positions([operation["id"]], op_num)
+            text = texts[pos]
+            # Split after each marker, searching onwards from the previous split
+            pieces = []
+            previous = 0
+            for marker in operation["after"]:
+                found = text.find(marker, previous)
+                if found == -1:
+                    raise ValueError(f"Journal operation {op_num}: marker {marker!r} not found")
+                split_at = found + len(marker)
+                pieces.append(text[previous:split_at].strip())
+                previous = split_at
+            pieces.append(text[previous:].strip())
+            replace([pos], pieces)
+        elif op == "replace":
+            replace(positions(operation["ids"], op_num), operation["texts"])
+        elif op == "delete":
+            for pos in sorted(positions(operation["ids"], op_num), reverse=True):
+                del texts[pos]
+                del origins[pos]
+        else:
+            raise ValueError(f"Journal operation {op_num} has unknown op {op!r}")
+
+    if return_origins:
+        return texts, origins
+    return texts
+
+def load_current_state():
+    """
+    Load the current chunk store and embeddings, if they exist.
+
+    Returns:
+        tuple: (store, embeddings), or (None, None).
+    """
+    if not (file_exists(DOCUMENTS_PATH) and file_exists(EMBEDDINGS_PATH)):
+        return None, None
+    stored_model = loose_embeddings_model(EMBEDDINGS_PATH, SNAPSHOTS_DIR)
+    if stored_model not in (None, embedding_model_id()):
+        logging.warning(f"Current embeddings come from {stored_model}; everything will be re-embedded")
+        return None, None
+    store = ChunkStore.load(DOCUMENTS_PATH, CHUNK_IDS_PATH)
+    embeddings = load_embedding_matrix(EMBEDDINGS_PATH)
+    if embeddings.shape[0] != len(store):
+        logging.warning("Current chunks and embeddings disagree; everything will be re-embedded")
+        return None, None
+    return store, embeddings
+
+def load_current_index(store):
+    """
+    Load the id-mapped index if it matches the chunk store, else None.
+    """
+    if store is None or not file_exists(INDEX_PATH):
+        return None, {}
+    index, params = load_index(INDEX_PATH)
+    if not params.get("ids") or index.ntotal != len(store):
+        return None, params
+    return index, params
+
+def apply_journal(journal_path=JOURNAL_PATH):
+    """
+    Replay the journal over the base chunks and update the artifacts.
+
+    Embeddings of chunks whose id already exists are reused; only new or
+    edited chunks are embedded. The id-mapped index is then updated in
+    place: removed chunks are dropped by id and new ones added with theirs.
+    Indexes that cannot be mutated (positional, out of sync, or unable to
+    remove vectors, see chunk_store.supports_removal) are rebuilt from the
+    assembled matrix with the same factory and search parameters as before.
+
+    Returns:
+        dict: Counts of reused, embedded and removed chunks.
+    """
+    base_chunks = load_base_chunks()
+    base_metadata = load_base_metadata(base_chunks)
+    texts, origins = replay_journal(base_chunks, load_journal(journal_path), return_origins=True)
+    # Same final step as main.build_snapshot, so both produce the same chunks; windows
+    # of a split section keep its origin
+    fitted = fit_chunks_to_model([{"text": text, "origin": origin} for text, origin in zip(texts, origins)])
+    if not fitted:
+        raise ValueError("The journal leaves no chunks to index")
+    chunks = [chunk["text"] for chunk in fitted]
+    # Every chunk keeps the attribution of the base chunk it was edited from
+    metadata = [base_metadata[chunk["origin"]] for chunk in fitted] if base_metadata is not None else None
+    ids = compute_chunk_ids(chunks)
+
+    store, old_embeddings = load_current_state()
+    old_rows = {cid: row for row, cid in enumerate(store.ids() if store is not None else [])}
+    new_ids = set(ids)
+    removed = [cid for cid in old_rows if cid not in new_ids]
+
+    to_embed = [pos for pos, cid in enumerate(ids) if cid not in old_rows]
+    if to_embed:
+        new_embeddings = embed_text([chunks[pos] for pos in to_embed])
+    dimension = new_embeddings.shape[1] if to_embed else old_embeddings.shape[1]
+
+    embeddings = np.empty((len(chunks), dimension), dtype='float32')
+    for pos, cid in enumerate(ids):
+        if cid in old_rows:
+            embeddings[pos] = old_embeddings[old_rows[cid]]
+    if to_embed:
+        embeddings[to_embed] = new_embeddings
+
+    index, index_params = load_current_index(store)
+    rebuild = index is None
+    if index is not None:
+        try:
+            remove_vectors(index, store, removed)
+            if to_embed:
+                upsert_vectors(index, store, [ids[pos] for pos in to_embed],
+                               [chunks[pos] for pos in to_embed], new_embeddings)
+            index_params["count"] = index.ntotal
+        except ValueError as e:
+            logging.info(f"Rebuilding the index: {e}")
+            rebuild = True
+    if rebuild:
+        # Keep the index type and search parameters chosen when the index was first built
+        index, index_params = rebuild_index(index, embeddings, ids, index_params)
+
+    # documents.pkl is about to hold the edited chunks; keep what they were edited from
+    freeze_base_chunks(base_chunks, base_metadata)
+    # Saved in journal order; search results are ids, so the index does not depend on it
+    new_store = ChunkStore(ids, chunks, metadata)
+    new_store.save(DOCUMENTS_PATH, CHUNK_IDS_PATH, METADATA_PATH)
+    if metadata is None and file_exists(METADATA_PATH):
+        # Left over from other chunks; it would no longer line up with documents.pkl
+        os.remove(METADATA_PATH)
+    # Keep the storage type of the existing matrix (float16 stays float16)
+    storage_dtype = str(old_embeddings.dtype) if old_embeddings is not None else "float32"
+    save_embedding_matrix(EMBEDDINGS_PATH, embeddings, storage_dtype, embedding_model_id())
+    save_index(index, INDEX_PATH, index_params)
+    # Publish the result as the snapshot main.py serves
+    write_snapshot(SNAPSHOTS_DIR, new_store, embeddings, index, index_params,
+                   embedding_model_id(), storage_dtype)
+
+    stats = {
+        "reused": len(chunks) - len(to_embed),
+        "embedded": len(to_embed),
+        "removed": len(removed),
+    }
+    logging.info(
+        f"Applied journal: {len(chunks)} chunks ({stats['reused']} reused, "
+        f"{stats['embedded']} embedded, {stats['removed']} removed)"
+    )
+    return stats
+
+def list_chunks():
+    # The chunks new journal operations apply to, i.e. the ids they can refer to
+    chunks = replay_journal(load_base_chunks(), load_journal())
+    for position, (cid, text) in enumerate(zip(compute_chunk_ids(chunks), chunks), start=1):
+        preview = " ".join(text.split())[:80]
+        print(f"{position:4d}  {format_id(cid)}  {preview}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay chunk edits and update the index incrementally.")
+    parser.add_argument("command", choices=["list", "apply"])
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    if args.command == "list":
+        list_chunks()
+    else:
+        try:
+            apply_journal()
+        except ValueError as e:
+            logging.error(f"Could not apply chunk journal: {e}")
+            sys.exit(1)
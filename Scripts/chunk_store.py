@@ -0,0 +1,219 @@
+# Scripts/chunk_store.py
+#
+# Chunks keyed by their stable 64-bit ids (utils.chunk_id). The FAISS index
+# carries the same ids (IVF indexes natively, others through an
+# IndexIDMap2), so search results are chunk ids rather than positions, and a
+# chunk can be added, replaced or removed without renumbering the rest.
+# HNSW graphs cannot drop vectors; update_vectors rebuilds those instead. On disk the store stays three
+# aligned lists: documents.pkl (texts), chunk_ids.pkl and, for ingested
+# corpora, document_metadata.pkl.
+
+import os
+import pickle
+import logging
+
+import faiss
+import numpy as np
+
+from Scripts.utils import compute_chunk_ids
+from Scripts.index_builder import rebuild_index, unwrap_index
+
+class ChunkStore:
+    """
+    Insertion-ordered mapping of chunk id -> text, with optional metadata.
+    """
+
+    def __init__(self, ids=(), texts=(), metadata=None):
+        ids = [int(cid) for cid in ids]
+        self._texts = dict(zip(ids, texts))
+        if len(self._texts) != len(ids):
+            raise ValueError("Chunk ids must be unique")
+        self._metadata = dict(zip(ids, metadata)) if metadata is not None else {}
+
+    @classmethod
+    def from_chunks(cls, texts, metadata=None):
+        return cls(compute_chunk_ids(texts), texts, metadata)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __contains__(self, cid):
+        return int(cid) in self._texts
+
+    def __getitem__(self, cid):
+        return self._texts[int(cid)]
+
+    def get(self, cid, default=None):
+        return self._texts.get(int(cid), default)
+
+    def ids(self):
+        return list(self._texts)
+
+    def texts(self):
+        return list(self._texts.values())
+
+    def metadata(self, cid):
+        return self._metadata.get(int(cid))
+
+    def put(self, cid, text, metadata=None):
+        self._texts[int(cid)] = text
+        if metadata is not None:
+            self._metadata[int(cid)] = metadata
+
+    def remove(self, cid):
+        self._texts.pop(int(cid), None)
+        self._metadata.pop(int(cid), None)
+
+    def save(self, documents_path, ids_path, metadata_path=None):
+        """
+        Write the store as aligned lists of texts, ids and (optionally) metadata.
+        """
+        ids = self.ids()
+        with open(documents_path, "wb") as f:
+            pickle.dump(self.texts(), f)
+        with open(ids_path, "wb") as f:
+            pickle.dump(ids, f)
+        if metadata_path and self._metadata:
+            with open(metadata_path, "wb") as f:
+                pickle.dump([self._metadata.get(cid) for cid in ids], f)
+
+    @classmethod
+    def load(cls, documents_path, ids_path=None, metadata_path=None):
+        """
+        Load a store saved by save(). Stores from before chunk ids were kept
+        (no ids file, or one that no longer lines up) get their ids recomputed.
+        """
+        with open(documents_path, "rb") as f:
+            texts = pickle.load(f)
+        ids = None
+        if ids_path and os.path.exists(ids_path):
+            with open(ids_path, "rb") as f:
+                ids = pickle.load(f)
+            if len(ids) != len(texts):
+                logging.warning(f"{ids_path} does not match {documents_path}; recomputing chunk ids")
+                ids = None
+        if ids is None:
+            ids = compute_chunk_ids(texts)
+        metadata = None
+        if metadata_path and os.path.exists(metadata_path):
+            with open(metadata_path, "rb") as f:
+                metadata = pickle.load(f)
+        return cls(ids, texts, metadata)
+
+def as_faiss_ids(ids):
+    return np.asarray([int(cid) for cid in ids], dtype=np.int64)
+
+def supports_removal(index):
+    """
+    Whether chunks can be removed from the index in place.
+
+    HNSW graphs cannot drop vectors at all, and an IndexIDMap2 around an IVF
+    index (as built by older versions) maps ids wrongly after a removal.
+    """
+    wrapped = hasattr(faiss.downcast_index(index), "id_map")
+    base = unwrap_index(index)
+    if hasattr(base, "hnsw"):
+        return False
+    return not (wrapped and faiss.try_extract_index_ivf(base) is not None)
+
+def upsert_vectors(index, store, ids, texts, embeddings, metadata=None):
+    """
+    Add or replace chunks in an id-mapped index and the store, in place.
+
+    Ids already in the store are removed from the index first, so a changed
+    chunk costs one remove and one add rather than a rebuild.
+
+    Args:
+        index (faiss.Index): Index built with ids (index_builder.build_index(..., ids=...)).
+        store (ChunkStore): The chunk store matching the index.
+        ids (list): Chunk ids.
+        texts (list): Chunk texts, aligned with ids.
+        embeddings (np.ndarray): (len(ids), dimension) normalized embeddings.
+        metadata (list, optional): Per-chunk metadata, aligned with ids.
+
+    Raises:
+        ValueError: If chunks have to be replaced and the index cannot remove
+            them (see supports_removal); nothing is changed then.
+    """
+    if not len(ids):
+        return
+    existing = [cid for cid in ids if cid in store]
+    # Replaced chunks keep their metadata unless new metadata is given
+    previous_metadata = {cid: store.metadata(cid) for cid in existing}
+    if existing:
+        remove_vectors(index, store, existing)
+    index.add_with_ids(np.ascontiguousarray(embeddings, dtype=np.float32), as_faiss_ids(ids))
+    for pos, (cid, text) in enumerate(zip(ids, texts)):
+        store.put(cid, text, metadata[pos] if metadata is not None else previous_metadata.get(cid))
+
+def remove_vectors(index, store, ids):
+    """
+    Remove chunks from an id-mapped index and the store, in place.
+
+    Returns:
+        int: Number of vectors removed from the index.
+
+    Raises:
+        ValueError: If the index cannot remove vectors (see supports_removal).
+    """
+    if not len(ids):
+        return 0
+    if not supports_removal(index):
+        raise ValueError("This index type does not support removing chunks; it has to be rebuilt")
+    removed = index.remove_ids(as_faiss_ids(ids))
+    for cid in ids:
+        store.remove(cid)
+    return removed
+
+def reconstruct_vectors(index, ids):
+    """
+    Vectors stored in an id-mapped index for the given chunk ids (exact for
+    flat storage, approximate for PQ).
+    """
+    ivf = faiss.try_extract_index_ivf(unwrap_index(index))
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    vectors = np.empty((len(ids), index.d), dtype=np.float32)
+    for row, cid in enumerate(ids):
+        vectors[row] = index.reconstruct(int(cid))
+    return vectors
+
+def update_vectors(index, store, ids=(), texts=(), embeddings=None, metadata=None, remove_ids=(), params=None):
+    """
+    Remove and add/replace chunks, in place where the index allows it.
+
+    Indexes that cannot remove vectors (see supports_removal) are rebuilt
+    like the original (see index_builder.rebuild_index) from the vectors
+    they hold plus the new ones, which keeps every chunk findable by its id.
+
+    Args:
+        index (faiss.Index): Index built with ids.
+        store (ChunkStore): The chunk store matching the index, updated in place.
+        ids, texts, embeddings, metadata: Chunks to add or replace, as for upsert_vectors.
+        remove_ids (list, optional): Chunks to remove.
+        params (dict, optional): The params the index was built with
+            (index_builder.build_index), used to rebuild it the same way.
+
+    Returns:
+        tuple: (index, params): the same index or the rebuilt one, and its
+            params with the updated vector count.
+    """
+    remove_ids = [cid for cid in remove_ids if cid in store]
+    if supports_removal(index) or not (remove_ids or any(cid in store for cid in ids)):
+        remove_vectors(index, store, remove_ids)
+        upsert_vectors(index, store, ids, texts, embeddings, metadata)
+        return index, dict(params or {}, count=index.ntotal)
+
+    dropped = set(int(cid) for cid in remove_ids) | set(int(cid) for cid in ids)
+    kept = [cid for cid in store.ids() if cid not in dropped]
+    vectors = reconstruct_vectors(index, kept)
+    for cid in remove_ids:
+        store.remove(cid)
+    for pos, (cid, text) in enumerate(zip(ids, texts)):
+        previous = store.metadata(cid) if cid in store else None
+        store.put(cid, text, metadata[pos] if metadata is not None else previous)
+    if len(ids):
+        vectors = np.vstack([vectors, np.asarray(embeddings, dtype=np.float32)])
+        kept = kept + [int(cid) for cid in ids]
+    logging.info(f"Rebuilding the index over {len(kept)} chunks; it cannot remove vectors in place")
+    return rebuild_index(index, vectors, kept, params)
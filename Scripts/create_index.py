@@ -6,26 +6,26 @@ Created on Tue Jul  2 10:56:11 2024
 """
 
 # create_index.py
-import faiss
 import pickle
 import os
 import numpy as np
 
-def create_faiss_index(document_embeddings, documents, index_path, documents_path):
+from Scripts.index_builder import build_index, save_index
+
+def create_faiss_index(document_embeddings, documents, index_path, documents_path, index_policy="auto"):
     # Convert embeddings to float32 if they are not already
     if document_embeddings.dtype != np.float32:
         document_embeddings = document_embeddings.astype('float32')
 
-    # Create and train the FAISS index
-    index = faiss.IndexFlatIP(document_embeddings.shape[1])
-    index.add(document_embeddings)
+    # Create and train the FAISS index (type chosen from the corpus size unless given)
+    index, index_params = build_index(document_embeddings, index_policy)
 
     # Ensure the output directories exist
     os.makedirs(os.path.dirname(index_path), exist_ok=True)
     os.makedirs(os.path.dirname(documents_path), exist_ok=True)
 
     # Save the index and documents
-    faiss.write_index(index, index_path)
+    save_index(index, index_path, index_params)
     with open(documents_path, "wb") as f:
         pickle.dump(documents, f)
 
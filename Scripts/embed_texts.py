@@ -6,29 +6,30 @@ Created on Tue Jul  2 10:55:42 2024
 """
 
 # embed_texts.py
-from sentence_transformers import SentenceTransformer
-import pickle
 import os
+import sys
 
-# Load pre-trained SentenceTransformer model for embeddings
-model = SentenceTransformer("sentence-transformers/all-mpnet-base-v2")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def embed_text(text_list):
-    embeddings = embedding_model.encode(text_list, convert_to_numpy=True)
-    # Normalize embeddings
-    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-    embeddings = embeddings / norms
-    return embeddings
+# The SentenceTransformer is shared with Scripts/utils.py and loaded lazily on first use
+from Scripts.utils import embed_corpus
+from Scripts.embedding_store import save_embedding_matrix
 
-def save_embeddings(doc_txt, output_embeddings_path):
-    document_embeddings = embed_text(doc_txt)
+def save_embeddings(doc_txt, output_embeddings_path, workers=1, dtype="float32"):
+    """
+    Embed the corpus and save the embeddings as a memory-mappable .npy file.
 
-    # Ensure the output directory exists
-    os.makedirs(os.path.dirname(output_embeddings_path), exist_ok=True)
+    Args:
+        doc_txt (list): Chunk strings.
+        output_embeddings_path (str): Where to save the embeddings (.npy).
+        workers (int, optional): Worker processes to shard the embedding
+            across; 1 embeds in this process. Defaults to 1.
+        dtype (str, optional): Storage type, "float32" or "float16".
+    """
+    document_embeddings = embed_corpus(doc_txt, workers=workers)
 
-    # Save the embeddings to a file
-    with open(output_embeddings_path, "wb") as f:
-        pickle.dump(document_embeddings, f)
+    # Save the embeddings to a file (the output directory is created if needed)
+    save_embedding_matrix(output_embeddings_path, document_embeddings, dtype=dtype)
 
     print(f"Document embeddings saved to {output_embeddings_path}")
 
@@ -37,5 +38,5 @@ def save_embeddings(doc_txt, output_embeddings_path):
 # Example usage for testing
 if __name__ == "__main__":
     doc_txt = ["Example text"]
-    output_embeddings_path = "C:/Users/akome/Desktop/RAG/V3/Scripts/document_embeddings.pkl"
+    output_embeddings_path = "C:/Users/akome/Desktop/RAG/V3/Scripts/document_embeddings.npy"
     save_embeddings(doc_txt, output_embeddings_path)
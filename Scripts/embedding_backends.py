@@ -0,0 +1,145 @@
+# Scripts/embedding_backends.py
+#
+# Embedding backends behind utils.get_embedding_model(). Every backend offers
+# the parts of the SentenceTransformer interface the pipeline uses: encode(),
+# tokenizer, max_seq_length and get_sentence_embedding_dimension().
+#
+#   torch      SentenceTransformer on PyTorch (default)
+#   onnx       all-mpnet-base-v2 exported to ONNX, run with onnxruntime on CPU
+#   onnx-int8  the same export with dynamically int8-quantized weights
+#
+# Export the ONNX models once with:
+#
+#   python Scripts/embedding_backends.py export [--output-dir DIR]
+
+import os
+import sys
+import logging
+import argparse
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_ONNX_DIR = os.path.join(SCRIPTS_DIR, "onnx", "all-mpnet-base-v2")
+ONNX_MODEL_FILENAME = "model.onnx"
+ONNX_INT8_MODEL_FILENAME = "model.int8.onnx"
+
+# all-mpnet-base-v2 is trained with sequences of up to 384 tokens
+ONNX_MAX_SEQ_LENGTH = 384
+
+class OnnxEmbeddingModel:
+    """
+    Mean-pooled transformer embeddings from an exported ONNX graph.
+
+    Mirrors the SentenceTransformer calls used in this repo so it can stand in
+    for the torch model. Vectors are returned unnormalized, as
+    SentenceTransformer.encode returns them before utils normalizes.
+    """
+
+    def __init__(self, model_dir=DEFAULT_ONNX_DIR, quantized=False, threads=None):
+        if threads is None and os.environ.get("OMP_NUM_THREADS", "").isdigit():
+            threads = int(os.environ["OMP_NUM_THREADS"])
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(model_dir, ONNX_INT8_MODEL_FILENAME if quantized else ONNX_MODEL_FILENAME)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"ONNX model not found at {model_path}; run 'python Scripts/embedding_backends.py export'"
+            )
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = ONNX_MAX_SEQ_LENGTH
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self._dimension = self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self):
+        return self._dimension
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            encoded = self.tokenizer(
+                list(sentences[start:start + batch_size]),
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self._input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            # Mean pooling over real (non-padding) tokens, as in the sentence-transformers config
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            summed = (token_embeddings * mask).sum(axis=1)
+            embeddings.append(summed / np.clip(mask.sum(axis=1), 1e-9, None))
+        if not embeddings:
+            return np.zeros((0, self._dimension), dtype=np.float32)
+        return np.vstack(embeddings).astype(np.float32)
+
+def load_embedding_backend(backend, model_name, onnx_dir=DEFAULT_ONNX_DIR):
+    """
+    Build the embedding model for a backend name (see BACKENDS).
+    """
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddingModel(onnx_dir, quantized=backend == "onnx-int8")
+    raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {BACKENDS}")
+
+def export_onnx_model(model_name, output_dir=DEFAULT_ONNX_DIR, quantize=True):
+    """
+    Export the transformer behind a sentence-transformers model to ONNX, and
+    optionally write a dynamically int8-quantized copy next to it.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(output_dir)
+
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILENAME)
+    sample = tokenizer(["Contrast media and renal function."], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            model_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["token_embeddings"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "token_embeddings": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+    logging.info(f"Exported {model_name} to {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(output_dir, ONNX_INT8_MODEL_FILENAME)
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+        logging.info(f"Wrote int8-quantized model to {int8_path}")
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(SCRIPTS_DIR))
+    from Scripts.utils import setup_logging, EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Manage ONNX embedding backends.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--output-dir", default=DEFAULT_ONNX_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8-quantized copy.")
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    export_onnx_model(EMBEDDING_MODEL_NAME, args.output_dir, quantize=not args.no_quantize)
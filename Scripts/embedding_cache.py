@@ -0,0 +1,125 @@
+# Scripts/embedding_cache.py
+#
+# Persistent, content-addressed cache of chunk embeddings. Vectors are keyed
+# by hash(model name, normalization, text) and stored as raw float32 bytes in
+# a SQLite file, so re-chunking or rebuilding the corpus only encodes texts
+# that have never been seen before. The cache is bounded by entry count and
+# evicts the least recently used vectors.
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 200_000
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache with LRU eviction and hit/miss statistics.
+
+    Args:
+        path (str): SQLite file to store the cache in.
+        max_entries (int, optional): Vectors kept before the least recently
+            used ones are evicted. Defaults to 200,000.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, normalization, text):
+        return hashlib.sha256(f"{model_name}\x00{normalization}\x00{text}".encode("utf-8")).digest()
+
+    def get_many(self, model_name, normalization, texts):
+        """
+        Look up cached vectors for a list of texts.
+
+        Returns:
+            dict: Maps positions in `texts` to float32 vectors, for hits only.
+        """
+        keys = [self.make_key(model_name, normalization, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+            vectors = {
+                pos: np.frombuffer(found[key], dtype=np.float32)
+                for pos, key in enumerate(keys)
+                if key in found
+            }
+            self.hits += len(vectors)
+            self.misses += len(texts) - len(vectors)
+        return vectors
+
+    def put_many(self, model_name, normalization, texts, vectors):
+        """
+        Store vectors for a list of texts, evicting old entries past the size bound.
+        """
+        now = time.time()
+        rows = [
+            (self.make_key(model_name, normalization, text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                logging.debug(f"Evicted {excess} least recently used embeddings from {self.path}")
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Hit/miss counters since this cache was opened, plus its current size.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,94 @@
+# Scripts/embedding_pool.py
+#
+# Multi-process CPU embedding for large corpora. torch's intra-op threading
+# stops scaling after a few cores, so instead the corpus is sharded across
+# worker processes that each load the model once and run with a pinned
+# number of threads. Use it through utils.embed_corpus(..., workers=N).
+
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# Chunks sent to a worker at a time; small enough to keep every worker busy
+DEFAULT_SHARD_SIZE = 128
+
+def _init_worker(threads, backend):
+    # Pin the thread pools before torch is imported and sizes them itself
+    # (the ONNX backend sizes its session from OMP_NUM_THREADS too)
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+
+    from Scripts.utils import get_embedding_model, set_embedding_backend, setup_logging
+    setup_logging(logging.INFO)
+    set_embedding_backend(backend)
+    get_embedding_model()  # Load once per worker, not once per shard
+
+def _embed_shard(positions, texts, batch_size):
+    from Scripts.utils import embed_corpus
+    return positions, embed_corpus(texts, batch_size=batch_size, show_progress=False)
+
+def encode_in_pool(text_list, workers, threads_per_worker=None, batch_size=None,
+                   shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Embed chunks across a pool of worker processes.
+
+    Chunks are ordered by length before sharding, so each shard holds chunks
+    of similar size and shards finish at a similar pace. Shards are streamed
+    back as they complete and written into one float32 matrix in the
+    original chunk order.
+
+    Args:
+        text_list (list): Chunk strings.
+        workers (int): Number of worker processes.
+        threads_per_worker (int, optional): torch threads per worker.
+            Defaults to the CPU count divided evenly between workers.
+        batch_size (int, optional): Chunks per forward pass inside a worker.
+        shard_size (int, optional): Chunks per task. Defaults to 128.
+
+    Returns:
+        np.ndarray: (len(text_list), dimension) float32 embeddings.
+    """
+    from Scripts import utils
+
+    if not text_list:
+        return np.zeros((0, utils.get_embedding_model().get_sentence_embedding_dimension()), dtype='float32')
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    order = sorted(range(len(text_list)), key=lambda pos: len(text_list[pos]))
+    shards = [order[start:start + shard_size] for start in range(0, len(order), shard_size)]
+    logging.info(
+        f"Embedding {len(text_list)} chunks in {len(shards)} shards on {workers} workers "
+        f"x {threads_per_worker} threads"
+    )
+
+    embeddings = None
+    done = 0
+    start_time = time.perf_counter()
+    # torch is not fork-safe once its thread pools exist, so always spawn
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(threads_per_worker, utils.EMBEDDING_BACKEND)) as executor:
+        futures = [
+            executor.submit(_embed_shard, shard, [text_list[pos] for pos in shard], batch_size)
+            for shard in shards
+        ]
+        for future in as_completed(futures):
+            positions, shard_embeddings = future.result()
+            if embeddings is None:
+                embeddings = np.empty((len(text_list), shard_embeddings.shape[1]), dtype='float32')
+            embeddings[positions] = shard_embeddings
+
+            done += len(positions)
+            elapsed = time.perf_counter() - start_time
+            logging.info(f"Embedded {done}/{len(text_list)} chunks ({done / elapsed:.1f} chunks/s)")
+
+    return embeddings
@@ -0,0 +1,84 @@
+# Scripts/embedding_store.py
+#
+# Embedding matrices are stored as raw .npy files instead of pickles, so they
+# can be memory-mapped: loading is near-instant and every server process
+# reading the same file shares one copy in the page cache. Matrices can be
+# stored as float16 to halve their size; FAISS still receives float32.
+
+import os
+import json
+import pickle
+import logging
+
+import numpy as np
+
+STORAGE_DTYPES = ("float32", "float16")
+
+def embedding_model_path(path):
+    return os.path.splitext(path)[0] + ".model.json"
+
+def save_embedding_matrix(path, embeddings, dtype="float32", model_name=None):
+    """
+    Save an embedding matrix as .npy, atomically.
+
+    Args:
+        path (str): Destination .npy path.
+        embeddings (np.ndarray): (n, dimension) matrix.
+        dtype (str, optional): Storage type, "float32" or "float16". Defaults to "float32".
+        model_name (str, optional): Model that produced the embeddings, recorded
+            in a sidecar (see load_embedding_model_name).
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported embedding storage dtype {dtype!r}; expected one of {STORAGE_DTYPES}")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    # Write to a temporary file first; readers that have the old file mapped keep a valid view
+    temp_path = path + ".tmp.npy"
+    np.save(temp_path, np.ascontiguousarray(embeddings, dtype=dtype))
+    os.replace(temp_path, path)
+
+    # A sidecar left by an earlier matrix would describe the wrong vectors
+    if model_name is None:
+        if os.path.exists(embedding_model_path(path)):
+            os.remove(embedding_model_path(path))
+    else:
+        with open(embedding_model_path(path), "w", encoding="utf-8") as f:
+            json.dump({"model_name": model_name, "count": int(len(embeddings))}, f, indent=2)
+
+def load_embedding_model_name(path):
+    """
+    Model recorded with a matrix by save_embedding_matrix, or None if unknown.
+    """
+    if not os.path.exists(embedding_model_path(path)):
+        return None
+    with open(embedding_model_path(path), "r", encoding="utf-8") as f:
+        return json.load(f).get("model_name")
+
+def load_embedding_matrix(path, mmap=True):
+    """
+    Load an embedding matrix saved by save_embedding_matrix.
+
+    Args:
+        path (str): .npy path.
+        mmap (bool, optional): Map the file read-only instead of reading it
+            into memory. Defaults to True.
+
+    Returns:
+        np.ndarray: The matrix, in its storage dtype.
+    """
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+def as_float32(embeddings):
+    """
+    View of the matrix as float32 for FAISS; only float16 storage is copied.
+    """
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+def migrate_pickled_embeddings(pickle_path, npy_path, dtype="float32"):
+    """
+    Convert a legacy pickled embedding matrix to the .npy store.
+    """
+    with open(pickle_path, "rb") as f:
+        embeddings = pickle.load(f)
+    save_embedding_matrix(npy_path, embeddings, dtype=dtype)
+    logging.info(f"Migrated pickled embeddings from {pickle_path} to {npy_path}")
@@ -16,6 +16,11 @@ import camelot
 import re
 import shutil
 import tempfile
+import argparse
+import hashlib
+import sqlite3
+import json
+from concurrent.futures import ProcessPoolExecutor
 
 def setup_logging():
     logging.basicConfig(
@@ -23,40 +28,290 @@ def setup_logging():
         format="%(asctime)s - %(levelname)s - %(message)s",
     )
 
-def extract_text_and_tables(pdf_path, output_text_path):
+# Layout thresholds for the cheap table pre-filter (PDF points)
+MIN_RULE_LENGTH = 40       # Shortest line that counts as a table ruling line
+MIN_RULING_LINES = 3       # Horizontal rules needed to call a page tabular
+COLUMN_TOLERANCE = 4       # x0 positions closer than this share a column
+MIN_ALIGNED_ROWS = 3       # Rows that must share the same column positions
+MIN_ALIGNED_COLUMNS = 3    # Columns a row needs to count as a table row
+
+# Bump when extraction or merging changes so stale cache entries are ignored
+EXTRACTION_CACHE_VERSION = 2
+EXTRACTION_CACHE_FILENAME = "extraction_cache.sqlite"
+
+# Pages extracted per run: the text of a run is held until Camelot has been
+# over it, and the run's records are then written out and cached
+PAGE_RUN_SIZE = 16
+
+def extract_text_and_tables(pdf_path, output_text_path, workers=1, prefilter=True, cache_path=None,
+                            output_records_path=None):
+    """
+    Extract text and tables from every page of a PDF and save them as text.
+
+    Pages are streamed to disk in page order, both as flat text and as one
+    JSON record per block (page, bbox, kind, heading level, text). Pages are
+    extracted in runs of PAGE_RUN_SIZE (one Camelot call per run), each run
+    is written out and added to the extraction cache before the next one
+    starts, so memory stays bounded by the run size rather than the document
+    size. An interrupted extraction resumes from the cached pages.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        output_text_path (str): Where to write the extracted text.
+        output_records_path (str, optional): Where to write the JSONL block
+            records. Defaults to the output text path with a .jsonl extension.
+        workers (int, optional): Number of worker processes. With 1 (the
+            default) pages are processed serially in this process; with more,
+            page runs are spread across a process pool. The output is
+            identical either way. Defaults to 1.
+        prefilter (bool, optional): Skip Camelot on pages whose layout shows
+            no tabular structure. Defaults to True.
+        cache_path (str, optional): Per-page extraction cache (SQLite). Pages
+            whose content hash is already cached are not re-extracted.
+            Defaults to extraction_cache.sqlite next to the output text; pass
+            False to disable caching.
+
+    Returns:
+        dict: Run statistics with page, block, cache hit and cache miss
+            counts. (This used to be the extracted text; read it from
+            output_text_path instead.)
+    """
     setup_logging()
-    logging.info(f"Starting extraction from {pdf_path}")
+    logging.info(f"Starting extraction from {pdf_path} with {workers} worker(s)")
 
     # Ensure the output directory exists
     os.makedirs(os.path.dirname(output_text_path), exist_ok=True)
 
+    if output_records_path is None:
+        output_records_path = os.path.splitext(output_text_path)[0] + ".jsonl"
+    if cache_path is None:
+        cache_path = os.path.join(os.path.dirname(output_text_path), EXTRACTION_CACHE_FILENAME)
+    cache = ExtractionCache(cache_path) if cache_path else None
+
     doc = fitz.open(pdf_path)
-    all_text = ""
+    stats = {"pages": len(doc), "blocks": 0}
     temp_dir = tempfile.mkdtemp()
+    # Write temporary files so an interrupted run leaves the previous output intact
+    temp_output_paths = [output_text_path + ".tmp", output_records_path + ".tmp"]
+    text_file = open(temp_output_paths[0], "w", encoding="utf-8")
+    records_file = open(temp_output_paths[1], "w", encoding="utf-8")
 
     try:
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            logging.info(f"Processing page {page_num + 1}")
-            page_text_blocks = extract_page_text(page)
-            page_table_blocks = extract_page_tables(pdf_path, page_num)
-            # Merge text and tables based on positions
-            combined_content = merge_blocks(page_text_blocks, page_table_blocks)
-            all_text += combined_content + "\n\n"
+        page_hashes = [page_content_hash(doc.load_page(page_num), prefilter) for page_num in range(len(doc))]
+        cached_hashes = cache.contains(page_hashes) if cache else set()
+        missed_pages = [page_num for page_num, page_hash in enumerate(page_hashes) if page_hash not in cached_hashes]
+        stats["cache_hits"] = len(page_hashes) - len(missed_pages)
+        stats["cache_misses"] = len(missed_pages)
+        logging.info(f"Extraction cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses")
+
+        if workers > 1 and len(missed_pages) > PAGE_RUN_SIZE:
+            page_results = extract_pages_parallel(pdf_path, missed_pages, workers, prefilter)
+        else:
+            page_results = extract_pages_in_runs(pdf_path, doc, missed_pages, prefilter)
+
+        # Results arrive in page order, so merging here is identical to the serial path
+        new_pages = {}
+        for page_num, page_hash in enumerate(page_hashes):
+            if page_hash in cached_hashes:
+                records = cache.get(page_hash)
+            else:
+                _, page_text_blocks, page_table_blocks = next(page_results)
+                # Merge text and tables based on positions
+                records = page_records(page_text_blocks, page_table_blocks)
+                new_pages[page_hash] = records
+
+            text_file.write(render_records(records) + "\n\n")
+            for record in records:
+                records_file.write(json.dumps(dict(record, page=page_num + 1), ensure_ascii=False) + "\n")
+            stats["blocks"] += len(records)
+
+            if cache and len(new_pages) >= PAGE_RUN_SIZE:
+                cache.put_many(new_pages)
+                new_pages = {}
+
+        if cache:
+            cache.put_many(new_pages)
+            # Only keep the pages of the current revision so the cache doesn't grow forever
+            cache.prune(page_hashes)
+
+        text_file.close()
+        records_file.close()
+        os.replace(temp_output_paths[0], output_text_path)
+        os.replace(temp_output_paths[1], output_records_path)
     finally:
-        # Clean up temporary directory
+        doc.close()
+        text_file.close()
+        records_file.close()
+        if cache:
+            cache.close()
+        # Clean up temporary directory and the output of a failed run
         shutil.rmtree(temp_dir)
+        for temp_path in temp_output_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    logging.info(
+        f"Extraction completed. Text saved to {output_text_path}, "
+        f"{stats['blocks']} block records saved to {output_records_path}"
+    )
 
-    # Save the extracted text to a file
-    with open(output_text_path, "w", encoding="utf-8") as f:
-        f.write(all_text)
+    return stats
 
-    logging.info(f"Extraction completed. Text saved to {output_text_path}")
+def page_runs(page_nums, run_size=PAGE_RUN_SIZE):
+    page_nums = list(page_nums)
+    return [page_nums[start:start + run_size] for start in range(0, len(page_nums), run_size)]
+
+def extract_pages(pdf_path, doc, page_nums, prefilter=True):
+    """
+    Extract the text and table blocks of a run of pages.
+
+    Text is read page by page with PyMuPDF. Pages that pass the layout
+    pre-filter are then handed to Camelot in a single call, reusing the page
+    heights already loaded here.
+
+    Returns:
+        list: (page_num, text_blocks, table_blocks) tuples in page order.
+    """
+    page_text = []
+    table_page_heights = {}
+    for page_num in page_nums:
+        page = doc.load_page(page_num)
+        logging.info(f"Processing page {page_num + 1}")
+        blocks = page.get_text("dict")["blocks"]
+        page_text.append((page_num, extract_page_text(page, blocks)))
+        if not prefilter or page_has_table_structure(page, blocks):
+            table_page_heights[page_num] = page.rect.height
 
-    return all_text
+    logging.info(f"Running table detection on {len(table_page_heights)} of {len(page_text)} pages")
+    page_tables = extract_tables(pdf_path, table_page_heights)
 
-def extract_page_text(page):
-    blocks = page.get_text("dict")["blocks"]
+    return [
+        (page_num, text_blocks, page_tables.get(page_num, []))
+        for page_num, text_blocks in page_text
+    ]
+
+def extract_pages_in_runs(pdf_path, doc, page_nums, prefilter=True):
+    """
+    Serial extraction, one run of PAGE_RUN_SIZE pages at a time.
+    """
+    for run in page_runs(page_nums):
+        yield from extract_pages(pdf_path, doc, run, prefilter)
+
+def extract_page_range(pdf_path, page_nums, prefilter=True):
+    """
+    Worker entry point: open the PDF in this process and extract a run of pages.
+    """
+    with fitz.open(pdf_path) as doc:
+        return extract_pages(pdf_path, doc, page_nums, prefilter)
+
+def extract_pages_parallel(pdf_path, page_nums, workers, prefilter=True):
+    """
+    Extract runs of pages in a process pool.
+
+    Each worker opens its own fitz document. Runs are yielded back in page
+    order so that the caller can merge them exactly as the serial path does.
+    Only a few runs per worker are in flight at a time, so finished runs
+    waiting for an earlier, slower one cannot pile up.
+    """
+    runs = page_runs(page_nums)
+    in_flight = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=setup_logging) as executor:
+        for run in runs:
+            in_flight.append(executor.submit(extract_page_range, pdf_path, run, prefilter))
+            # A couple of runs per worker keeps the pool busy when some pages are slow
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.pop(0).result()
+        for future in in_flight:
+            yield from future.result()
+
+def page_content_hash(page, prefilter=True):
+    """
+    Hash a page's content stream, the resources it draws, and its geometry.
+
+    The content stream alone only names its resources ("/Fm0 Do"), so the
+    streams of the form XObjects it uses and the fonts with their ToUnicode
+    maps are hashed too; changing either changes the extracted text. The hash
+    also covers the cache version and the pre-filter setting, since both
+    change what extraction produces for the same page.
+    """
+    doc = page.parent
+    hasher = hashlib.sha256()
+    hasher.update(f"{EXTRACTION_CACHE_VERSION}:{prefilter}:{tuple(page.rect)}".encode("utf-8"))
+    hasher.update(page.read_contents())
+    # Includes XObjects nested inside other XObjects
+    for xref, *_ in page.get_xobjects():
+        hasher.update(doc.xref_stream(xref) or b"")
+    for xref, *_ in page.get_fonts(full=True):
+        hasher.update(doc.xref_object(xref, compressed=True).encode("utf-8"))
+        kind, value = doc.xref_get_key(xref, "ToUnicode")
+        if kind == "xref":
+            hasher.update(doc.xref_stream(int(value.split()[0])) or b"")
+    return hasher.hexdigest()
+
+class ExtractionCache:
+    """
+    Per-page extraction results in a SQLite file, keyed by page content
+    hash. Pages can be looked up and added one run at a time, so neither
+    the cache nor a run's results ever have to be held in memory whole.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " hash TEXT PRIMARY KEY,"
+            " records TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def contains(self, page_hashes):
+        """
+        The subset of page_hashes that is cached.
+        """
+        page_hashes = list(page_hashes)
+        found = set()
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(page_hashes), 500):
+            batch = page_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(row[0] for row in self._conn.execute(
+                f"SELECT hash FROM pages WHERE hash IN ({placeholders})", batch
+            ))
+        return found
+
+    def get(self, page_hash):
+        row = self._conn.execute("SELECT records FROM pages WHERE hash = ?", (page_hash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, pages):
+        """
+        Store the block records of several pages, committed together.
+        """
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?)",
+            [(page_hash, json.dumps(records, ensure_ascii=False)) for page_hash, records in pages.items()],
+        )
+        self._conn.commit()
+
+    def prune(self, page_hashes):
+        """
+        Drop every page not in page_hashes.
+        """
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (hash TEXT PRIMARY KEY)")
+        self._conn.execute("DELETE FROM keep")
+        self._conn.executemany("INSERT OR IGNORE INTO keep VALUES (?)", [(page_hash,) for page_hash in page_hashes])
+        removed = self._conn.execute("DELETE FROM pages WHERE hash NOT IN (SELECT hash FROM keep)").rowcount
+        self._conn.commit()
+        logging.info(f"Extraction cache at {self.path}: {len(page_hashes)} pages kept, {removed} stale pages dropped")
+
+    def close(self):
+        self._conn.close()
+
+def extract_page_text(page, blocks=None):
+    if blocks is None:
+        blocks = page.get_text("dict")["blocks"]
 
     # Extract text blocks with positions
     text_blocks = []
@@ -78,7 +333,86 @@ def extract_page_text(page):
     text_blocks.sort(key=lambda b: (b["y0"], b["x0"]))
     return text_blocks
 
-def extract_page_tables(pdf_path, page_num):
+def page_has_table_structure(page, blocks=None):
+    """
+    Cheap layout check for whether a page may contain a table.
+
+    A page is considered tabular if it has several horizontal ruling lines,
+    or if several text rows share the same set of column start positions.
+    False positives only cost a Camelot call; pages failing both checks are
+    skipped entirely.
+    """
+    # Ruling lines, drawn either as lines or as thin rectangles
+    ruling_lines = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) < 1 and abs(p1.x - p2.x) >= MIN_RULE_LENGTH:
+                    ruling_lines += 1
+            elif item[0] == "re":
+                rect = item[1]
+                if rect.height < 2 and rect.width >= MIN_RULE_LENGTH:
+                    ruling_lines += 1
+    if ruling_lines >= MIN_RULING_LINES:
+        return True
+
+    # Column-aligned text: group line start positions into rows by baseline
+    if blocks is None:
+        blocks = page.get_text("dict")["blocks"]
+    rows = {}
+    for block in blocks:
+        if block["type"] != 0:
+            continue
+        for line in block["lines"]:
+            row_key = round(line["bbox"][3])
+            column_key = round(line["bbox"][0] / COLUMN_TOLERANCE)
+            rows.setdefault(row_key, set()).add(column_key)
+
+    # Count how many multi-column rows start a cell at each column position
+    column_counts = {}
+    for columns in rows.values():
+        if len(columns) >= MIN_ALIGNED_COLUMNS:
+            for column_key in columns:
+                column_counts[column_key] = column_counts.get(column_key, 0) + 1
+    aligned_columns = sum(1 for count in column_counts.values() if count >= MIN_ALIGNED_ROWS)
+    return aligned_columns >= MIN_ALIGNED_COLUMNS
+
+def extract_tables(pdf_path, page_heights):
+    """
+    Extract tables from the given pages with a single Camelot call.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        page_heights (dict): Maps 0-based page numbers to page heights.
+
+    Returns:
+        dict: Maps 0-based page numbers to lists of table blocks.
+    """
+    if not page_heights:
+        return {}
+
+    try:
+        tables = camelot.read_pdf(
+            pdf_path,
+            pages=",".join(str(page_num + 1) for page_num in sorted(page_heights)),
+            flavor='stream',  # Use 'stream' flavor for PDFs without ruling lines
+        )
+    except Exception as e:
+        # Fall back to page-by-page extraction so one bad page doesn't lose every table
+        logging.warning(f"Batched table extraction failed, retrying page by page: {e}")
+        return {
+            page_num: extract_page_tables(pdf_path, page_num, page_height)
+            for page_num, page_height in page_heights.items()
+        }
+
+    page_tables = {}
+    for table in tables:
+        page_num = int(table.page) - 1  # Camelot pages are 1-indexed
+        page_tables.setdefault(page_num, []).append(table_to_block(table, page_heights[page_num]))
+    return page_tables
+
+def extract_page_tables(pdf_path, page_num, page_height=None):
     # Extract tables using Camelot
     try:
         tables = camelot.read_pdf(
@@ -86,27 +420,28 @@ def extract_page_tables(pdf_path, page_num):
             pages=str(page_num + 1),  # Camelot pages are 1-indexed
             flavor='stream',  # Use 'stream' flavor for PDFs without ruling lines
         )
-        page_tables = []
-        for idx, table in enumerate(tables):
-            df = table.df
-            table_text = df.to_csv(sep='\t', index=False, header=False)
-            bbox = table._bbox  # Bounding box of the table (x1, y1, x2, y2)
-            # Adjust y0 to match PyMuPDF coordinate system
+        if page_height is None:
             page_height = get_page_height(pdf_path, page_num)
-            y0 = page_height - bbox[1]  # Convert y1 from Camelot to y0 in PyMuPDF
-            x0 = bbox[0]  # x0 is the same in both coordinate systems
-
-            page_tables.append({
-                "text": f"[TABLE]\n{table_text.strip()}\n[/TABLE]",
-                "bbox": (x0, y0, bbox[2], bbox[3]),
-                "y0": y0,
-                "x0": x0,
-            })
-        return page_tables
+        return [table_to_block(table, page_height) for table in tables]
     except Exception as e:
         logging.warning(f"Failed to extract tables on page {page_num + 1}: {e}")
         return []
 
+def table_to_block(table, page_height):
+    df = table.df
+    table_text = df.to_csv(sep='\t', index=False, header=False)
+    bbox = table._bbox  # Bounding box of the table (x1, y1, x2, y2)
+    # Adjust y0 to match PyMuPDF coordinate system
+    y0 = page_height - bbox[1]  # Convert y1 from Camelot to y0 in PyMuPDF
+    x0 = bbox[0]  # x0 is the same in both coordinate systems
+
+    return {
+        "text": f"[TABLE]\n{table_text.strip()}\n[/TABLE]",
+        "bbox": (x0, y0, bbox[2], bbox[3]),
+        "y0": y0,
+        "x0": x0,
+    }
+
 def get_page_height(pdf_path, page_num):
     with fitz.open(pdf_path) as doc:
         page = doc.load_page(page_num)
@@ -114,25 +449,70 @@ def get_page_height(pdf_path, page_num):
 
 def merge_blocks(text_blocks, table_blocks):
     # Combine text blocks and table blocks based on positions
+    return render_records(page_records(text_blocks, table_blocks))
+
+def page_records(text_blocks, table_blocks):
+    """
+    Turn a page's text and table blocks into ordered block records.
+
+    Each record holds the block's bbox, its kind (heading, list, table or
+    text), the heading level for headings, and the text itself.
+    """
     all_blocks = text_blocks + table_blocks
 
     # Sort blocks by y0 (top coordinate), then x0 (left coordinate)
     all_blocks.sort(key=lambda b: (b["y0"], b["x0"]))
 
-    page_content = ""
+    records = []
     for block in all_blocks:
         text = block["text"]
-        if is_heading(text):
+        kind = classify_block(text)
+        records.append({
+            "bbox": [round(float(v), 2) for v in block["bbox"]],
+            "kind": kind,
+            "level": heading_level(text) if kind == "heading" else None,
+            "text": text,
+        })
+    return records
+
+def render_records(records):
+    """
+    Render a page's block records as the flat text written to extracted_text.txt.
+    """
+    page_content = ""
+    for record in records:
+        text = record["text"]
+        kind = record["kind"]
+        if kind == "heading":
             page_content += f"\n\n{text}\n\n"
-        elif is_list_item(text):
+        elif kind == "list":
             page_content += f"- {text}\n"
-        elif "[TABLE]" in text:
+        elif kind == "table":
             page_content += f"\n{text}\n"
         else:
             page_content += text + " "
 
     return page_content.strip()
 
+def classify_block(text):
+    if is_heading(text):
+        return "heading"
+    if is_list_item(text):
+        return "list"
+    if "[TABLE]" in text:
+        return "table"
+    return "text"
+
+def heading_level(text):
+    """
+    Nesting depth of a heading from its section code ('B.' -> 1, 'B.5.2' -> 3).
+    Headings without a section code are treated as top level.
+    """
+    match = re.match(r'^((?:[A-Z\d]{1,3}\.)+(?:[A-Z\d]{1,3}\b)?)', text)
+    if not match:
+        return 1
+    return len([part for part in match.group(1).split('.') if part])
+
 def is_heading(text):
     """
     Determine if a block of text is a heading based on heuristics.
@@ -157,6 +537,25 @@ def is_list_item(text):
 
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract text and tables from the ESUR guidelines PDF.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes to split pages across (1 = serial).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-extract every page instead of reusing the per-page extraction cache.",
+    )
+    parser.add_argument(
+        "--no-prefilter",
+        action="store_true",
+        help="Run Camelot on every page instead of only pages that look tabular.",
+    )
+    args = parser.parse_args()
+
     # Adjust paths based on your directory structure
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # Directory containing extractPDF.py
     SCRIPTS_DIR = BASE_DIR  # Since extractPDF.py is in the Scripts directory
@@ -166,9 +565,11 @@ if __name__ == "__main__":
 
     PDF_FILENAME = "ESUR.pdf"
     OUTPUT_TEXT_FILENAME = "extracted_text.txt"
+    OUTPUT_RECORDS_FILENAME = "extracted_text.jsonl"
 
     pdf_path = os.path.join(DATA_DIR, PDF_FILENAME)
     output_text_path = os.path.join(OUTPUT_DIR, OUTPUT_TEXT_FILENAME)
+    output_records_path = os.path.join(OUTPUT_DIR, OUTPUT_RECORDS_FILENAME)
 
     # Ensure the Data directory exists
     if not os.path.exists(DATA_DIR):
@@ -180,5 +581,12 @@ if __name__ == "__main__":
         logging.error(f"PDF file not found at {pdf_path}")
         sys.exit(1)
 
-    extract_text_and_tables(pdf_path, output_text_path)
+    extract_text_and_tables(
+        pdf_path,
+        output_text_path,
+        workers=args.workers,
+        prefilter=not args.no_prefilter,
+        cache_path=False if args.no_cache else None,
+        output_records_path=output_records_path,
+    )
 
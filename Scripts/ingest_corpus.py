@@ -0,0 +1,310 @@
+# Scripts/ingest_corpus.py
+#
+# Ingest every guideline PDF under Data/ into one combined corpus:
+#
+#   python Scripts/ingest_corpus.py [--workers N]
+#
+# Each document is extracted and chunked into its own folder under
+# Scripts/corpus/documents/, then embedded. A manifest records every document's
+# id, version, file hash and the chunk id range it occupies in the combined
+# index. Documents whose hash matches the previous manifest are skipped.
+# Point main.py at the result with ESUR_ARTIFACTS_DIR=Scripts/corpus.
+
+import os
+import re
+import sys
+import json
+import pickle
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Make the project root importable when run as a script
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(SCRIPTS_DIR)
+sys.path.append(PROJECT_DIR)
+
+from Scripts.extractPDF import extract_text_and_tables
+from Scripts.embedding_cache import EmbeddingCache
+from Scripts.embedding_store import save_embedding_matrix, load_embedding_matrix
+from Scripts.index_builder import build_index, save_index
+from Scripts.chunk_store import ChunkStore
+from Scripts.snapshot import SNAPSHOTS_DIRNAME, write_snapshot
+from Scripts.utils import (
+    setup_logging,
+    embed_corpus,
+    set_embedding_cache,
+    iter_extracted_records,
+    split_records_by_headlines,
+    fit_chunks_to_model,
+    embedding_model_id,
+)
+
+DATA_DIR = os.path.join(PROJECT_DIR, 'Data')
+CORPUS_DIR = os.path.join(SCRIPTS_DIR, 'corpus')
+
+MANIFEST_FILENAME = "manifest.json"
+DOCUMENTS_FILENAME = "documents.pkl"
+METADATA_FILENAME = "document_metadata.pkl"
+CHUNK_IDS_FILENAME = "chunk_ids.pkl"
+EMBEDDINGS_FILENAME = "document_embeddings.npy"
+INDEX_FILENAME = "faiss_index.index"
+EMBEDDING_CACHE_FILENAME = "embedding_cache.sqlite"
+
+# Per-document outputs
+CHUNKS_FILENAME = "chunks.pkl"
+
+# 'ESUR_v10.pdf', 'ESUR-version-10.1.pdf' -> ('ESUR', '10'), ('ESUR', '10.1')
+VERSION_PATTERN = re.compile(r'^(?P<name>.+?)[_\-\s]v(?:ersion)?[_\-\s]?(?P<version>\d+(?:\.\d+)*)$', re.IGNORECASE)
+
+def discover_pdfs(data_dir):
+    """
+    Find every PDF under the data directory, in a stable order.
+    """
+    pdf_paths = []
+    for root, _, filenames in os.walk(data_dir):
+        for filename in filenames:
+            if filename.lower().endswith(".pdf"):
+                pdf_paths.append(os.path.join(root, filename))
+    return sorted(pdf_paths)
+
+def document_identity(pdf_path, data_dir):
+    """
+    Derive a document's manifest key, id and version from its path.
+
+    Returns:
+        tuple: (key, doc_id, version). The key is the path relative to the
+        data directory and is unique; the version comes from a '_v<N>' suffix
+        in the file name when present.
+    """
+    key = os.path.relpath(pdf_path, data_dir).replace(os.sep, "/")
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    match = VERSION_PATTERN.match(stem)
+    if match:
+        return key, match.group("name"), match.group("version")
+    return key, stem, None
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def document_dir(corpus_dir, key):
+    slug = re.sub(r'[^A-Za-z0-9._-]+', '_', os.path.splitext(key)[0])
+    return os.path.join(corpus_dir, "documents", slug)
+
+def load_manifest(corpus_dir):
+    manifest_path = os.path.join(corpus_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {"documents": {}}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def extract_and_chunk(pdf_path, output_dir):
+    """
+    Worker entry point: extract one PDF and split it into headline sections.
+
+    Returns:
+        tuple: (page_count, number of chunks)
+    """
+    setup_logging(logging.INFO)
+    os.makedirs(output_dir, exist_ok=True)
+    stats = extract_text_and_tables(pdf_path, os.path.join(output_dir, "extracted_text.txt"))
+    records = iter_extracted_records(os.path.join(output_dir, "extracted_text.jsonl"))
+    chunks = list(split_records_by_headlines(records))
+
+    with open(os.path.join(output_dir, CHUNKS_FILENAME), "wb") as f:
+        pickle.dump(chunks, f)
+    return stats["pages"], len(chunks)
+
+def fit_document_chunks(output_dir):
+    """
+    Fit a document's sections to the embedding model's token limit (see
+    utils.fit_chunks_to_model). Runs here rather than in the extraction
+    workers so the embedding model is only loaded once.
+
+    Returns:
+        int: Number of chunks.
+    """
+    chunks_path = os.path.join(output_dir, CHUNKS_FILENAME)
+    with open(chunks_path, "rb") as f:
+        chunks = fit_chunks_to_model(pickle.load(f))
+    with open(chunks_path, "wb") as f:
+        pickle.dump(chunks, f)
+    return len(chunks)
+
+def ingest_corpus(data_dir=DATA_DIR, corpus_dir=CORPUS_DIR, workers=1, force=False, embedding_workers=1,
+                  index_policy="auto"):
+    """
+    Extract, chunk and embed every PDF under data_dir into one combined index.
+
+    Args:
+        data_dir (str): Directory searched recursively for PDFs.
+        corpus_dir (str): Output directory for per-document and combined artifacts.
+        workers (int): Number of documents extracted in parallel.
+        force (bool): Re-process every document even if unchanged.
+        embedding_workers (int): Worker processes used for embedding.
+        index_policy (str): FAISS index policy or factory string (see index_builder).
+
+    Returns:
+        dict: The new manifest.
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    previous = load_manifest(corpus_dir)
+    # A different embedding model invalidates every stored vector, but not the extraction
+    model_changed = previous.get("model_name") != embedding_model_id()
+
+    entries = {}
+    to_extract = []
+    to_embed = []
+    for pdf_path in discover_pdfs(data_dir):
+        key, doc_id, version = document_identity(pdf_path, data_dir)
+        sha256 = file_sha256(pdf_path)
+        output_dir = document_dir(corpus_dir, key)
+        entry = {"doc_id": doc_id, "version": version, "path": key, "sha256": sha256}
+
+        old_entry = previous["documents"].get(key)
+        unchanged = (
+            not force
+            and old_entry is not None
+            and old_entry["sha256"] == sha256
+            and os.path.exists(os.path.join(output_dir, CHUNKS_FILENAME))
+        )
+        if unchanged:
+            entry["pages"] = old_entry.get("pages")
+            if model_changed or not os.path.exists(os.path.join(output_dir, EMBEDDINGS_FILENAME)):
+                to_embed.append(key)
+            else:
+                logging.info(f"Skipping unchanged document {key}")
+        else:
+            to_extract.append((key, pdf_path, output_dir))
+            to_embed.append(key)
+        entries[key] = entry
+
+    if not to_extract and not to_embed and entries.keys() == previous["documents"].keys() \
+            and previous.get("index_policy", "auto") == index_policy \
+            and os.path.exists(os.path.join(corpus_dir, INDEX_FILENAME)):
+        logging.info("Corpus is up to date; nothing to do.")
+        return previous
+
+    # Extract and chunk the changed documents in parallel
+    if to_extract:
+        logging.info(f"Extracting {len(to_extract)} document(s) with {workers} worker(s)")
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                key: executor.submit(extract_and_chunk, pdf_path, output_dir)
+                for key, pdf_path, output_dir in to_extract
+            }
+            for key, future in futures.items():
+                entries[key]["pages"], _ = future.result()
+                chunk_count = fit_document_chunks(document_dir(corpus_dir, key))
+                logging.info(f"Extracted {key}: {entries[key]['pages']} pages, {chunk_count} chunks")
+
+    # Embed document by document, optionally sharded over a process pool.
+    # Chunks that survive a revision unchanged come straight from the embedding cache.
+    embedding_cache = EmbeddingCache(os.path.join(corpus_dir, EMBEDDING_CACHE_FILENAME))
+    set_embedding_cache(embedding_cache)
+    for key in to_embed:
+        output_dir = document_dir(corpus_dir, key)
+        with open(os.path.join(output_dir, CHUNKS_FILENAME), "rb") as f:
+            chunks = pickle.load(f)
+        embeddings = embed_corpus([chunk["text"] for chunk in chunks], workers=embedding_workers) if chunks \
+            else np.zeros((0, 0), dtype='float32')
+        save_embedding_matrix(os.path.join(output_dir, EMBEDDINGS_FILENAME), embeddings)
+        logging.info(f"Embedded {len(chunks)} chunks for {key}")
+    set_embedding_cache(None)
+    logging.info(f"Embedding cache stats: {embedding_cache.stats()}")
+    embedding_cache.close()
+
+    return build_combined_index(corpus_dir, entries, index_policy)
+
+def build_combined_index(corpus_dir, entries, index_policy="auto"):
+    """
+    Concatenate every document's chunks and embeddings into one FAISS index.
+
+    The index returns stable chunk ids (chunk_ids.pkl); each manifest entry
+    gets the half-open [chunk_start, chunk_end) range its chunks occupy in
+    documents.pkl.
+    """
+    documents = []
+    metadata = []
+    embedding_parts = []
+    for key in sorted(entries):
+        entry = entries[key]
+        output_dir = document_dir(corpus_dir, key)
+        with open(os.path.join(output_dir, CHUNKS_FILENAME), "rb") as f:
+            chunks = pickle.load(f)
+        embeddings = load_embedding_matrix(os.path.join(output_dir, EMBEDDINGS_FILENAME))
+
+        entry["chunk_start"] = len(documents)
+        for chunk in chunks:
+            documents.append(chunk["text"])
+            metadata.append({
+                "doc_id": entry["doc_id"],
+                "version": entry["version"],
+                "path": key,
+                "heading": chunk["heading"],
+                "page_start": chunk["page_start"],
+                "page_end": chunk["page_end"],
+            })
+        entry["chunk_end"] = len(documents)
+        if len(chunks):
+            embedding_parts.append(embeddings)
+
+    if not embedding_parts:
+        raise ValueError("No chunks were extracted from the documents in the corpus")
+
+    document_embeddings = np.vstack(embedding_parts).astype('float32')
+    chunk_store = ChunkStore.from_chunks(documents, metadata)
+    index, index_params = build_index(document_embeddings, index_policy, ids=chunk_store.ids())
+
+    chunk_store.save(
+        os.path.join(corpus_dir, DOCUMENTS_FILENAME),
+        os.path.join(corpus_dir, CHUNK_IDS_FILENAME),
+        os.path.join(corpus_dir, METADATA_FILENAME),
+    )
+    save_embedding_matrix(os.path.join(corpus_dir, EMBEDDINGS_FILENAME), document_embeddings)
+    save_index(index, os.path.join(corpus_dir, INDEX_FILENAME), index_params)
+    snapshot_id = write_snapshot(os.path.join(corpus_dir, SNAPSHOTS_DIRNAME), chunk_store,
+                                 document_embeddings, index, index_params, embedding_model_id())
+
+    manifest = {
+        "model_name": embedding_model_id(),
+        "chunk_count": len(documents),
+        "index_policy": index_policy,
+        "snapshot_id": snapshot_id,
+        "documents": entries,
+    }
+    with open(os.path.join(corpus_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    logging.info(f"Built combined index with {len(documents)} chunks from {len(entries)} document(s)")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest every PDF under Data/ into one combined index.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory searched for PDFs.")
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR, help="Output directory for the combined corpus.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of documents extracted in parallel.")
+    parser.add_argument("--embedding-workers", type=int, default=1,
+                        help="Worker processes used for embedding (1 = in process).")
+    parser.add_argument("--force", action="store_true", help="Re-process documents even if unchanged.")
+    parser.add_argument("--index", default="auto",
+                        help="Index policy (auto, flat, ivf-flat, ivf-pq, hnsw) or a FAISS factory string.")
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    ingest_corpus(
+        args.data_dir,
+        args.corpus_dir,
+        workers=args.workers,
+        force=args.force,
+        embedding_workers=args.embedding_workers,
+        index_policy=args.index,
+    )
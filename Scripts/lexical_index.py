@@ -0,0 +1,184 @@
+# Scripts/lexical_index.py
+#
+# BM25 over the same chunks as the FAISS index, for the exact terms dense
+# embeddings blur together: drug names, thresholds such as
+# "GFR < 30 ml/min/1.73 m2" and section codes such as "B.7.".
+#
+# Postings are stored as flat numpy arrays (CSR layout: one offset per term
+# into shared row and weight arrays). Each posting already holds its BM25
+# term weight, length normalization included, and the IDF of every term is
+# precomputed, so a query is one vectorized add per query term. Results are
+# chunk ids, ready to be fused with the dense ranking (fuse_rankings).
+
+import re
+import logging
+
+import numpy as np
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant; higher values flatten the rank contributions
+RRF_K = 60
+
+# Section codes (b.4.1), decimal numbers (1.73), then words and plain numbers
+TOKEN_PATTERN = re.compile(r"[a-z]\.\d+(?:\.\d+)*|\d+(?:[.,]\d+)+|[^\W_]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could do does for from had has have how if in into is it its
+may might must no not of on or should so such than that the their then there these they this to
+was were what when which who will with would
+""".split())
+
+def tokenize(text):
+    """
+    Lower-cased terms of a text, keeping section codes and decimals whole.
+    """
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+class LexicalIndex:
+    """
+    Immutable BM25 index over a list of chunks, searched by chunk id.
+    """
+
+    def __init__(self, chunk_ids, vocabulary, offsets, rows, weights, idf):
+        self.chunk_ids = chunk_ids    # int64, row -> chunk id
+        self.vocabulary = vocabulary  # term -> term id
+        self.offsets = offsets        # int64, postings of term t are [offsets[t], offsets[t + 1])
+        self.rows = rows              # int32, chunk row of each posting
+        self.weights = weights        # float32, BM25 term weight of each posting
+        self.idf = idf                # float32, per term
+
+    @classmethod
+    def build(cls, chunk_ids, texts, k1=BM25_K1, b=BM25_B):
+        """
+        Build the index.
+
+        Args:
+            chunk_ids (list): Chunk ids, as used by the FAISS index.
+            texts (list): Chunk texts, aligned with chunk_ids.
+            k1 (float, optional): BM25 term frequency saturation.
+            b (float, optional): BM25 length normalization.
+
+        Returns:
+            LexicalIndex: The index.
+        """
+        vocabulary = {}
+        term_ids = []
+        rows = []
+        freqs = []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                rows.append(row)
+                freqs.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int32)
+        freqs = np.asarray(freqs, dtype=np.float32)
+
+        # Group postings by term
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, rows, freqs = term_ids[order], rows[order], freqs[order]
+        document_freqs = np.bincount(term_ids, minlength=len(vocabulary))
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(document_freqs, out=offsets[1:])
+
+        count = max(len(texts), 1)
+        average_length = max(float(lengths.mean()) if len(texts) else 0.0, 1.0)
+        idf = np.log1p((count - document_freqs + 0.5) / (document_freqs + 0.5)).astype(np.float32)
+        norms = k1 * (1 - b + b * lengths[rows] / average_length)
+        weights = (freqs * (k1 + 1) / (freqs + norms)).astype(np.float32)
+
+        return cls(np.asarray(chunk_ids, dtype=np.int64), vocabulary, offsets, rows, weights, idf)
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def scores(self, query):
+        """
+        BM25 score of every chunk row for a query.
+        """
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            # Rows are unique within a term's postings, so fancy-index add is safe
+            scores[self.rows[start:end]] += self.idf[term] * self.weights[start:end]
+        return scores
+
+    def search(self, query, k=10):
+        """
+        Top-k chunks for a query.
+
+        Returns:
+            tuple: (chunk ids, scores), best first; chunks with no matching term are left out.
+        """
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[scores[top] > 0]
+        return self.chunk_ids[top], scores[top]
+
+def fuse_rankings(dense_ids, dense_scores, lexical_ids, lexical_scores, k,
+                  method="rrf", lexical_weight=0.5):
+    """
+    Fuse a dense and a lexical ranking of chunk ids.
+
+    Args:
+        dense_ids, dense_scores: Dense ranking, best first.
+        lexical_ids, lexical_scores: Lexical ranking, best first.
+        k (int): Number of fused results.
+        method (str, optional): "rrf" (reciprocal rank fusion, scale-free) or
+            "weighted" (scores divided by the best score of their ranking,
+            mixed by lexical_weight).
+        lexical_weight (float, optional): Weight of the lexical side for "weighted".
+
+    Returns:
+        tuple: (chunk ids, fused scores), best first.
+    """
+    fused = {}
+    if method == "rrf":
+        for ranking in (dense_ids, lexical_ids):
+            for rank, cid in enumerate(ranking):
+                fused[int(cid)] = fused.get(int(cid), 0.0) + 1.0 / (RRF_K + rank + 1)
+    elif method == "weighted":
+        for ranking, scores, weight in ((dense_ids, dense_scores, 1 - lexical_weight),
+                                        (lexical_ids, lexical_scores, lexical_weight)):
+            if not len(ranking):
+                continue
+            scores = np.asarray(scores, dtype=np.float32)
+            # Not min-max: that would score the weakest hit, and so a single hit, 0
+            best_score = float(scores.max())
+            if best_score <= 0:
+                continue
+            for cid, score in zip(ranking, np.clip(scores, 0, None) / best_score):
+                fused[int(cid)] = fused.get(int(cid), 0.0) + weight * float(score)
+    else:
+        raise ValueError(f"Unknown fusion method {method!r}; expected 'rrf' or 'weighted'")
+
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [cid for cid, _ in best], [score for _, score in best]
+
+def build_lexical_index(store):
+    """
+    Build the lexical index over a chunk_store.ChunkStore.
+    """
+    lexical_index = LexicalIndex.build(store.ids(), store.texts())
+    logging.info(f"Built lexical index: {len(lexical_index)} chunks, {len(lexical_index.vocabulary)} terms")
+    return lexical_index
@@ -0,0 +1,139 @@
+# Scripts/rerank.py
+#
+# Second-stage reranking of retrieved chunks with a small cross-encoder on
+# CPU. Retrieval over-fetches candidates (e.g. 30); the cross-encoder reads
+# each (question, chunk) pair together and keeps the best k, which is a much
+# better judge of relevance than the bi-encoder distance alone.
+#
+# Scores are cached per (question, chunk id), so repeated questions cost
+# nothing. Scoring runs in batches against a millisecond budget, checked
+# after every batch: once it is exceeded with batches still to go, the
+# retrieval order is kept for this request (the scores computed so far are
+# still cached). A last batch that ends over budget is still used.
+
+import time
+import logging
+import threading
+
+import numpy as np
+
+from Scripts.memory_cache import LRUCache
+from Scripts.utils import normalize_query
+
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_MAX_LENGTH = 512   # Tokens of question + chunk the cross-encoder reads
+RERANK_BATCH_SIZE = 16    # Pairs per forward pass
+RERANK_BUDGET_MS = 400    # Per request; over budget falls back to the retrieval order
+
+# (question, chunk id) -> cross-encoder score
+RERANK_CACHE_SIZE = 8192
+RERANK_CACHE_TTL = 6 * 60 * 60  # Seconds
+
+_reranker = None
+_reranker_lock = threading.Lock()
+score_cache = LRUCache(RERANK_CACHE_SIZE, RERANK_CACHE_TTL)
+rerank_stats = {"requests": 0, "reranked": 0, "over_budget": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+def get_reranker():
+    """
+    Return the shared cross-encoder, loading it on first use (CPU only).
+    """
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                from sentence_transformers import CrossEncoder
+                logging.info(f"Loading reranker {RERANK_MODEL_NAME}")
+                _reranker = CrossEncoder(RERANK_MODEL_NAME, max_length=RERANK_MAX_LENGTH, device="cpu")
+    return _reranker
+
+def warm_up_reranker():
+    """
+    Load the cross-encoder and score one pair, so the first request's budget
+    is not spent on loading the model.
+    """
+    get_reranker().predict([("warm-up", "warm-up")], convert_to_numpy=True)
+    logging.info("Reranker warmed up")
+
+def get_rerank_stats():
+    """
+    Reranking counters plus the hit rate of the score cache.
+    """
+    with _stats_lock:
+        stats = dict(rerank_stats)
+    return {**stats, "score_cache": score_cache.stats()}
+
+def _count(name):
+    # Requests rerank concurrently in the server's threads
+    with _stats_lock:
+        rerank_stats[name] += 1
+
+def rerank(query, chunks, ids, distances, k, budget_ms=RERANK_BUDGET_MS):
+    """
+    Rerank retrieved chunks with the cross-encoder and keep the best k.
+
+    Args:
+        query (str): The question.
+        chunks (list): Candidate chunk texts, in retrieval order.
+        ids (list): Chunk ids of the candidates, used as cache keys.
+        distances (list): Retrieval scores of the candidates.
+        k (int): Number of chunks to keep.
+        budget_ms (float, optional): Time allowed for scoring. None disables the budget.
+
+    Returns:
+        tuple: (chunks, ids, distances) of the k kept chunks, best first; the
+            first k in retrieval order if scoring failed or ran over budget.
+            Distances stay the retrieval scores.
+    """
+    _count("requests")
+    fallback = (chunks[:k], ids[:k], distances[:k])
+    if len(chunks) <= 1:
+        return fallback
+
+    start = time.perf_counter()
+    key = normalize_query(query)
+    scores = np.empty(len(chunks), dtype=np.float32)
+    missing = []
+    for pos, cid in enumerate(ids):
+        score = score_cache.get((key, int(cid)))
+        if score is None:
+            missing.append(pos)
+        else:
+            scores[pos] = score
+
+    try:
+        model = get_reranker()
+        for batch_start in range(0, len(missing), RERANK_BATCH_SIZE):
+            batch = missing[batch_start:batch_start + RERANK_BATCH_SIZE]
+            batch_scores = model.predict(
+                [(query, chunks[pos]) for pos in batch],
+                batch_size=len(batch),
+                convert_to_numpy=True,
+            )
+            for pos, score in zip(batch, batch_scores):
+                scores[pos] = score
+                score_cache.put((key, int(ids[pos])), float(score))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            remaining = len(missing) - batch_start - len(batch)
+            if budget_ms is not None and elapsed_ms > budget_ms and remaining:
+                _count("over_budget")
+                logging.warning(
+                    f"Reranking over its {budget_ms} ms budget ({elapsed_ms:.0f} ms) after "
+                    f"{batch_start + len(batch)} of {len(missing)} uncached pairs; keeping the retrieval order"
+                )
+                return fallback
+    except Exception as e:
+        _count("failed")
+        logging.error(f"Error in rerank: {e}; keeping the retrieval order")
+        return fallback
+
+    # Stable, so ties keep their retrieval order
+    order = np.argsort(-scores, kind="stable")[:k]
+    _count("reranked")
+    logging.debug(
+        f"Reranked {len(chunks)} candidates in {(time.perf_counter() - start) * 1000:.1f} ms "
+        f"({len(chunks) - len(missing)} cached): kept {[ids[pos] for pos in order]}, "
+        f"scores {scores[order].tolist()}"
+    )
+    return [chunks[pos] for pos in order], [ids[pos] for pos in order], [distances[pos] for pos in order]
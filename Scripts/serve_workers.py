@@ -0,0 +1,163 @@
+# Scripts/serve_workers.py
+#
+# Pre-fork retrieval server: one listening socket, N forked worker processes
+# accepting on it. The current snapshot's index is shared between the
+# workers in one of two ways:
+#
+#   --index-io mmap   each worker maps index.faiss; the pages live once in the page cache
+#   --preload         the parent loads the snapshot and then forks (fork-after-load);
+#                     the read-only index pages stay shared copy-on-write
+#
+# Without either, every worker reads its own copy of the index. The embedding
+# model is always loaded after the fork (torch is not fork-safe), so it is
+# per worker.
+#
+# Endpoints:
+#   GET /health              worker pid and snapshot id
+#   GET /search?q=...&k=3    retrieve_documents for a question
+#   GET /probe?n=32          search n random vectors, without the embedding model
+#
+#   python Scripts/serve_workers.py --workers 4 [--index-io mmap] [--preload] [--port 8765]
+#
+# Linux/macOS only (os.fork). See bench_memory.py for per-worker memory.
+
+import os
+import sys
+import json
+import signal
+import socket
+import logging
+import argparse
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts import utils
+from Scripts.snapshot import SNAPSHOTS_DIRNAME, load_snapshot
+from Scripts.lexical_index import build_lexical_index
+
+DEFAULT_SNAPSHOTS_DIR = os.path.join(os.environ.get("ESUR_ARTIFACTS_DIR", SCRIPTS_DIR), SNAPSHOTS_DIRNAME)
+
+# Largest k a /search request may ask for
+MAX_K = 100
+
+snapshot = None  # Set in each worker before serving
+
+class RetrievalHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/health":
+            payload = {"pid": os.getpid(), "snapshot_id": snapshot.snapshot_id}
+        elif url.path == "/search" and not self.server.probe_only:
+            query = params.get("q", [""])[0]
+            try:
+                k = int(params.get("k", ["3"])[0])
+            except ValueError:
+                k = 0
+            if not 1 <= k <= MAX_K:
+                self.send_error(400, f"k must be an integer from 1 to {MAX_K}")
+                return
+            chunks, ids, distances = utils.retrieve_documents(query, k=k, return_details=True)
+            payload = {"chunks": chunks, "ids": [int(cid) for cid in ids], "distances": distances}
+        elif url.path == "/probe":
+            count = int(params.get("n", ["32"])[0])
+            vectors = np.random.default_rng().standard_normal((count, snapshot.index.d), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            snapshot.index.search(vectors, 10)
+            payload = {"pid": os.getpid(), "searched": count}
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"[{os.getpid()}] {format % args}")
+
+def run_worker(listener, snapshots_dir, index_io, probe_only):
+    global snapshot
+    if snapshot is None:
+        snapshot = load_snapshot(
+            snapshots_dir,
+            model_name=None if probe_only else utils.embedding_model_id(),
+            index_io=index_io,
+        )
+    utils.set_documents(snapshot.store)
+    utils.set_index(snapshot.index, snapshot.manifest["index"])
+    if not probe_only:
+        # Same hybrid retrieval as main.py; the BM25 postings are small and built per worker
+        utils.set_lexical_index(build_lexical_index(snapshot.store))
+
+    server = HTTPServer(listener.getsockname(), RetrievalHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    server.probe_only = probe_only
+    logging.info(f"Worker {os.getpid()} serving snapshot {snapshot.snapshot_id}")
+    server.serve_forever()
+
+def serve(workers, port, snapshots_dir, index_io="copy", preload=False, probe_only=False):
+    """
+    Bind the port, fork the workers and wait for them.
+    """
+    global snapshot
+    if preload:
+        snapshot = load_snapshot(
+            snapshots_dir,
+            model_name=None if probe_only else utils.embedding_model_id(),
+            index_io=index_io,
+        )
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", port))
+    listener.listen(128)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_worker(listener, snapshots_dir, index_io, probe_only)
+            finally:
+                os._exit(1)
+        children.append(pid)
+    logging.info(f"Started {workers} workers on port {port}: {children}")
+
+    def stop(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in children:
+        os.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve retrieval from N forked worker processes.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--snapshots-dir", default=DEFAULT_SNAPSHOTS_DIR)
+    parser.add_argument("--index-io", choices=["copy", "mmap"], default="mmap")
+    parser.add_argument("--preload", action="store_true",
+                        help="Load the snapshot before forking so workers share it copy-on-write.")
+    parser.add_argument("--probe-only", action="store_true",
+                        help="Only serve /health and /probe; skips the embedding model check.")
+    args = parser.parse_args()
+
+    utils.setup_logging(logging.INFO)
+    serve(args.workers, args.port, args.snapshots_dir, args.index_io, args.preload, args.probe_only)
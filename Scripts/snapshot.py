@@ -0,0 +1,315 @@
+# Scripts/snapshot.py
+#
+# Versioned snapshots bundling everything retrieval needs, written together
+# so they cannot drift apart:
+#
+#   snapshots/CURRENT                 id of the snapshot to serve
+#   snapshots/<id>/manifest.json      model, dimension, chunk count, index params,
+#                                     size and sha256 of every section
+#   snapshots/<id>/ids.npy            int64 chunk ids              (memory-mapped)
+#   snapshots/<id>/embeddings.npy     float32/float16 embeddings   (memory-mapped)
+#   snapshots/<id>/chunks.pkl         chunk texts and metadata
+#   snapshots/<id>/index.faiss        id-mapped FAISS index
+#
+# Loading checks the manifest against the files in O(1): format version,
+# model, section sizes and the shapes in the .npy headers and the index.
+# The sha256 of every section is only recomputed by verify_snapshot().
+#
+#   python Scripts/snapshot.py list|verify [--id ID] [--snapshots-dir DIR]
+
+import os
+import sys
+import json
+import time
+import shutil
+import itertools
+import pickle
+import hashlib
+import logging
+import argparse
+from collections import namedtuple
+
+import faiss
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+
+from Scripts.chunk_store import ChunkStore
+from Scripts.embedding_store import save_embedding_matrix, load_embedding_matrix, load_embedding_model_name
+from Scripts.index_builder import apply_search_params, read_index
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOTS_DIRNAME = "snapshots"
+CURRENT_FILENAME = "CURRENT"
+MANIFEST_FILENAME = "manifest.json"
+IDS_FILENAME = "ids.npy"
+EMBEDDINGS_FILENAME = "embeddings.npy"
+CHUNKS_FILENAME = "chunks.pkl"
+INDEX_FILENAME = "index.faiss"
+SECTION_FILENAMES = (IDS_FILENAME, EMBEDDINGS_FILENAME, CHUNKS_FILENAME, INDEX_FILENAME)
+
+# Older snapshots kept next to the current one, for rollback
+SNAPSHOT_RETENTION = 3
+
+Snapshot = namedtuple("Snapshot", ["snapshot_id", "path", "manifest", "store", "embeddings", "index"])
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot is missing sections or they disagree with its manifest."""
+
+def _file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def current_snapshot_id(snapshots_dir):
+    """
+    Id of the snapshot CURRENT points to, or None if there is none yet.
+    """
+    current_path = os.path.join(snapshots_dir, CURRENT_FILENAME)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path, "r", encoding="utf-8") as f:
+        return f.read().strip() or None
+
+def _set_current(snapshots_dir, snapshot_id):
+    temp_path = os.path.join(snapshots_dir, CURRENT_FILENAME + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(snapshot_id + "\n")
+    os.replace(temp_path, os.path.join(snapshots_dir, CURRENT_FILENAME))
+
+def list_snapshots(snapshots_dir):
+    if not os.path.isdir(snapshots_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(snapshots_dir)
+        if os.path.exists(os.path.join(snapshots_dir, name, MANIFEST_FILENAME))
+    )
+
+def write_snapshot(snapshots_dir, store, embeddings, index, index_params, model_name, dtype="float32"):
+    """
+    Write a new snapshot and make it current.
+
+    Sections are written to a temporary directory that is renamed into place
+    only once complete, so readers never see a partial snapshot.
+
+    Args:
+        snapshots_dir (str): Directory holding the snapshots.
+        store (ChunkStore): Chunks, in the row order of embeddings.
+        embeddings (np.ndarray): (len(store), dimension) embeddings.
+        index (faiss.Index): Id-mapped index over the same chunks.
+        index_params (dict): Parameters from index_builder.build_index.
+        model_name (str): utils.embedding_model_id() of the embeddings.
+        dtype (str, optional): Embedding storage type. Defaults to "float32".
+
+    Returns:
+        str: The new snapshot id.
+    """
+    ids = np.asarray(store.ids(), dtype=np.int64)
+    if embeddings.shape[0] != len(ids) or index.ntotal != len(ids):
+        raise SnapshotError(
+            f"Refusing to snapshot {len(ids)} chunks with {embeddings.shape[0]} embeddings "
+            f"and {index.ntotal} indexed vectors"
+        )
+
+    # Identifies the content: which chunks, embedded by which model
+    content_hash = hashlib.sha256(ids.tobytes() + model_name.encode("utf-8")).hexdigest()
+    snapshot_id, temp_dir = _new_snapshot_dir(snapshots_dir, content_hash)
+    final_dir = os.path.join(snapshots_dir, snapshot_id)
+    try:
+        manifest = _write_sections(temp_dir, snapshot_id, content_hash, store, ids, embeddings,
+                                   index, index_params, model_name, dtype)
+        os.rename(temp_dir, final_dir)
+    except BaseException:
+        # Never leave a half-written snapshot behind
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    _set_current(snapshots_dir, snapshot_id)
+    logging.info(f"Wrote snapshot {snapshot_id} with {manifest['chunk_count']} chunks to {final_dir}")
+
+    prune_snapshots(snapshots_dir)
+    return snapshot_id
+
+def _new_snapshot_dir(snapshots_dir, content_hash):
+    """
+    Pick an unused snapshot id and create its temporary directory.
+
+    Ids sort by creation time (to the microsecond); a counter separates
+    snapshots of the same content written within the same microsecond.
+    """
+    os.makedirs(snapshots_dir, exist_ok=True)
+    now = time.time()
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(now)) + f".{int(now % 1 * 1e6):06d}"
+    for attempt in itertools.count():
+        snapshot_id = f"{stamp}-{content_hash[:8]}" + (f"-{attempt}" if attempt else "")
+        temp_dir = os.path.join(snapshots_dir, "." + snapshot_id + ".tmp")
+        if os.path.exists(os.path.join(snapshots_dir, snapshot_id)):
+            continue
+        try:
+            os.mkdir(temp_dir)
+        except FileExistsError:
+            continue
+        return snapshot_id, temp_dir
+
+def _write_sections(temp_dir, snapshot_id, content_hash, store, ids, embeddings, index, index_params,
+                    model_name, dtype):
+    np.save(os.path.join(temp_dir, IDS_FILENAME), ids)
+    save_embedding_matrix(os.path.join(temp_dir, EMBEDDINGS_FILENAME), embeddings, dtype)
+    with open(os.path.join(temp_dir, CHUNKS_FILENAME), "wb") as f:
+        pickle.dump({
+            "texts": store.texts(),
+            "metadata": [store.metadata(cid) for cid in store.ids()],
+        }, f)
+    faiss.write_index(index, os.path.join(temp_dir, INDEX_FILENAME))
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "snapshot_id": snapshot_id,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "model_name": model_name,
+        "dimension": int(embeddings.shape[1]),
+        "chunk_count": int(len(ids)),
+        "embedding_dtype": dtype,
+        "content_hash": content_hash,
+        "index": index_params,
+        "sections": {
+            name: {
+                "size": os.path.getsize(os.path.join(temp_dir, name)),
+                "sha256": _file_sha256(os.path.join(temp_dir, name)),
+            }
+            for name in SECTION_FILENAMES
+        },
+    }
+    with open(os.path.join(temp_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def prune_snapshots(snapshots_dir, keep=SNAPSHOT_RETENTION):
+    """
+    Delete all but the newest `keep` snapshots besides the current one.
+    """
+    current = current_snapshot_id(snapshots_dir)
+    older = [name for name in list_snapshots(snapshots_dir) if name != current]
+    for name in older[:max(0, len(older) - keep)]:
+        shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+        logging.info(f"Removed old snapshot {name}")
+
+def _read_manifest(snapshot_dir):
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        raise SnapshotError(f"No manifest at {manifest_path}")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def loose_embeddings_model(embeddings_path, snapshots_dir):
+    """
+    Model that produced a loose embedding matrix (document_embeddings.npy):
+    the one recorded with it, else, for matrices saved before that was
+    recorded, the model of the current snapshot, which was built from it.
+
+    Returns:
+        str: The model name, or None if neither is known.
+    """
+    model_name = load_embedding_model_name(embeddings_path)
+    if model_name is None:
+        snapshot_id = current_snapshot_id(snapshots_dir)
+        if snapshot_id is not None:
+            try:
+                model_name = _read_manifest(os.path.join(snapshots_dir, snapshot_id)).get("model_name")
+            except (SnapshotError, ValueError):
+                pass
+    return model_name
+
+def load_snapshot(snapshots_dir, snapshot_id=None, model_name=None, index_io="copy"):
+    """
+    Load a snapshot, checking it against its manifest.
+
+    Args:
+        snapshots_dir (str): Directory holding the snapshots.
+        snapshot_id (str, optional): Snapshot to load. Defaults to CURRENT.
+        model_name (str, optional): Expected embedding model; a snapshot
+            embedded with another model is rejected.
+        index_io (str, optional): "copy" or "mmap" (see index_builder.read_index).
+
+    Returns:
+        Snapshot: The loaded snapshot, or None when there is no snapshot yet.
+
+    Raises:
+        SnapshotError: If the snapshot is incomplete or inconsistent.
+    """
+    snapshot_id = snapshot_id or current_snapshot_id(snapshots_dir)
+    if snapshot_id is None:
+        return None
+    snapshot_dir = os.path.join(snapshots_dir, snapshot_id)
+    manifest = _read_manifest(snapshot_dir)
+
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"Snapshot {snapshot_id} has format {manifest.get('format_version')}, "
+                            f"expected {SNAPSHOT_FORMAT_VERSION}")
+    if model_name is not None and manifest["model_name"] != model_name:
+        raise SnapshotError(f"Snapshot {snapshot_id} was embedded with {manifest['model_name']}, not {model_name}")
+    for name, section in manifest["sections"].items():
+        path = os.path.join(snapshot_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != section["size"]:
+            raise SnapshotError(f"Section {name} of snapshot {snapshot_id} is missing or has the wrong size")
+
+    count, dimension = manifest["chunk_count"], manifest["dimension"]
+    ids = np.load(os.path.join(snapshot_dir, IDS_FILENAME), mmap_mode="r")
+    embeddings = load_embedding_matrix(os.path.join(snapshot_dir, EMBEDDINGS_FILENAME))
+    index = read_index(os.path.join(snapshot_dir, INDEX_FILENAME), index_io)
+    if ids.shape != (count,) or embeddings.shape != (count, dimension) \
+            or index.ntotal != count or index.d != dimension:
+        raise SnapshotError(f"Sections of snapshot {snapshot_id} disagree with its manifest")
+    apply_search_params(index, manifest["index"])
+
+    with open(os.path.join(snapshot_dir, CHUNKS_FILENAME), "rb") as f:
+        chunks = pickle.load(f)
+    store = ChunkStore(ids, chunks["texts"], chunks["metadata"])
+
+    logging.info(f"Loaded snapshot {snapshot_id}: {count} chunks, {manifest['index'].get('factory', 'Flat')} index")
+    return Snapshot(snapshot_id, snapshot_dir, manifest, store, embeddings, index)
+
+def verify_snapshot(snapshots_dir, snapshot_id=None):
+    """
+    Recompute the sha256 of every section and compare it with the manifest.
+
+    Returns:
+        list: Names of the sections that do not match (empty if all do).
+    """
+    snapshot_id = snapshot_id or current_snapshot_id(snapshots_dir)
+    if snapshot_id is None:
+        raise SnapshotError(f"No current snapshot in {snapshots_dir}")
+    snapshot_dir = os.path.join(snapshots_dir, snapshot_id)
+    manifest = _read_manifest(snapshot_dir)
+    return [
+        name for name, section in manifest["sections"].items()
+        if not os.path.exists(os.path.join(snapshot_dir, name))
+        or _file_sha256(os.path.join(snapshot_dir, name)) != section["sha256"]
+    ]
+
+if __name__ == "__main__":
+    from Scripts.utils import setup_logging
+
+    parser = argparse.ArgumentParser(description="Inspect and verify retrieval snapshots.")
+    parser.add_argument("command", choices=["list", "verify"])
+    parser.add_argument("--id", help="Snapshot id; defaults to the current one.")
+    parser.add_argument("--snapshots-dir", default=os.path.join(
+        os.environ.get("ESUR_ARTIFACTS_DIR", SCRIPTS_DIR), SNAPSHOTS_DIRNAME))
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    if args.command == "list":
+        current = current_snapshot_id(args.snapshots_dir)
+        for name in list_snapshots(args.snapshots_dir):
+            manifest = _read_manifest(os.path.join(args.snapshots_dir, name))
+            marker = "*" if name == current else " "
+            print(f"{marker} {name}  {manifest['chunk_count']:7d} chunks  {manifest['model_name']}  "
+                  f"{manifest['index'].get('factory', 'Flat')}")
+    else:
+        mismatched = verify_snapshot(args.snapshots_dir, args.id)
+        if mismatched:
+            logging.error(f"Sections with a wrong checksum: {', '.join(mismatched)}")
+            sys.exit(1)
+        logging.info("All snapshot sections match their checksums")
@@ -8,11 +8,15 @@ Created on Wed Sep 18 11:31:01 2024
 # Scripts/utils.py
 import os
 import re
+import json
+import hashlib
 import logging
+import time
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
 import numpy as np
-import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
+from Scripts.memory_cache import LRUCache
 
 def file_exists(file_path):
     """
@@ -65,76 +69,747 @@ def split_text_into_sections(text):
             sections.append(f"{section_title}\n{section_content}")
     return sections
 
+# Headlines: uppercase lines, or lines starting with numbering like '1.', '1.1.', '2.3.1'
+HEADLINE_PATTERN = re.compile(r"""
+    (?:
+        ^[A-Z][A-Z\s\d\.\-:,]{2,}$      # Lines in uppercase (with possible numbers, dots, hyphens, colons)
+        |
+        ^(?:\d+\.)+\s.*$                # Lines starting with numbering like '1.', '1.1.', '2.3.1'
+    )
+    """, re.MULTILINE | re.VERBOSE)
+
+# Leading section code of a headline, e.g. 'B.5.' or '2.3.1.'
+SECTION_CODE_PATTERN = re.compile(r'(?:[A-Z\d]{1,3}\.)+')
+
+# A headline section as offsets into the source text: the headline spans
+# [start, heading_end) and its content runs on to end.
+HeadlineChunk = namedtuple("HeadlineChunk", ["start", "heading_end", "end", "level"])
+
+def iter_headline_chunks(text):
+    """
+    Walk the text once and yield a HeadlineChunk for every headline section.
+
+    Only offsets are produced; use headline_chunk_text to build the section
+    string when it is needed. Text before the first headline is not part of
+    any section, matching split_text_by_headlines.
+
+    Args:
+        text (str): The extracted text.
+
+    Yields:
+        HeadlineChunk: (start, heading_end, end, level) of each section.
+    """
+    previous = None
+    for match in HEADLINE_PATTERN.finditer(text):
+        if previous is not None:
+            yield _headline_chunk(text, previous, match.start())
+        previous = match
+    if previous is not None:
+        yield _headline_chunk(text, previous, len(text))
+
+def _headline_chunk(text, match, end):
+    code = SECTION_CODE_PATTERN.match(text, match.start())
+    level = code.group().count('.') if code else 1
+    return HeadlineChunk(match.start(), match.end(), end, level)
+
+def headline_chunk_text(text, chunk):
+    """
+    Build the section string for a HeadlineChunk: the headline, then its content.
+    """
+    headline = text[chunk.start:chunk.heading_end].strip()
+    content = text[chunk.heading_end:chunk.end].strip()
+    if content:
+        return f"{headline}\n{content}"
+    return headline
+
 def split_text_by_headlines(text):
     """
     Splits the text into sections based on headlines.
     Headlines are detected based on specific patterns.
     """
-    headline_pattern = re.compile(r"""
-        (?:
-            ^[A-Z][A-Z\s\d\.\-:,]{2,}$      # Lines in uppercase (with possible numbers, dots, hyphens, colons)
-            |
-            ^(?:\d+\.)+\s.*$                # Lines starting with numbering like '1.', '1.1.', '2.3.1'
-        )
-        """, re.MULTILINE | re.VERBOSE)
+    return [headline_chunk_text(text, chunk) for chunk in iter_headline_chunks(text)]
 
-    splits = re.split(headline_pattern, text)
-    headlines = re.findall(headline_pattern, text)
+def chunk_id(text, occurrence=0):
+    """
+    Stable 63-bit id for a chunk, derived from its content.
 
-    sections = []
-    for idx, headline in enumerate(headlines):
-        if idx < len(splits):
-            content = splits[idx + 1].strip() if idx + 1 < len(splits) else ''
-            headline = headline.strip()
-            if content:
-                section = f"{headline}\n{content}"
-            else:
-                section = headline
-            sections.append(section)
-
-    remaining_content = splits[len(headlines) + 1:] if len(splits) > len(headlines) + 1 else []
-    for content in remaining_content:
-        content = content.strip()
-        if content:
-            sections.append(content)
+    Ids only change when the chunk text changes, so they survive inserts and
+    deletes elsewhere in the chunk list. Repeated texts are told apart by
+    their occurrence number.
+    """
+    data = text.encode("utf-8")
+    if occurrence:
+        data += f"\x00{occurrence}".encode("utf-8")
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    # Keep ids positive so they fit FAISS's signed 64-bit ids
+    return int.from_bytes(digest, "big") >> 1
+
+def compute_chunk_ids(chunks):
+    """
+    Compute stable ids for a list of chunk strings.
 
-    return sections
+    Returns:
+        list: One id per chunk, unique within the list.
+    """
+    seen = {}
+    ids = []
+    for text in chunks:
+        occurrence = seen.get(text, 0)
+        seen[text] = occurrence + 1
+        ids.append(chunk_id(text, occurrence))
+    return ids
+
+def iter_extracted_records(records_path):
+    """
+    Lazily read the block records written by extractPDF.extract_text_and_tables.
+
+    Args:
+        records_path (str): Path to the JSONL records file.
+
+    Yields:
+        dict: One block record (page, bbox, kind, level, text) per line.
+    """
+    with open(records_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def split_records_by_headlines(records):
+    """
+    Group a stream of block records into sections that start at each heading.
+
+    Records are consumed lazily, so only the section being built is held in
+    memory. Content before the first heading becomes its own section.
+
+    Args:
+        records (iterable): Block records, e.g. from iter_extracted_records.
+
+    Yields:
+        dict: A section with its 'text', 'heading', heading 'level', and the
+        'page_start' and 'page_end' it spans.
+    """
+    section = None
+    for record in records:
+        if record["kind"] == "heading" or section is None:
+            if section is not None and section["parts"]:
+                yield _finish_section(section)
+            is_heading = record["kind"] == "heading"
+            section = {
+                "heading": record["text"] if is_heading else None,
+                "level": record.get("level") if is_heading else None,
+                "page_start": record["page"],
+                "page_end": record["page"],
+                "parts": [],
+            }
+            if is_heading:
+                section["parts"].append(record["text"] + "\n")
+                continue
+
+        parts = section["parts"]
+        section["page_end"] = record["page"]
+        if record["kind"] in ("list", "table") and parts and not parts[-1].endswith("\n"):
+            # Lists and tables start on their own line
+            parts[-1] = parts[-1].rstrip() + "\n"
+        if record["kind"] == "list":
+            parts.append(f"- {record['text']}\n")
+        elif record["kind"] == "table":
+            parts.append(f"\n{record['text']}\n")
+        else:
+            parts.append(record["text"] + " ")
+
+    if section is not None and section["parts"]:
+        yield _finish_section(section)
+
+def _finish_section(section):
+    parts = section.pop("parts")
+    section["text"] = "".join(parts).strip()
+    return section
 
 # -------------------------------------
 # Model and Global Variables
 # -------------------------------------
 
-embedding_model = SentenceTransformer("sentence-transformers/all-mpnet-base-v2")
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+
+# Backend running the model: "torch", "onnx" or "onnx-int8" (see Scripts/embedding_backends.py)
+EMBEDDING_BACKEND = os.environ.get("ESUR_EMBEDDING_BACKEND", "torch")
 
-documents = None  # Will be set by main.py
+# Loaded on first use by get_embedding_model; importing this module stays cheap
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+class ReadWriteLock:
+    """
+    Shared access for any number of readers, exclusive access for one
+    writer. A waiting writer holds back new readers, so a steady stream of
+    searches cannot starve an update.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+# Searches read the index and chunk store while upsert_chunks/delete_chunks change them in place
+_corpus_lock = ReadWriteLock()
+
+documents = None  # ChunkStore keyed by chunk id, set by main.py
 index = None      # Will be set by main.py
+index_params = None       # Params the index was built with (index_builder.build_index)
+embedding_cache = None    # Optional persistent EmbeddingCache, set by main.py
+lexical_index = None      # Optional BM25 LexicalIndex fused into retrieval, set by main.py
+corpus_revision = 0       # Bumped whenever the served chunks change, see get_corpus_revision
+
+# Identifies how embed_text post-processes vectors, as part of the cache key
+EMBEDDING_NORMALIZATION = "l2"
+
+# Chunks per forward pass when embedding a corpus with embed_corpus
+EMBEDDING_BATCH_SIZE = 16
+
+# Split headline sections into windows that fit the embedding model's token limit
+# (fit_chunks_to_model; used by main.py, chunk_journal.py and ingest_corpus.py alike)
+TOKEN_AWARE_CHUNKING = False
+CHUNK_TOKEN_OVERLAP = 32  # Tokens shared between consecutive windows of a long section
+
+# In-process cache of query embeddings, so repeated questions skip the model
+QUERY_CACHE_SIZE = 2048
+QUERY_CACHE_TTL = 6 * 60 * 60  # Seconds
+
+# Hybrid retrieval: candidates taken from each of the dense and lexical rankings,
+# and how they are fused ("rrf", or "weighted" with LEXICAL_WEIGHT on the lexical side)
+HYBRID_CANDIDATES = 20
+HYBRID_FUSION = "rrf"
+LEXICAL_WEIGHT = 0.5
+query_embedding_cache = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+def get_embedding_model():
+    """
+    Return the shared embedding model, loading it on first use.
+
+    This is a SentenceTransformer for the torch backend, or an ONNX model with
+    the same interface. The backend's heavy imports (torch, onnxruntime) are
+    deferred to here as well, so tooling and tests that never embed don't pay
+    for them. Safe to call from several threads; the model is only loaded once.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                from Scripts.embedding_backends import load_embedding_backend
+                logging.info(f"Loading embedding model {EMBEDDING_MODEL_NAME} ({EMBEDDING_BACKEND} backend)")
+                _embedding_model = load_embedding_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
+def set_embedding_backend(backend):
+    """
+    Switch the embedding backend; the model is reloaded on next use.
+    """
+    global EMBEDDING_BACKEND, _embedding_model
+    with _embedding_model_lock:
+        EMBEDDING_BACKEND = backend
+        _embedding_model = None
+    query_embedding_cache.clear()  # Vectors from another backend are not interchangeable
+
+def embedding_model_id():
+    """
+    Identifies the vectors embed_text produces: the model name, plus the
+    backend when it is not the reference torch one. Used in cache keys and
+    manifests so vectors from different backends are never mixed.
+    """
+    if EMBEDDING_BACKEND == "torch":
+        return EMBEDDING_MODEL_NAME
+    return f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}"
+
+def warm_up_embedding_model():
+    """
+    Load the embedding model and run one forward pass, for servers that
+    would rather pay the start-up cost before the first request.
+    """
+    get_embedding_model().encode(["warm-up"], convert_to_numpy=True)
+    logging.info("Embedding model warmed up")
 
 def set_documents(docs):
     """
-    Store the documents globally.
+    Store the documents globally, as a chunk_store.ChunkStore whose ids
+    match the ids in the index.
     """
-    global documents
+    global documents, corpus_revision
     documents = docs
+    corpus_revision += 1
 
-def set_index(idx):
+def set_index(idx, params=None):
     """
-    Store the FAISS index globally.
+    Store the FAISS index globally, with the params it was built with so
+    that a rebuild (see chunk_store.update_vectors) can keep them.
     """
-    global index
+    global index, index_params
     index = idx
+    index_params = params
+
+def get_corpus_revision():
+    """
+    Counter bumped by set_documents, upsert_chunks and delete_chunks, so
+    anything derived from the served chunks (e.g. cached answers) can tell
+    when it is stale.
+    """
+    return corpus_revision
+
+def set_lexical_index(lex_index):
+    """
+    Store the lexical (BM25) index globally, or None for dense-only retrieval.
+    """
+    global lexical_index
+    lexical_index = lex_index
+
+def set_embedding_cache(cache):
+    """
+    Store the persistent embedding cache globally, or None to disable it.
+    """
+    global embedding_cache
+    embedding_cache = cache
+
+def get_chunk_sources(indices):
+    """
+    Look up the source attribution of retrieved chunks.
+
+    Args:
+        indices (list): Chunk ids as returned by retrieve_documents.
+
+    Returns:
+        list: One metadata dict per id, or None entries when no metadata is loaded.
+    """
+    with _corpus_lock.reading():
+        return [documents.metadata(i) for i in indices]
+
+def upsert_chunks(texts, ids=None, metadata=None):
+    """
+    Add or update chunks in the live index and chunk store.
+
+    Only chunks whose text is new or changed are embedded; each costs one
+    embed and one index mutation, not a rebuild (except for indexes that
+    cannot remove vectors, see chunk_store.update_vectors). Searches wait
+    while the index and store are being changed, not while embedding.
+
+    Args:
+        texts (list): Chunk strings.
+        ids (list, optional): Chunk ids; defaults to their content ids.
+        metadata (list, optional): Per-chunk metadata, aligned with texts.
+
+    Returns:
+        list: The chunk ids.
+    """
+    from Scripts.chunk_store import update_vectors
+    global corpus_revision
+
+    if ids is None:
+        ids = compute_chunk_ids(texts)
+    changed = [pos for pos, (cid, text) in enumerate(zip(ids, texts)) if documents.get(cid) != text]
+    if changed:
+        embeddings = embed_text([texts[pos] for pos in changed])
+        with _corpus_lock.writing():
+            set_index(*update_vectors(
+                _writable_index(),
+                documents,
+                [ids[pos] for pos in changed],
+                [texts[pos] for pos in changed],
+                embeddings,
+                [metadata[pos] for pos in changed] if metadata is not None else None,
+                params=index_params,
+            ))
+            _rebuild_lexical_index()
+            corpus_revision += 1
+    logging.info(f"Upserted {len(changed)} of {len(texts)} chunks")
+    return ids
+
+def delete_chunks(ids):
+    """
+    Remove chunks from the live index and chunk store.
+
+    Returns:
+        int: Number of chunks removed.
+    """
+    from Scripts.chunk_store import update_vectors
+    global corpus_revision
+
+    with _corpus_lock.writing():
+        removed = [cid for cid in ids if cid in documents]
+        if not removed:
+            return 0
+        set_index(*update_vectors(_writable_index(), documents, remove_ids=removed, params=index_params))
+        _rebuild_lexical_index()
+        corpus_revision += 1
+    logging.info(f"Deleted {len(removed)} of {len(ids)} chunks")
+    return len(removed)
+
+def _writable_index():
+    # A memory-mapped index is a read-only view of its file; changing it in place
+    # would abort inside FAISS, so this process switches to a private copy
+    from Scripts.index_builder import is_memory_mapped, read_into_memory
+    if is_memory_mapped(index):
+        logging.warning("The index is memory-mapped and read-only; copying it into memory to change it")
+        set_index(read_into_memory(index), index_params)
+    return index
+
+def _rebuild_lexical_index():
+    # The BM25 postings are immutable; rebuilding is cheap next to an embed
+    if lexical_index is not None:
+        from Scripts.lexical_index import build_lexical_index
+        set_lexical_index(build_lexical_index(documents))
+
+# -------------------------------------
+# Token-aware Chunking
+# -------------------------------------
+
+def max_chunk_tokens():
+    """
+    Number of content tokens the embedding model sees per input, leaving
+    room for the special tokens it adds around every sequence.
+    """
+    embedding_model = get_embedding_model()
+    special_tokens = embedding_model.tokenizer.num_special_tokens_to_add(pair=False)
+    return embedding_model.max_seq_length - special_tokens
+
+def count_truncated_chunks(chunks, max_tokens=None):
+    """
+    Count the chunks whose tail would be silently cut off by the embedding model.
+
+    Args:
+        chunks (list): Chunk strings.
+        max_tokens (int, optional): Token limit. Defaults to max_chunk_tokens().
+
+    Returns:
+        int: Number of chunks longer than the limit.
+    """
+    if max_tokens is None:
+        max_tokens = max_chunk_tokens()
+    encoded = get_embedding_model().tokenizer(list(chunks), add_special_tokens=False)
+    return sum(1 for input_ids in encoded["input_ids"] if len(input_ids) > max_tokens)
+
+def split_sections_by_tokens(sections, max_tokens=None, overlap=32):
+    """
+    Split sections into windows that fit the embedding model's sequence length.
+
+    All sections are tokenized in one batched call with the model's own
+    tokenizer. Sections that fit are kept as they are; longer ones are cut
+    into overlapping token windows, mapped back to the original text through
+    the tokenizer offsets. Continuation windows repeat the section headline
+    so they remain attributable.
+
+    Args:
+        sections (list): Section strings, e.g. from split_text_by_headlines.
+        max_tokens (int, optional): Tokens per window. Defaults to max_chunk_tokens().
+        overlap (int, optional): Tokens shared by consecutive windows. Defaults to 32.
+            At most half of a continuation window, so each window moves at
+            least half a window on.
+
+    Returns:
+        list: Chunk strings that the model can embed without truncation.
+
+    Raises:
+        ValueError: If overlap is negative or more than half a continuation window.
+    """
+    return [window for windows in _token_windows(sections, max_tokens, overlap) for window in windows]
+
+def _token_windows(sections, max_tokens=None, overlap=32):
+    """
+    split_sections_by_tokens, keeping the windows of each section together.
+
+    Returns:
+        list: One list of chunk strings per section.
+    """
+    if max_tokens is None:
+        max_tokens = max_chunk_tokens()
+    # Continuation windows give up to a quarter of max_tokens to the repeated headline
+    max_headline_tokens = max_tokens // 4
+    max_overlap = (max_tokens - max_headline_tokens) // 2
+    if not 0 <= overlap <= max_overlap:
+        raise ValueError(
+            f"overlap must be between 0 and {max_overlap} for max_tokens={max_tokens}, got {overlap}"
+        )
+
+    sections = list(sections)
+    encoded = get_embedding_model().tokenizer(sections, add_special_tokens=False, return_offsets_mapping=True)
+
+    windows_by_section = []
+    truncated = 0
+    for section, offsets in zip(sections, encoded["offset_mapping"]):
+        chunks = []
+        windows_by_section.append(chunks)
+        if len(offsets) <= max_tokens:
+            chunks.append(section)
+            continue
+        truncated += 1
+
+        # Tokens belonging to the headline, repeated at the top of continuation windows
+        headline_end = section.find("\n")
+        headline_tokens = sum(1 for _, end in offsets if end <= headline_end) if headline_end > 0 else 0
+        if headline_tokens > max_headline_tokens:
+            headline_tokens = 0  # Not worth repeating an oversized headline
+        headline = section[:headline_end] if headline_tokens else ""
+
+        start = 0
+        while True:
+            budget = max_tokens if start == 0 else max_tokens - headline_tokens
+            window = offsets[start:start + budget]
+            window_text = section[window[0][0]:window[-1][1]]
+            chunks.append(window_text if start == 0 or not headline else f"{headline}\n{window_text}")
+            if start + budget >= len(offsets):
+                break
+            start += budget - overlap
+
+    logging.info(
+        f"Token-aware chunking: {truncated} of {len(sections)} sections exceeded "
+        f"{max_tokens} tokens and would have been truncated; "
+        f"produced {sum(len(chunks) for chunks in windows_by_section)} chunks"
+    )
+    return windows_by_section
+
+def fit_chunks_to_model(chunks):
+    """
+    Final step of every chunking pipeline: with TOKEN_AWARE_CHUNKING, split
+    sections longer than the model's token limit into windows; otherwise
+    warn about the sections the model will truncate.
+
+    Chunks are strings, or section dicts with a 'text' key (e.g. from
+    split_records_by_headlines); every window of a section dict keeps its
+    heading and pages.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return chunks
+    texts = [chunk["text"] if isinstance(chunk, dict) else chunk for chunk in chunks]
+    if TOKEN_AWARE_CHUNKING:
+        return [
+            dict(chunk, text=window) if isinstance(chunk, dict) else window
+            for chunk, windows in zip(chunks, _token_windows(texts, overlap=CHUNK_TOKEN_OVERLAP))
+            for window in windows
+        ]
+    truncated = count_truncated_chunks(texts)
+    if truncated:
+        logging.warning(
+            f"{truncated} sections exceed the embedding model's token limit and will be "
+            f"truncated; set TOKEN_AWARE_CHUNKING to split them"
+        )
+    return chunks
 
 # -------------------------------------
 # Embedding and Retrieval
 # -------------------------------------
 
 def embed_text(text_list):
-    embeddings = embedding_model.encode(text_list, convert_to_numpy=True)
+    return _embed_with_cache(text_list, _encode_normalized)
+
+def embed_corpus(text_list, batch_size=None, show_progress=True, workers=1, threads_per_worker=None):
+    """
+    Embed a large list of chunks in token-length buckets.
+
+    Chunks are tokenized in one batched call, sorted by token length and
+    encoded in batches of similar length, which keeps padding to a minimum
+    when section lengths vary widely. Results are returned in the original
+    order and are the same vectors embed_text produces.
+
+    Args:
+        text_list (list): Chunk strings.
+        batch_size (int, optional): Chunks per forward pass. Defaults to
+            EMBEDDING_BATCH_SIZE.
+        show_progress (bool, optional): Log progress and throughput. Defaults to True.
+        workers (int, optional): With more than 1, shard the chunks across
+            that many worker processes (see Scripts/embedding_pool.py).
+            Defaults to 1.
+        threads_per_worker (int, optional): torch threads per worker process.
+
+    Returns:
+        np.ndarray: (len(text_list), dimension) float32 embeddings.
+    """
+    if batch_size is None:
+        batch_size = EMBEDDING_BATCH_SIZE
+    if workers > 1:
+        from Scripts.embedding_pool import encode_in_pool
+        return _embed_with_cache(
+            text_list,
+            lambda texts: encode_in_pool(texts, workers, threads_per_worker, batch_size),
+        )
+    return _embed_with_cache(
+        text_list,
+        lambda texts: _encode_bucketed(texts, batch_size, show_progress),
+    )
+
+def _encode_bucketed(text_list, batch_size, show_progress):
+    model = get_embedding_model()
+    token_lengths = [len(ids) for ids in model.tokenizer(text_list, add_special_tokens=False)["input_ids"]]
+    order = np.argsort(token_lengths, kind="stable")
+
+    embeddings = np.empty((len(text_list), model.get_sentence_embedding_dimension()), dtype='float32')
+    start_time = time.perf_counter()
+    batch_count = (len(text_list) + batch_size - 1) // batch_size
+    log_every = max(1, batch_count // 10)
+    for batch_num, start in enumerate(range(0, len(text_list), batch_size), start=1):
+        bucket = order[start:start + batch_size]
+        embeddings[bucket] = _encode_normalized([text_list[pos] for pos in bucket], batch_size=len(bucket))
+        if show_progress and (batch_num % log_every == 0 or batch_num == batch_count):
+            done = min(start + batch_size, len(text_list))
+            elapsed = time.perf_counter() - start_time
+            logging.info(
+                f"Embedded {done}/{len(text_list)} chunks "
+                f"({done / elapsed:.1f} chunks/s, max {token_lengths[bucket[-1]]} tokens in batch)"
+            )
+    return embeddings
+
+def _embed_with_cache(text_list, encode):
+    text_list = list(text_list)
+    if not text_list:
+        return np.zeros((0, get_embedding_model().get_sentence_embedding_dimension()), dtype='float32')
+    if embedding_cache is None:
+        return encode(text_list)
+
+    # Only encode the texts the persistent cache has never seen
+    cached = embedding_cache.get_many(embedding_model_id(), EMBEDDING_NORMALIZATION, text_list)
+    missing = [pos for pos in range(len(text_list)) if pos not in cached]
+    logging.debug(f"Embedding cache: {len(cached)} hits, {len(missing)} misses")
+    if not missing:
+        return np.vstack([cached[pos] for pos in range(len(text_list))])
+
+    new_embeddings = encode([text_list[pos] for pos in missing])
+    embedding_cache.put_many(
+        embedding_model_id(),
+        EMBEDDING_NORMALIZATION,
+        [text_list[pos] for pos in missing],
+        new_embeddings,
+    )
+
+    embeddings = np.empty((len(text_list), new_embeddings.shape[1]), dtype='float32')
+    embeddings[missing] = new_embeddings
+    for pos, vector in cached.items():
+        embeddings[pos] = vector
+    return embeddings
+
+def _encode_normalized(text_list, batch_size=32):
+    embeddings = get_embedding_model().encode(text_list, batch_size=batch_size, convert_to_numpy=True)
     # Normalize embeddings
     norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
     embeddings = embeddings / norms
     return embeddings.astype('float32')  # Ensure embeddings are float32 for FAISS
 
-def retrieve_documents(query, k=3, return_details=False):
+def normalize_query(query):
+    """
+    Canonical form of a query for cache lookups: case-folded, whitespace
+    collapsed, surrounding punctuation removed.
+    """
+    return " ".join(query.casefold().split()).strip(" ?!.,;:")
+
+def embed_query(query):
+    """
+    Embed a single query, serving repeats from the in-process query cache.
+
+    Returns:
+        np.ndarray: A (1, dimension) float32 array, ready for index.search.
+    """
+    key = normalize_query(query)
+    query_embedding = query_embedding_cache.get(key)
+    if query_embedding is None:
+        query_embedding = embed_text([query])
+        query_embedding.flags.writeable = False  # Shared between callers
+        query_embedding_cache.put(key, query_embedding)
+    return query_embedding
+
+def embed_queries(queries):
+    """
+    Embed a batch of queries in one forward pass, serving repeats from the
+    query cache; only distinct uncached queries are encoded.
+
+    Returns:
+        np.ndarray: A (len(queries), dimension) float32 array, ready for index.search.
+    """
+    keys = [normalize_query(query) for query in queries]
+    cached = {key: query_embedding_cache.get(key) for key in set(keys)}
+    missing = [key for key, vector in cached.items() if vector is None]
+    if missing:
+        # Encode one original query per missing key, in one batch
+        originals = {key: query for key, query in zip(keys, queries)}
+        texts = [originals[key] for key in missing]
+        new_embeddings = _embed_with_cache(
+            texts, lambda texts: _encode_normalized(texts, batch_size=max(len(texts), EMBEDDING_BATCH_SIZE))
+        )
+        for key, vector in zip(missing, new_embeddings):
+            vector = vector[np.newaxis, :]
+            vector.flags.writeable = False  # Shared between callers
+            query_embedding_cache.put(key, vector)
+            cached[key] = vector
+    if not keys:
+        return np.zeros((0, get_embedding_model().get_sentence_embedding_dimension()), dtype='float32')
+    return np.vstack([cached[key] for key in keys])
+
+def configure_query_cache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+    """
+    Replace the query embedding cache with one of the given size and TTL (seconds).
+    A max_size of 0 disables caching.
+    """
+    global query_embedding_cache
+    query_embedding_cache = LRUCache(max_size, ttl)
+
+def get_query_cache_stats():
+    """
+    Hit/miss counters, hit rate, evictions and size of the query embedding cache.
+    """
+    return query_embedding_cache.stats()
+
+def _search_index(query_embeddings, k, search_params, use_hybrid):
+    params = None
+    if search_params:
+        from Scripts.index_builder import search_parameters
+        params = search_parameters(index, **search_params)
+    candidates = max(k, HYBRID_CANDIDATES) if use_hybrid else k
+    return index.search(query_embeddings, candidates, params=params)
+
+def _rank_hits(query, ids_row, distances_row, k, use_hybrid):
+    """
+    Final (ids, distances) of one query from its row of index.search
+    results, fused with the lexical ranking when use_hybrid is set.
+    """
+    keep = ids_row >= 0
+    retrieved_indices = ids_row[keep].tolist()
+    distances = distances_row[keep].tolist()
+    if use_hybrid:
+        from Scripts.lexical_index import fuse_rankings
+        lexical_ids, lexical_scores = lexical_index.search(query, len(ids_row))
+        logging.debug(f"Lexical indices: {lexical_ids}, scores: {lexical_scores}")
+        retrieved_indices, distances = fuse_rankings(
+            retrieved_indices, distances, lexical_ids, lexical_scores,
+            k, HYBRID_FUSION, LEXICAL_WEIGHT,
+        )
+    return retrieved_indices, distances
+
+def retrieve_documents(query, k=3, return_details=False, search_params=None, hybrid=None):
     """
     Retrieves the top-k most relevant documents for a given query.
 
@@ -142,10 +817,16 @@ def retrieve_documents(query, k=3, return_details=False):
         query (str): The query string.
         k (int): Number of top documents to retrieve.
         return_details (bool): Whether to return indices and distances along with the documents.
+        search_params (dict, optional): Per-request index knobs, e.g.
+            {"nprobe": 64} for IVF or {"efSearch": 128} for HNSW. Defaults
+            to the parameters saved with the index.
+        hybrid (bool, optional): Fuse in the lexical (BM25) ranking. Defaults
+            to True whenever a lexical index is set.
 
     Returns:
         list: A list of retrieved document chunks if return_details=False
-        tuple: (retrieved_chunks, indices, distances) if return_details=True
+        tuple: (retrieved_chunks, indices, distances) if return_details=True;
+            with hybrid retrieval the distances are the fused scores
     """
     if documents is None or index is None:
         logging.error("Documents or index have not been set. Please call set_documents and set_index first.")
@@ -155,19 +836,20 @@ def retrieve_documents(query, k=3, return_details=False):
 
     try:
         logging.debug(f"Starting document retrieval for query: {query}")
-        query_embedding = embed_text([query])
+        query_embedding = embed_query(query)
 
         logging.debug(f"Query embedding shape: {query_embedding.shape}")
 
         # Retrieve top k documents
-        D, I = index.search(query_embedding, k)
+        with _corpus_lock.reading():
+            use_hybrid = lexical_index is not None and hybrid is not False
+            D, I = _search_index(query_embedding, k, search_params, use_hybrid)
 
-        logging.debug(f"Indices returned: {I}")
-        logging.debug(f"Distances: {D}")
+            logging.debug(f"Indices returned: {I}")
+            logging.debug(f"Distances: {D}")
 
-        retrieved_indices = [i for i in I[0] if i >= 0]
-        retrieved_chunks = [documents[i] for i in retrieved_indices]
-        distances = D[0].tolist()
+            retrieved_indices, distances = _rank_hits(query, I[0], D[0], k, use_hybrid)
+            retrieved_chunks = [documents[i] for i in retrieved_indices]
 
         # Log the retrieved documents
         logging.debug("Retrieved Documents:")
@@ -184,3 +866,40 @@ def retrieve_documents(query, k=3, return_details=False):
             return [], [], []
         return []
 
+def retrieve_documents_batch(queries, k=3, search_params=None, hybrid=None):
+    """
+    Retrieves the top-k documents for many queries at once: one embedding
+    forward pass (see embed_queries) and one index.search over all of them.
+
+    Args:
+        queries (list): Query strings.
+        k (int): Number of top documents to retrieve per query.
+        search_params (dict, optional): Per-request index knobs, as for retrieve_documents.
+        hybrid (bool, optional): Fuse in the lexical (BM25) ranking, as for retrieve_documents.
+
+    Returns:
+        list: One (retrieved_chunks, indices, distances) tuple per query, as
+            retrieve_documents returns with return_details=True.
+    """
+    queries = list(queries)
+    if documents is None or index is None:
+        logging.error("Documents or index have not been set. Please call set_documents and set_index first.")
+        return [([], [], []) for _ in queries]
+    if not queries:
+        return []
+
+    try:
+        logging.debug(f"Starting batched document retrieval for {len(queries)} queries")
+        query_embeddings = embed_queries(queries)
+        with _corpus_lock.reading():
+            use_hybrid = lexical_index is not None and hybrid is not False
+            D, I = _search_index(query_embeddings, k, search_params, use_hybrid)
+
+            results = []
+            for query, ids_row, distances_row in zip(queries, I, D):
+                retrieved_indices, distances = _rank_hits(query, ids_row, distances_row, k, use_hybrid)
+                results.append(([documents[i] for i in retrieved_indices], retrieved_indices, distances))
+        return results
+    except Exception as e:
+        logging.error(f"Error in retrieve_documents_batch: {e}")
+        return [([], [], []) for _ in queries]
@@ -16,26 +16,21 @@ parent_dir = os.path.abspath(os.path.join(current_dir, os.pardir))
 sys.path.append(parent_dir)
 
 # Now import from main.py
-from main import generate_response
+from main import generate_response_stream, initialize, warm_up_reranking
+from Scripts.utils import warm_up_embedding_model
 
-# Function to handle user input and generate responses
+# Function to handle user input and stream the response into the chat
 def respond(user_message, chat_history, enhance):
     if chat_history is None:
         chat_history = []
-    # Generate the assistant's response
-    assistant_response = generate_response(user_message, history=chat_history, enhance=enhance)
+    # Earlier exchanges only; the new one is filled in as the answer streams
+    history = list(chat_history)
+    chat_history.append((user_message, ""))
 
-    # Check if assistant_response is a dictionary (i.e., when enhance=True)
-    if isinstance(assistant_response, dict):
-        # Extract the 'final_answer' to display
-        assistant_reply = assistant_response.get('final_answer', '')
-    else:
-        # Use the assistant_response directly
-        assistant_reply = assistant_response
-
-    # Append the user message and assistant response to the chat history
-    chat_history.append((user_message, assistant_reply))
-    return "", chat_history
+    # Each partial answer replaces the assistant's message so far
+    for assistant_reply in generate_response_stream(user_message, history=history, enhance=enhance):
+        chat_history[-1] = (user_message, assistant_reply)
+        yield "", chat_history
 
 # Create Gradio interface
 with gr.Blocks() as demo:
@@ -61,4 +56,11 @@ with gr.Blocks() as demo:
     clear.click(lambda: None, None, chatbot, queue=False)
 
 if __name__ == "__main__":
+    # Load (or build) the snapshot; never at import, see main.initialize
+    initialize()
+    # Load the embedding model and the reranker before the first question rather than during it
+    warm_up_embedding_model()
+    warm_up_reranking()
+    # Generator handlers (streaming) need the queue
+    demo.queue()
     demo.launch()
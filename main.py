@@ -11,20 +11,38 @@ Created on Wed Sep 18 11:18:17 2024
 
 import os
 import sys
+import time
 import logging
-import pickle
-import faiss
-import numpy as np
 from together import Together
 from Scripts.enhance_response import enhance_answer  # Import enhance_answer
+from Scripts.chunk_journal import load_base_chunks, load_journal, replay_journal
+from Scripts.embedding_cache import EmbeddingCache
+from Scripts.embedding_store import (
+    save_embedding_matrix,
+    load_embedding_matrix,
+    as_float32,
+    migrate_pickled_embeddings
+)
+from Scripts.index_builder import build_index, save_index, load_index
+from Scripts.chunk_store import ChunkStore
+from Scripts.snapshot import SNAPSHOTS_DIRNAME, SnapshotError, load_snapshot, loose_embeddings_model, write_snapshot
+from Scripts.lexical_index import build_lexical_index
+from Scripts.rerank import rerank, warm_up_reranker
+from Scripts.answer_cache import SemanticAnswerCache, depends_on_history
 
 # Import utility functions
 from Scripts.utils import (
     file_exists,
-    split_text_by_headlines,
-    embed_text,
+    fit_chunks_to_model,
+    embed_corpus,
+    embedding_model_id,
+    embed_query,
+    get_corpus_revision,
+    set_embedding_cache,
     set_documents,
-    set_index
+    set_index,
+    set_lexical_index,
+    get_chunk_sources
 )
 
 # Setup logging
@@ -40,11 +58,45 @@ setup_logging()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # V3/
 SCRIPTS_DIR = os.path.join(BASE_DIR, 'Scripts')
 DATA_DIR = os.path.join(BASE_DIR, 'Data')  # Data directory
-
-OUTPUT_TEXT_PATH = os.path.join(SCRIPTS_DIR, "extracted_text.txt")
-OUTPUT_EMBEDDINGS_PATH = os.path.join(SCRIPTS_DIR, "document_embeddings.pkl")
-DOCUMENTS_PATH = os.path.join(SCRIPTS_DIR, "documents.pkl")
-INDEX_PATH = os.path.join(SCRIPTS_DIR, "faiss_index.index")
+# Set ESUR_ARTIFACTS_DIR to serve a multi-document corpus built by Scripts/ingest_corpus.py
+ARTIFACTS_DIR = os.environ.get("ESUR_ARTIFACTS_DIR", SCRIPTS_DIR)
+
+OUTPUT_EMBEDDINGS_PATH = os.path.join(ARTIFACTS_DIR, "document_embeddings.npy")
+LEGACY_EMBEDDINGS_PATH = os.path.join(ARTIFACTS_DIR, "document_embeddings.pkl")
+DOCUMENTS_PATH = os.path.join(ARTIFACTS_DIR, "documents.pkl")
+METADATA_PATH = os.path.join(ARTIFACTS_DIR, "document_metadata.pkl")
+CHUNK_IDS_PATH = os.path.join(ARTIFACTS_DIR, "chunk_ids.pkl")
+INDEX_PATH = os.path.join(ARTIFACTS_DIR, "faiss_index.index")
+SNAPSHOTS_DIR = os.path.join(ARTIFACTS_DIR, SNAPSHOTS_DIRNAME)
+EMBEDDING_CACHE_PATH = os.path.join(SCRIPTS_DIR, "embedding_cache.sqlite")
+
+# Worker processes used to embed the corpus when building embeddings (1 = in process)
+EMBEDDING_WORKERS = 1
+
+# Storage type of the memory-mapped embedding matrix ("float32" or "float16")
+EMBEDDING_STORAGE_DTYPE = "float32"
+
+# FAISS index type: "auto" (by corpus size), "flat", "ivf-flat", "ivf-pq", "hnsw" or a factory string
+INDEX_POLICY = "auto"
+
+# "mmap" shares the index pages between server processes; it makes the index read-only,
+# so keep "copy" when chunks are upserted into the live index
+INDEX_IO_MODE = os.environ.get("ESUR_INDEX_IO", "copy")
+
+# Fuse BM25 over the same chunks into retrieval, for exact terms (drug names, eGFR thresholds, section codes)
+HYBRID_RETRIEVAL = True
+
+# Over-retrieve RERANK_CANDIDATES chunks and keep the CONTEXT_CHUNKS a local cross-encoder
+# ranks best (Scripts/rerank.py); retrieval order is kept if scoring exceeds RERANK_BUDGET_MS
+RERANK_RESULTS = True
+RERANK_CANDIDATES = 30
+RERANK_BUDGET_MS = 400
+CONTEXT_CHUNKS = 3
+
+# Answer questions close to an earlier one from the answer cache (Scripts/answer_cache.py,
+# which sets the similarity threshold). Follow-up questions always bypass it.
+ANSWER_CACHE = True
+answer_cache = SemanticAnswerCache() if ANSWER_CACHE else None
 
 # Initialize Together client
 API_KEY = os.environ.get("TOGETHER_API_KEY")
@@ -53,81 +105,202 @@ if not API_KEY:
     sys.exit(1)
 client = Together(api_key=API_KEY)
 
-# Initialize variables
-try:
+def build_snapshot():
+    """
+    Build a snapshot from the loose artifacts (documents.pkl,
+    document_embeddings.npy, faiss_index.index), creating whichever are
+    missing from the journal's base chunks (see Scripts/chunk_journal.py).
+    Embeddings from another model, or that do not match the chunks, are
+    recomputed and the index rebuilt from them.
+
+    Returns:
+        str: The id of the new snapshot.
+    """
     # Check if an existing documents.pkl file is available
     if file_exists(DOCUMENTS_PATH):
-        with open(DOCUMENTS_PATH, "rb") as f:
-            doc_chunks = pickle.load(f)
+        # Chunk ids (chunk_ids.pkl) and per-chunk document attribution (ingested corpora only)
+        chunk_store = ChunkStore.load(DOCUMENTS_PATH, CHUNK_IDS_PATH, METADATA_PATH)
+        doc_chunks = chunk_store.texts()
         logging.info(f"Loaded existing document chunks from {DOCUMENTS_PATH}")
     else:
-        # If documents.pkl doesn't exist, extract from extracted_text.txt
-        if file_exists(OUTPUT_TEXT_PATH):
-            with open(OUTPUT_TEXT_PATH, "r", encoding="utf-8") as f:
-                extracted_text = f.read()
-            logging.info(f"Loaded extracted text from {OUTPUT_TEXT_PATH}")
-        else:
-            logging.error(f"Extracted text file not found at {OUTPUT_TEXT_PATH}")
-            sys.exit(1)
-
-        # Split the extracted text into sections based on headlines
-        doc_chunks = split_text_by_headlines(extracted_text)
-        logging.info(f"Split text into {len(doc_chunks)} sections based on headlines")
-
-        # Save the split chunks to documents.pkl for future use
-        with open(DOCUMENTS_PATH, "wb") as f:
-            pickle.dump(doc_chunks, f)
+        # If documents.pkl doesn't exist, start from the journal's base chunks (the headline
+        # chunking of extracted_text.txt until the journal is first applied) and replay
+        # the curated chunk edits (Scripts/chunk_edits.json) over them
+        doc_chunks = fit_chunks_to_model(replay_journal(load_base_chunks(), load_journal()))
+
+        # Save the split chunks (and their ids) to documents.pkl for future use
+        chunk_store = ChunkStore.from_chunks(doc_chunks)
+        chunk_store.save(DOCUMENTS_PATH, CHUNK_IDS_PATH)
         logging.info(f"Saved document chunks to {DOCUMENTS_PATH}")
 
-    # Set documents in utils for retrieval functions
-    set_documents(doc_chunks)
+    # Convert embeddings pickled by older versions to the memory-mappable store
+    if not file_exists(OUTPUT_EMBEDDINGS_PATH) and file_exists(LEGACY_EMBEDDINGS_PATH):
+        migrate_pickled_embeddings(LEGACY_EMBEDDINGS_PATH, OUTPUT_EMBEDDINGS_PATH, EMBEDDING_STORAGE_DTYPE)
 
     # Load or save embeddings
+    model_name = embedding_model_id()
+    document_embeddings = None
     if file_exists(OUTPUT_EMBEDDINGS_PATH):
-        with open(OUTPUT_EMBEDDINGS_PATH, "rb") as f:
-            document_embeddings = pickle.load(f)
-        logging.info(f"Loaded document embeddings from {OUTPUT_EMBEDDINGS_PATH}")
-    else:
-        # Generate embeddings for doc_chunks and save them
-        document_embeddings = embed_text(doc_chunks)
-        with open(OUTPUT_EMBEDDINGS_PATH, "wb") as f:
-            pickle.dump(document_embeddings, f)
+        # Memory-mapped: no copy, and shared between server processes through the page cache
+        document_embeddings = load_embedding_matrix(OUTPUT_EMBEDDINGS_PATH)
+        # Unknown only for matrices older than both the model sidecar and snapshots
+        stored_model = loose_embeddings_model(OUTPUT_EMBEDDINGS_PATH, SNAPSHOTS_DIR) or model_name
+        if stored_model != model_name:
+            logging.warning(f"{OUTPUT_EMBEDDINGS_PATH} was embedded with {stored_model}, not {model_name}; re-embedding")
+            document_embeddings = None
+        elif document_embeddings.shape[0] != len(chunk_store):
+            logging.warning(
+                f"{OUTPUT_EMBEDDINGS_PATH} holds {document_embeddings.shape[0]} embeddings for "
+                f"{len(chunk_store)} chunks; re-embedding"
+            )
+            document_embeddings = None
+        else:
+            logging.info(f"Loaded document embeddings from {OUTPUT_EMBEDDINGS_PATH}")
+    reembedded = document_embeddings is None
+    if reembedded:
+        # Generate embeddings for doc_chunks and save them, reusing any cached vectors
+        embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+        set_embedding_cache(embedding_cache)
+        document_embeddings = embed_corpus(doc_chunks, workers=EMBEDDING_WORKERS)
+        set_embedding_cache(None)
+        logging.info(f"Embedding cache stats: {embedding_cache.stats()}")
+        embedding_cache.close()
+        save_embedding_matrix(OUTPUT_EMBEDDINGS_PATH, document_embeddings, EMBEDDING_STORAGE_DTYPE, model_name)
         logging.info(f"Saved document embeddings to {OUTPUT_EMBEDDINGS_PATH}")
 
     # Load or create FAISS index
-    if file_exists(INDEX_PATH):
-        index = faiss.read_index(INDEX_PATH)
-        logging.info(f"Loaded FAISS index from {INDEX_PATH}")
-    else:
-        # Create FAISS index and save
-        dimension = document_embeddings.shape[1]
-        index = faiss.IndexFlatIP(dimension)
-        index.add(document_embeddings)
-        faiss.write_index(index, INDEX_PATH)
+    index = None
+    if file_exists(INDEX_PATH) and not reembedded:
+        index, index_params = load_index(INDEX_PATH)
+        logging.info(f"Loaded FAISS index from {INDEX_PATH} ({index_params.get('factory', 'Flat')})")
+        if not index_params.get("ids"):
+            # Older indexes return positions rather than chunk ids
+            logging.info("Rebuilding positional FAISS index with chunk ids")
+            index = None
+        elif index.ntotal != len(chunk_store) or index.d != document_embeddings.shape[1]:
+            logging.warning(f"FAISS index at {INDEX_PATH} does not match the chunks; rebuilding it")
+            index = None
+    if index is None:
+        # Create FAISS index, keyed by chunk id, and save
+        index, index_params = build_index(as_float32(document_embeddings), INDEX_POLICY, ids=chunk_store.ids())
+        save_index(index, INDEX_PATH, index_params)
         logging.info(f"Created FAISS index and saved to {INDEX_PATH}")
 
-    # Set FAISS index in utils
-    set_index(index)
+    return write_snapshot(
+        SNAPSHOTS_DIR,
+        chunk_store,
+        document_embeddings,
+        index,
+        index_params,
+        model_name,
+        EMBEDDING_STORAGE_DTYPE,
+    )
+
+# Set by initialize()
+snapshot = None
+
+def initialize():
+    """
+    Load the current snapshot (building one if needed) and hand it to the
+    retrieval functions. Entry points call this once at startup; it does not
+    run on import, because the embedding pool's spawned workers re-import the
+    entry point's __main__ module.
+    """
+    global snapshot
+    try:
+        # Chunks, embeddings and index are served from one snapshot, validated against its manifest
+        snapshot = None
+        try:
+            snapshot = load_snapshot(SNAPSHOTS_DIR, model_name=embedding_model_id(), index_io=INDEX_IO_MODE)
+        except SnapshotError as e:
+            logging.warning(f"Current snapshot is unusable ({e}); building a new one")
+        if snapshot is None:
+            snapshot = load_snapshot(SNAPSHOTS_DIR, build_snapshot(), index_io=INDEX_IO_MODE)
+
+        # Set documents and FAISS index in utils for retrieval functions
+        set_documents(snapshot.store)
+        set_index(snapshot.index, snapshot.manifest["index"])
+        if HYBRID_RETRIEVAL:
+            set_lexical_index(build_lexical_index(snapshot.store))
+
+    except Exception as e:
+        logging.error(f"Error during initialization: {e}")
+        sys.exit(1)  # Exit if initialization fails
+
+def warm_up_reranking():
+    """
+    Load the cross-encoder now rather than inside the first request's budget.
+    Called by the UI at startup, next to warm_up_embedding_model; reranking
+    is switched off if the model cannot be loaded.
+    """
+    global RERANK_RESULTS
+    if not RERANK_RESULTS:
+        return
+    try:
+        warm_up_reranker()
+    except Exception as e:
+        logging.warning(f"Reranker unavailable ({e}); using the retrieval order")
+        RERANK_RESULTS = False
 
-except Exception as e:
-    logging.error(f"Error during initialization: {e}")
-    sys.exit(1)  # Exit if initialization fails
 
+LLM_MODEL = "meta-llama/Meta-Llama-3-70B-Instruct-Turbo"  # Adjust to your model
+LLM_MAX_TOKENS = 512
 
-def generate_response(query, history=None, enhance=False):
+def lookup_cached_answer(query, history, enhance):
+    """
+    Answer from the answer cache, if the question may be cached.
+
+    Returns:
+        tuple: (cached answer or None, cache key or None); pass the key to
+            store_cached_answer once the question is answered.
+    """
+    # Follow-up questions depend on the conversation, so only standalone ones are cached
+    if answer_cache is None or (history and depends_on_history(query)):
+        return None, None
+    try:
+        # Served from the query cache, so retrieval afterwards does not embed the query again
+        cache_key = (embed_query(query), (snapshot.snapshot_id, get_corpus_revision()))
+        cached = answer_cache.get(cache_key[0], cache_key[1], query, variant=enhance)
+    except Exception as e:
+        # Treated as a miss; retrieval reports the failure the way it always has
+        logging.error(f"Error looking up the answer cache: {e}")
+        return None, None
+    if cached is not None:
+        logging.info(f"Answered from the answer cache; stats: {answer_cache.stats()}")
+    return cached, cache_key
+
+def store_cached_answer(cache_key, query, result, enhance):
+    if cache_key is not None:
+        answer_cache.put(cache_key[0], cache_key[1], query, result, variant=enhance)
+
+def retrieve_context(query):
+    """
+    Retrieve the context chunks for a query, reranked when RERANK_RESULTS is set.
+
+    Returns:
+        tuple: (chunks, indices, distances)
+    """
     from Scripts.utils import retrieve_documents
 
     # Retrieve documents along with indices and distances
-    retrieved_docs, indices, distances = retrieve_documents(query, k=3, return_details=True)
-    if not retrieved_docs:
-        logging.error("No documents retrieved.")
-        return "I'm sorry, I couldn't find any information related to your query."
+    if RERANK_RESULTS:
+        retrieved_docs, indices, distances = retrieve_documents(query, k=RERANK_CANDIDATES, return_details=True)
+        retrieved_docs, indices, distances = rerank(
+            query, retrieved_docs, indices, distances, CONTEXT_CHUNKS, RERANK_BUDGET_MS
+        )
+    else:
+        retrieved_docs, indices, distances = retrieve_documents(query, k=CONTEXT_CHUNKS, return_details=True)
 
     # Log the retrieved chunks, indices, and distances
     logging.debug(f"Retrieved Chunks: {retrieved_docs}")
     logging.debug(f"Indices: {indices}")
     logging.debug(f"Distances: {distances}")
+    return retrieved_docs, indices, distances
 
+def build_messages(query, retrieved_docs, history=None):
+    """
+    Chat messages for the LLM: recent history, then the query with its context.
+    """
     # Combine retrieved documents into context
     combined_context = " ".join(retrieved_docs)
     # Truncate context to fit model's context window
@@ -162,42 +335,138 @@ def generate_response(query, history=None, enhance=False):
     logging.debug("Messages sent to the model:")
     for msg in messages:
         logging.debug(f"{msg['role']}: {msg['content']}")
+    return messages
+
+def build_result(query, assistant_reply, retrieved_docs, indices, distances, enhance=False):
+    """
+    The response dict for an answer, enhanced first if requested.
+    """
+    if enhance:
+        logging.debug("Enhancement requested. Enhancing the answer...")
+        # Use enhance_answer and get detailed information
+        enhancement_result = enhance_answer(query, retrieved_docs, assistant_reply)
+
+        enhancement_result['initial_chunks'] = {
+            'chunks': retrieved_docs,
+            'indices': indices,
+            'sources': get_chunk_sources(indices)
+        }
+        enhancement_result['distances'] = distances
+
+        return enhancement_result
+    else:
+        # Return original answer with initial chunks and indices
+        return {
+            'original_answer': assistant_reply,
+            'initial_chunks': {
+                'chunks': retrieved_docs,
+                'indices': indices,
+                'sources': get_chunk_sources(indices)
+            },
+            'distances': distances
+        }
+
+def generate_response(query, history=None, enhance=False):
+    cached, cache_key = lookup_cached_answer(query, history, enhance)
+    if cached is not None:
+        return cached
+
+    retrieved_docs, indices, distances = retrieve_context(query)
+    if not retrieved_docs:
+        logging.error("No documents retrieved.")
+        return "I'm sorry, I couldn't find any information related to your query."
+
+    messages = build_messages(query, retrieved_docs, history)
 
     # Make the API call
     try:
         response = client.chat.completions.create(
-            model="meta-llama/Meta-Llama-3-70B-Instruct-Turbo",  # Adjust to your model
+            model=LLM_MODEL,
             messages=messages,
-            max_tokens=512
+            max_tokens=LLM_MAX_TOKENS
         )
         if response and response.choices:
             assistant_reply = response.choices[0].message.content.strip()
-
-            if enhance:
-                logging.debug("Enhancement requested. Enhancing the answer...")
-                # Use enhance_answer and get detailed information
-                enhancement_result = enhance_answer(query, retrieved_docs, assistant_reply)
-
-                enhancement_result['initial_chunks'] = {
-                    'chunks': retrieved_docs,
-                    'indices': indices
-                }
-                enhancement_result['distances'] = distances
-
-                return enhancement_result
-            else:
-                # Return original answer with initial chunks and indices
-                return {
-                    'original_answer': assistant_reply,
-                    'initial_chunks': {
-                        'chunks': retrieved_docs,
-                        'indices': indices
-                    },
-                    'distances': distances
-                }
+            result = build_result(query, assistant_reply, retrieved_docs, indices, distances, enhance)
+            store_cached_answer(cache_key, query, result, enhance)
+            return result
         else:
             logging.error("Empty response from the model.")
             return "I'm sorry, I couldn't generate a response."
     except Exception as e:
         logging.error(f"Error generating response: {e}")
         return "I'm sorry, there was an error processing your request."
+
+def generate_response_stream(query, history=None, enhance=False):
+    """
+    Streaming variant of generate_response.
+
+    Yields the answer text so far each time the LLM sends more of it, so a
+    chat UI can render tokens as they arrive. With enhance, the enhanced
+    answer is yielded once enhance_answer has finished. Time to first token
+    and total latency are logged.
+
+    Returns:
+        The same value generate_response returns, as the generator's return
+        value (e.g. result = yield from generate_response_stream(...)).
+    """
+    cached, cache_key = lookup_cached_answer(query, history, enhance)
+    if cached is not None:
+        yield cached.get('final_answer') or cached.get('original_answer', '')
+        return cached
+
+    retrieved_docs, indices, distances = retrieve_context(query)
+    if not retrieved_docs:
+        logging.error("No documents retrieved.")
+        message = "I'm sorry, I couldn't find any information related to your query."
+        yield message
+        return message
+
+    messages = build_messages(query, retrieved_docs, history)
+
+    # Stream the API call
+    try:
+        start_time = time.perf_counter()
+        first_token_time = None
+        parts = []
+        stream = client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            max_tokens=LLM_MAX_TOKENS,
+            stream=True
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+                logging.info(f"LLM time to first token: {(first_token_time - start_time) * 1000:.0f} ms")
+            parts.append(delta)
+            yield "".join(parts).lstrip()
+        logging.info(
+            f"LLM total latency: {(time.perf_counter() - start_time) * 1000:.0f} ms "
+            f"({len(parts)} streamed chunks)"
+        )
+
+        assistant_reply = "".join(parts).strip()
+        if not assistant_reply:
+            logging.error("Empty response from the model.")
+            message = "I'm sorry, I couldn't generate a response."
+            yield message
+            return message
+
+        result = build_result(query, assistant_reply, retrieved_docs, indices, distances, enhance)
+        if enhance:
+            yield result.get('final_answer', assistant_reply)
+        store_cached_answer(cache_key, query, result, enhance)
+        return result
+    except Exception as e:
+        logging.error(f"Error generating response: {e}")
+        message = "I'm sorry, there was an error processing your request."
+        yield message
+        return message
+
+if __name__ == "__main__":
+    # Build (or check) the snapshot without starting a UI
+    initialize()
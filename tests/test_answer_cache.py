@@ -0,0 +1,135 @@
+# tests/test_answer_cache.py
+#
+# The in-memory caches: the semantic answer cache (hits by similarity, the
+# threshold, the number check, expiry and corpus-version invalidation), the
+# LRU cache, and which questions count as follow-ups.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts import answer_cache, memory_cache
+from Scripts.answer_cache import SemanticAnswerCache, depends_on_history
+from Scripts.memory_cache import LRUCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache.time, "monotonic", clock)
+    monkeypatch.setattr(memory_cache.time, "monotonic", clock)
+    return clock
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def test_semantic_hit_and_miss():
+    cache = SemanticAnswerCache(max_size=4, threshold=0.95)
+    cache.put(unit(1, 0, 0), "v1", "Is metformin safe?", {"original_answer": "Yes"})
+
+    assert cache.get(unit(1, 0.1, 0), "v1", "Is metformin ok?") == {"original_answer": "Yes"}
+    assert cache.get(unit(0, 1, 0), "v1", "What is NSF?") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_semantic_threshold():
+    close, far = unit(1, 0.2, 0), unit(1, 0.5, 0)  # Similarity to (1, 0, 0) of about 0.98 and 0.89
+    strict = SemanticAnswerCache(max_size=4, threshold=0.95)
+    loose = SemanticAnswerCache(max_size=4, threshold=0.85)
+    for cache in (strict, loose):
+        cache.put(unit(1, 0, 0), "v1", "question", "answer")
+
+    assert strict.get(close, "v1", "question") == "answer"
+    assert strict.get(far, "v1", "question") is None
+    assert loose.get(far, "v1", "question") == "answer"
+
+def test_semantic_numbers_and_variant_must_match():
+    cache = SemanticAnswerCache(max_size=4, threshold=0.95)
+    cache.put(unit(1, 0, 0), "v1", "eGFR below 30?", "answer", variant=False)
+
+    assert cache.get(unit(1, 0, 0), "v1", "eGFR below 45?", variant=False) is None
+    assert cache.get(unit(1, 0, 0), "v1", "eGFR below 30?", variant=True) is None
+    assert cache.get(unit(1, 0, 0), "v1", "eGFR below 30", variant=False) == "answer"
+
+def test_semantic_ttl_expiry(clock):
+    cache = SemanticAnswerCache(max_size=4, ttl=60, threshold=0.95)
+    cache.put(unit(1, 0, 0), "v1", "question", "answer")
+
+    clock.now += 59
+    assert cache.get(unit(1, 0, 0), "v1", "question") == "answer"
+    clock.now += 2
+    assert cache.get(unit(1, 0, 0), "v1", "question") is None
+    assert cache.stats()["size"] == 0
+
+def test_semantic_version_change_drops_everything():
+    cache = SemanticAnswerCache(max_size=4, threshold=0.95)
+    cache.put(unit(1, 0, 0), "v1", "first", "a")
+    cache.put(unit(0, 1, 0), "v1", "second", "b")
+
+    assert cache.get(unit(1, 0, 0), "v2", "first") is None
+    assert cache.invalidations == 1
+    # Going back to the old version does not bring the old answers back
+    assert cache.get(unit(0, 1, 0), "v1", "second") is None
+
+def test_semantic_evicts_least_recently_used():
+    cache = SemanticAnswerCache(max_size=2, threshold=0.95)
+    cache.put(unit(1, 0, 0), "v1", "first", "a")
+    cache.put(unit(0, 1, 0), "v1", "second", "b")
+    cache.get(unit(1, 0, 0), "v1", "first")
+    cache.put(unit(0, 0, 1), "v1", "third", "c")
+
+    assert cache.get(unit(1, 0, 0), "v1", "first") == "a"
+    assert cache.get(unit(0, 1, 0), "v1", "second") is None
+    assert cache.evictions == 1
+
+def test_semantic_returns_copies():
+    cache = SemanticAnswerCache(max_size=4, threshold=0.95)
+    cache.put(unit(1, 0, 0), "v1", "question", {"chunks": ["a"]})
+    cache.get(unit(1, 0, 0), "v1", "question")["chunks"].append("b")
+
+    assert cache.get(unit(1, 0, 0), "v1", "question") == {"chunks": ["a"]}
+
+def test_lru_hit_miss_and_eviction():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_lru_ttl_expiry(clock):
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.put("a", 1)
+
+    clock.now += 59
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.evictions == 1
+
+@pytest.mark.parametrize("query, follow_up", [
+    ("Should metformin be stopped before iodine-based contrast medium?", False),
+    ("How is post-contrast acute kidney injury defined?", False),
+    ("What about in children?", True),
+    ("And for gadolinium?", True),
+    ("Is it safe during pregnancy?", True),
+    ("How long should I wait after that?", True),
+])
+def test_depends_on_history(query, follow_up):
+    assert depends_on_history(query) is follow_up
@@ -0,0 +1,112 @@
+# tests/test_chunk_journal.py
+#
+# Replaying the chunk journal: every operation, the ids operations refer to,
+# and the attribution of edited chunks in ingested corpora.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts import chunk_journal
+from Scripts.chunk_journal import format_id, replay_journal
+from Scripts.chunk_store import ChunkStore
+from Scripts.utils import compute_chunk_ids
+
+BASE = ["A", "B", "A", "C"]
+
+def ids_of(chunks):
+    return [format_id(cid) for cid in compute_chunk_ids(chunks)]
+
+def test_merge_keeps_the_position_of_the_first_chunk():
+    a, b, a2, c = ids_of(BASE)
+    assert replay_journal(BASE, [{"op": "merge", "ids": [b, c]}]) == ["A", "B C", "A"]
+    assert replay_journal(BASE, [{"op": "merge", "ids": [c, a2], "separator": "\n"}]) == ["A", "B", "C\nA"]
+
+def test_split_after_markers():
+    chunks = ["Intro. First part. Second part."]
+    operations = [{"op": "split", "id": ids_of(chunks)[0], "after": ["Intro.", "First part."]}]
+    assert replay_journal(chunks, operations) == ["Intro.", "First part.", "Second part."]
+
+def test_split_with_missing_marker_fails():
+    with pytest.raises(ValueError, match="not found"):
+        replay_journal(["Intro."], [{"op": "split", "id": ids_of(["Intro."])[0], "after": ["Missing"]}])
+
+def test_replace_and_delete():
+    a, b, a2, c = ids_of(BASE)
+    assert replay_journal(BASE, [{"op": "replace", "ids": [b], "texts": ["B1", "B2"]}]) == ["A", "B1", "B2", "A", "C"]
+    assert replay_journal(BASE, [{"op": "delete", "ids": [a, c]}]) == ["B", "A"]
+
+def test_repeated_texts_are_told_apart_by_occurrence():
+    a, b, a2, c = ids_of(BASE)
+    assert a != a2
+    assert replay_journal(BASE, [{"op": "delete", "ids": [a2]}]) == ["A", "B", "C"]
+
+def test_ids_match_the_chunk_store():
+    # Later operations refer to chunks created by earlier ones, by the ids the store gives them
+    merged = replay_journal(BASE, [{"op": "merge", "ids": ids_of(BASE)[1:3]}])
+    assert merged == ["A", "B A", "C"]
+    store_ids = [format_id(cid) for cid in ChunkStore.from_chunks(["A", "B", "A", "A"]).ids()]
+    operations = [
+        {"op": "replace", "ids": [ids_of(BASE)[3]], "texts": ["A"]},
+        {"op": "delete", "ids": [store_ids[3]]},
+    ]
+    assert replay_journal(BASE, operations) == ["A", "B", "A"]
+
+def test_operation_listing_a_chunk_twice_is_rejected():
+    a, b, a2, c = ids_of(BASE)
+    for operation in ({"op": "merge", "ids": [b, b]}, {"op": "delete", "ids": [a, a]},
+                      {"op": "replace", "ids": [c, c], "texts": ["D"]}):
+        with pytest.raises(ValueError, match="more than once"):
+            replay_journal(BASE, [operation])
+
+def test_unknown_ids_are_rejected():
+    a, b, a2, c = ids_of(BASE)
+    with pytest.raises(ValueError, match="unknown chunk"):
+        replay_journal(BASE, [{"op": "delete", "ids": [format_id(12345)]}])
+    # Gone after the first operation
+    with pytest.raises(ValueError, match="unknown chunk"):
+        replay_journal(BASE, [{"op": "delete", "ids": [b]}, {"op": "merge", "ids": [a, b]}])
+    with pytest.raises(ValueError, match="unknown op"):
+        replay_journal(BASE, [{"op": "shuffle", "ids": [a]}])
+
+def test_origins():
+    a, b, a2, c = ids_of(BASE)
+    operations = [{"op": "merge", "ids": [c, b]}, {"op": "delete", "ids": [a]}]
+    assert replay_journal(BASE, operations, return_origins=True) == (["C B", "A"], [1, 2])
+
+def test_apply_keeps_metadata_aligned(tmp_path, monkeypatch):
+    for name, filename in [("DOCUMENTS_PATH", "documents.pkl"), ("CHUNK_IDS_PATH", "chunk_ids.pkl"),
+                           ("METADATA_PATH", "document_metadata.pkl"), ("BASE_CHUNKS_PATH", "chunk_base.pkl"),
+                           ("BASE_METADATA_PATH", "chunk_base_metadata.pkl"),
+                           ("EMBEDDINGS_PATH", "document_embeddings.npy"), ("INDEX_PATH", "faiss_index.index"),
+                           ("SNAPSHOTS_DIR", "snapshots"), ("JOURNAL_PATH", "chunk_edits.json")]:
+        monkeypatch.setattr(chunk_journal, name, str(tmp_path / filename))
+    monkeypatch.setattr(chunk_journal, "fit_chunks_to_model", list)
+    monkeypatch.setattr(chunk_journal, "embedding_model_id", lambda: "test-model")
+    monkeypatch.setattr(chunk_journal, "embed_text", lambda texts: np.random.default_rng(len(texts)).standard_normal(
+        (len(texts), 8)).astype(np.float32))
+
+    texts = ["A", "B", "C", "D"]
+    ChunkStore.from_chunks(texts, [{"doc_id": doc} for doc in "wxyz"]).save(
+        chunk_journal.DOCUMENTS_PATH, chunk_journal.CHUNK_IDS_PATH, chunk_journal.METADATA_PATH)
+    a, b, c, d = ids_of(texts)
+    with open(chunk_journal.JOURNAL_PATH, "w", encoding="utf-8") as f:
+        f.write(f'[{{"op": "delete", "ids": ["{a}"]}}, {{"op": "merge", "ids": ["{d}", "{b}"]}}]')
+    chunk_journal.apply_journal(chunk_journal.JOURNAL_PATH)
+
+    store = ChunkStore.load(chunk_journal.DOCUMENTS_PATH, chunk_journal.CHUNK_IDS_PATH, chunk_journal.METADATA_PATH)
+    assert store.texts() == ["D B", "C"]
+    assert [store.metadata(cid) for cid in store.ids()] == [{"doc_id": "x"}, {"doc_id": "y"}]
+
+    # Replayed from the frozen base the second time, with the same result
+    chunk_journal.apply_journal(chunk_journal.JOURNAL_PATH)
+    store = ChunkStore.load(chunk_journal.DOCUMENTS_PATH, chunk_journal.CHUNK_IDS_PATH, chunk_journal.METADATA_PATH)
+    assert [store.metadata(cid) for cid in store.ids()] == [{"doc_id": "x"}, {"doc_id": "y"}]
@@ -0,0 +1,91 @@
+# tests/test_chunk_store.py
+#
+# Removing and upserting chunks by id must keep every chunk findable by its
+# own vector, for every kind of index build_index can produce.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts.chunk_store import ChunkStore, update_vectors, supports_removal
+from Scripts.index_builder import apply_search_params, build_index, unwrap_index
+
+DIMENSION = 32
+
+def random_vectors(count, seed):
+    vectors = np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def exhaustive(index):
+    # Probe every list / visit enough of the graph that misses can only come from wrong ids
+    apply_search_params(index, {"nprobe": 1 << 16, "efSearch": 512})
+    return index
+
+def assert_self_hits(index, store, vectors_by_id):
+    ids = store.ids()
+    assert index.ntotal == len(ids)
+    _, found = exhaustive(index).search(np.vstack([vectors_by_id[cid] for cid in ids]), 1)
+    assert found[:, 0].tolist() == ids
+
+@pytest.mark.parametrize("policy", ["flat", "ivf-flat", "IVF16,Flat", "hnsw"])
+def test_remove_and_upsert_keep_self_hits(policy):
+    vectors = random_vectors(2000, seed=0)
+    ids = list(range(1000, 3000))
+    store = ChunkStore(ids, [f"chunk {cid}" for cid in ids])
+    index, params = build_index(vectors, policy, ids=ids)
+    vectors_by_id = dict(zip(ids, vectors))
+    assert_self_hits(index, store, vectors_by_id)
+
+    # Remove a quarter of the chunks
+    index, params = update_vectors(index, store, remove_ids=ids[:500], params=params)
+    for cid in ids[:500]:
+        del vectors_by_id[cid]
+    assert_self_hits(index, store, vectors_by_id)
+
+    # Replace some chunks and add new ones
+    upserted = ids[500:600] + list(range(5000, 5100))
+    new_vectors = random_vectors(len(upserted), seed=1)
+    index, params = update_vectors(index, store, upserted, [f"new {cid}" for cid in upserted], new_vectors,
+                                   params=params)
+    vectors_by_id.update(zip(upserted, new_vectors))
+    assert_self_hits(index, store, vectors_by_id)
+    assert store[5000] == "new 5000"
+    assert params["count"] == index.ntotal
+
+def test_rebuild_keeps_factory_and_search_params():
+    vectors = random_vectors(2000, seed=0)
+    ids = list(range(1000, 3000))
+    store = ChunkStore(ids, [f"chunk {cid}" for cid in ids])
+    index, params = build_index(vectors, "HNSW64,Flat", ids=ids)
+    # Tuned on the live index after loading
+    unwrap_index(index).hnsw.efSearch = 200
+
+    index, params = update_vectors(index, store, remove_ids=ids[:10], params=params)
+    assert params["factory"] == "HNSW64,Flat"
+    assert params["efSearch"] == 200
+    assert unwrap_index(index).hnsw.efSearch == 200
+    # Neighbours per node on the bottom layer are 2 * M
+    assert unwrap_index(index).hnsw.nb_neighbors(0) == 128
+    assert_self_hits(index, store, dict(zip(ids[10:], vectors[10:])))
+
+def test_legacy_id_map_around_ivf_is_rebuilt():
+    vectors = random_vectors(2000, seed=0)
+    ids = list(range(1000, 3000))
+    base, _ = build_index(vectors, "IVF16,Flat")
+    base.reset()
+    legacy = faiss.IndexIDMap2(base)
+    legacy.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    assert not supports_removal(legacy)
+
+    store = ChunkStore(ids, [f"chunk {cid}" for cid in ids])
+    index, _ = update_vectors(legacy, store, remove_ids=ids[:500])
+    assert supports_removal(index)
+    assert_self_hits(index, store, dict(zip(ids[500:], vectors[500:])))
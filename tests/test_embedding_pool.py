@@ -0,0 +1,42 @@
+# tests/test_embedding_pool.py
+#
+# The embedding pool spawns its workers, and spawned workers re-import the
+# __main__ module of the process that started them. An entry point that
+# imports main.py must still be able to embed with several workers.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("together")
+huggingface_hub = pytest.importorskip("huggingface_hub")
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+
+from Scripts.utils import EMBEDDING_MODEL_NAME
+
+ENTRY_POINT = f"""
+import sys
+sys.path.insert(0, {PROJECT_DIR!r})
+import main
+
+if __name__ == "__main__":
+    embeddings = main.embed_corpus(["contrast", "gadolinium", "metformin", "eGFR"], workers=2)
+    print(embeddings.shape, embeddings.dtype)
+"""
+
+def test_embed_with_two_workers_from_an_entry_point(tmp_path):
+    if not isinstance(huggingface_hub.try_to_load_from_cache(EMBEDDING_MODEL_NAME, "config.json"), str):
+        pytest.skip(f"{EMBEDDING_MODEL_NAME} is not downloaded")
+    script = tmp_path / "entry_point.py"
+    script.write_text(ENTRY_POINT)
+    env = dict(os.environ, TOGETHER_API_KEY=os.environ.get("TOGETHER_API_KEY", "test"))
+    result = subprocess.run([sys.executable, str(script)], env=env, capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.split("\n")[-2] == "(4, 768) float32"
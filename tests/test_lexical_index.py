@@ -0,0 +1,26 @@
+# tests/test_lexical_index.py
+#
+# Weighted fusion must let a lexical hit count even when it is the only one.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts.lexical_index import fuse_rankings
+
+def test_single_lexical_hit_counts_in_weighted_fusion():
+    ids, scores = fuse_rankings([1, 2, 3], [.9, .8, .7], [3], [2.0], 3, "weighted")
+    assert ids[0] == 3
+    assert scores[0] == pytest.approx(0.5 * 0.7 / 0.9 + 0.5)
+
+def test_weighted_fusion_scales_by_the_best_score():
+    ids, scores = fuse_rankings([1, 2], [.8, .4], [2, 1], [4.0, 1.0], 2, "weighted", lexical_weight=0.5)
+    assert ids == [2, 1]
+    assert scores == pytest.approx([0.5 * 0.5 + 0.5, 0.5 + 0.5 * 0.25])
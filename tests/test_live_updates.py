@@ -0,0 +1,102 @@
+# tests/test_live_updates.py
+#
+# Embedding nothing returns an empty matrix of the model's width, and the
+# live index can be changed with upsert_chunks/delete_chunks while other
+# threads search it.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts import utils
+from Scripts.chunk_store import ChunkStore
+from Scripts.embedding_cache import EmbeddingCache
+from Scripts.embedding_pool import encode_in_pool
+from Scripts.index_builder import build_index
+
+DIMENSION = 16
+
+class FakeModel:
+    # Deterministic vectors per text, without loading a real model
+    def get_sentence_embedding_dimension(self):
+        return DIMENSION
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        return np.vstack([
+            np.random.default_rng(abs(hash(text)) % 2**32).standard_normal(DIMENSION)
+            for text in texts
+        ]).astype(np.float32)
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    monkeypatch.setattr(utils, "_embedding_model", FakeModel())
+    monkeypatch.setattr(utils, "embedding_cache", None)
+
+def serve_chunks(monkeypatch, count):
+    # Set up the globals main.py would set, restored after the test
+    texts = [f"chunk {n}" for n in range(count)]
+    store = ChunkStore.from_chunks(texts)
+    index, params = build_index(utils.embed_text(texts), "flat", ids=store.ids())
+    monkeypatch.setattr(utils, "documents", store)
+    monkeypatch.setattr(utils, "index", index)
+    monkeypatch.setattr(utils, "index_params", params)
+    monkeypatch.setattr(utils, "lexical_index", None)
+    return store, index
+
+def test_empty_input_embeds_to_an_empty_matrix(fake_model, tmp_path):
+    for cache in (None, EmbeddingCache(str(tmp_path / "cache.sqlite"))):
+        utils.set_embedding_cache(cache)
+        embeddings = utils.embed_text([])
+        assert embeddings.shape == (0, DIMENSION) and embeddings.dtype == np.float32
+    assert encode_in_pool([], workers=2).shape == (0, DIMENSION)
+
+def test_searches_during_upserts_and_deletes(fake_model, monkeypatch):
+    serve_chunks(monkeypatch, 500)
+
+    failures = []
+    done = threading.Event()
+
+    def search():
+        while not done.is_set():
+            for chunks, ids, _ in utils.retrieve_documents_batch(["chunk 1", "chunk 2"], k=5):
+                # retrieve_documents_batch logs errors and returns nothing
+                if len(ids) != 5 or len(chunks) != 5:
+                    failures.append(ids)
+
+    searchers = [threading.Thread(target=search) for _ in range(4)]
+    for thread in searchers:
+        thread.start()
+    try:
+        for round_ in range(20):
+            new_texts = [f"new chunk {round_} {n}" for n in range(20)]
+            new_ids = utils.upsert_chunks(new_texts)
+            utils.delete_chunks(new_ids[:10])
+    finally:
+        done.set()
+        for thread in searchers:
+            thread.join()
+
+    assert not failures
+    assert len(utils.documents) == 500 + 20 * 10 == utils.index.ntotal
+
+def test_delete_waits_for_running_searches(fake_model, monkeypatch):
+    store, index = serve_chunks(monkeypatch, 50)
+
+    # Hold the lock the way a search in progress does
+    with utils._corpus_lock.reading():
+        deleter = threading.Thread(target=utils.delete_chunks, args=(store.ids()[:10],))
+        deleter.start()
+        deleter.join(timeout=0.2)
+        assert deleter.is_alive()
+        assert index.ntotal == len(store) == 50
+    deleter.join(timeout=5)
+    assert utils.index.ntotal == len(utils.documents) == 40
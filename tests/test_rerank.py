@@ -0,0 +1,50 @@
+# tests/test_rerank.py
+#
+# The rerank budget: a request that runs out of time with batches still to
+# score keeps the retrieval order, but scores that are all in are used.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts import rerank
+
+class SlowCrossEncoder:
+    # Scores candidates in reverse retrieval order, taking 20 ms per batch
+    def predict(self, pairs, batch_size, convert_to_numpy):
+        time.sleep(0.02)
+        return np.asarray([float(chunk[1:]) for _, chunk in pairs], dtype=np.float32)
+
+@pytest.fixture(autouse=True)
+def slow_reranker(monkeypatch):
+    monkeypatch.setattr(rerank, "_reranker", SlowCrossEncoder())
+    rerank.score_cache.clear()
+
+def candidates(count):
+    return [f"c{pos}" for pos in range(count)], list(range(count)), [1.0 - pos / 100 for pos in range(count)]
+
+def test_single_batch_over_budget_is_still_used():
+    chunks, ids, distances = candidates(rerank.RERANK_BATCH_SIZE)
+    _, kept, _ = rerank.rerank("question", chunks, ids, distances, 3, budget_ms=1)
+    assert kept == [15, 14, 13]
+
+def test_over_budget_with_batches_left_keeps_the_retrieval_order():
+    chunks, ids, distances = candidates(3 * rerank.RERANK_BATCH_SIZE)
+    over_budget = rerank.get_rerank_stats()["over_budget"]
+    _, kept, _ = rerank.rerank("question", chunks, ids, distances, 3, budget_ms=1)
+    assert kept == [0, 1, 2]
+    assert rerank.get_rerank_stats()["over_budget"] == over_budget + 1
+
+def test_within_budget_reranks():
+    chunks, ids, distances = candidates(3 * rerank.RERANK_BATCH_SIZE)
+    _, kept, kept_distances = rerank.rerank("question", chunks, ids, distances, 2, budget_ms=None)
+    assert kept == [47, 46]
+    assert kept_distances == [distances[47], distances[46]]
@@ -0,0 +1,64 @@
+# tests/test_snapshot.py
+#
+# Snapshots written back to back must each get their own id, a failed write
+# must not leave its temporary directory behind, and loose embeddings must
+# say which model produced them.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts.chunk_store import ChunkStore
+from Scripts.index_builder import build_index
+from Scripts.embedding_store import save_embedding_matrix
+from Scripts.snapshot import list_snapshots, load_snapshot, loose_embeddings_model, write_snapshot
+
+MODEL_NAME = "test-model"
+
+def snapshot_inputs():
+    vectors = np.random.default_rng(0).standard_normal((20, 8)).astype(np.float32)
+    ids = list(range(20))
+    index, params = build_index(vectors, "flat", ids=ids)
+    return ChunkStore(ids, [f"chunk {cid}" for cid in ids]), vectors, index, params
+
+def test_same_content_written_twice_gets_two_snapshots(tmp_path):
+    store, vectors, index, params = snapshot_inputs()
+    first = write_snapshot(str(tmp_path), store, vectors, index, params, MODEL_NAME)
+    second = write_snapshot(str(tmp_path), store, vectors, index, params, MODEL_NAME)
+    assert first != second
+    assert list_snapshots(str(tmp_path)) == [first, second]
+    assert load_snapshot(str(tmp_path), model_name=MODEL_NAME).snapshot_id == second
+
+def test_failed_write_leaves_nothing_behind(tmp_path, monkeypatch):
+    store, vectors, index, params = snapshot_inputs()
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(faiss, "write_index", fail)
+    with pytest.raises(OSError):
+        write_snapshot(str(tmp_path), store, vectors, index, params, MODEL_NAME)
+    assert os.listdir(tmp_path) == []
+
+def test_loose_embeddings_model(tmp_path):
+    store, vectors, index, params = snapshot_inputs()
+    embeddings_path = str(tmp_path / "document_embeddings.npy")
+    snapshots_dir = str(tmp_path / "snapshots")
+
+    # Recorded with the matrix
+    save_embedding_matrix(embeddings_path, vectors, model_name="other-model")
+    assert loose_embeddings_model(embeddings_path, snapshots_dir) == "other-model"
+
+    # Saved before the model was recorded: unknown, until a snapshot was built from it
+    save_embedding_matrix(embeddings_path, vectors)
+    assert loose_embeddings_model(embeddings_path, snapshots_dir) is None
+    write_snapshot(snapshots_dir, store, vectors, index, params, MODEL_NAME)
+    assert loose_embeddings_model(embeddings_path, snapshots_dir) == MODEL_NAME
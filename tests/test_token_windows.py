@@ -0,0 +1,58 @@
+# tests/test_token_windows.py
+#
+# Token-aware chunking: long sections are cut into overlapping windows that
+# repeat the headline, and an overlap that would leave windows barely moving
+# on is rejected.
+#
+#   python -m pytest -q tests
+
+import os
+import re
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scripts import utils
+
+class WordTokenizer:
+    # One token per word, with the offsets a fast tokenizer returns
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        offsets = [[match.span() for match in re.finditer(r"\S+", text)] for text in texts]
+        return {"input_ids": [list(range(len(spans))) for spans in offsets], "offset_mapping": offsets}
+
+class FakeModel:
+    tokenizer = WordTokenizer()
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(utils, "_embedding_model", FakeModel())
+
+def section(words):
+    return "Heading\n" + " ".join(f"w{n}" for n in range(words))
+
+def test_long_section_is_split_with_overlap_and_headline():
+    windows = utils.split_sections_by_tokens([section(40)], max_tokens=20, overlap=5)
+
+    assert windows[0].split() == ["Heading"] + [f"w{n}" for n in range(19)]
+    # Continuation windows repeat the headline and start `overlap` tokens back
+    assert windows[1].split()[:2] == ["Heading", "w14"]
+    assert all(len(window.split()) <= 20 for window in windows)
+    assert windows[-1].endswith("w39")
+
+def test_short_section_is_kept():
+    assert utils.split_sections_by_tokens([section(5)], max_tokens=20, overlap=5) == [section(5)]
+
+@pytest.mark.parametrize("overlap", [-1, 8, 19])
+def test_overlap_must_leave_windows_moving_on(overlap):
+    # 20 tokens, up to 5 of them a repeated headline: at most 7 may overlap
+    with pytest.raises(ValueError):
+        utils.split_sections_by_tokens([section(40)], max_tokens=20, overlap=overlap)
+
+def test_largest_overlap_still_advances_half_a_window():
+    windows = utils.split_sections_by_tokens([section(200)], max_tokens=20, overlap=7)
+    starts = [int(window.split("\n")[-1].split()[0][1:]) for window in windows[1:]]
+    assert all(later - earlier >= 7 for earlier, later in zip(starts, starts[1:]))